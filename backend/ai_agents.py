@@ -1,57 +1,146 @@
 import asyncio
-from typing import List, Dict, Any
-import anthropic
-from openai import OpenAI
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
 import os
 from dotenv import load_dotenv
 import json
 
+from json_stream import ParseResult, parse_json_document, validate_sitemap_page
+from llm_cache import LLM_CACHE_ENABLED, LLMCache
+from llm_providers import AnthropicProvider, Completion, JSONSchema, LLMProvider, OpenAIProvider
+from mermaid_parser import MermaidSyntaxError, normalize_flowchart
+from prompt_builder import compact_json, count_tokens, fit_sitemap
+from provider_router import ProviderRouter, request_queued, request_sent
+from rate_limiter import RateLimiters, estimate_tokens
+from schemas import SITEMAP_SCHEMA, StructuredOutputError, validate_sitemap
+from streaming import ArtifactStream, MermaidStream, SitemapStream
+from structured_log import get_logger, record_raw_response
+
 load_dotenv()
 
+# Stream tokens from the providers and publish partial artifacts while they generate
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() in ("1", "true", "yes")
+
+# Ask providers for schema-constrained JSON where a response has a schema
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "true").lower() in ("1", "true", "yes")
+# Repair round-trips for a response that fails its schema before giving up
+SCHEMA_REPAIR_ATTEMPTS = int(os.getenv("SCHEMA_REPAIR_ATTEMPTS", "1"))
+# Repair round-trips for a Mermaid diagram that fails to parse before giving up
+DIAGRAM_REPAIR_ATTEMPTS = int(os.getenv("DIAGRAM_REPAIR_ATTEMPTS", "1"))
+
+PROVIDER_LABELS = {"openai": "OpenAI GPT-4.1", "anthropic": "Claude AI"}
+
+log = get_logger("ai_agents")
+
+def best_rated(ratings: List[Dict[str, Any]]) -> int:
+    """Index of the highest rated artifact, 0 without ratings"""
+    if not ratings:
+        return 0
+    return max(ratings, key=lambda rating: rating.get("overall_score", 0)).get("index", 0)
+
 class AIAgents:
     def __init__(self):
-        # Initialize OpenAI client (primary)
+        # Initialize OpenAI provider (primary)
         openai_key = os.getenv("OPENAI_API_KEY")
         if openai_key:
-            print(f"Initializing AI Agents with OpenAI API key: {openai_key[:10]}...{openai_key[-4:]}")
-            self.openai_client = OpenAI(api_key=openai_key)
+            log.info("Initializing OpenAI provider", key=f"{openai_key[:10]}...{openai_key[-4:]}")
+            self.openai_provider = OpenAIProvider(api_key=openai_key)
             self.use_openai = True
         else:
-            print("No OpenAI API key found, will use Anthropic only")
-            self.openai_client = None
+            log.info("No OpenAI API key found, will use Anthropic only")
+            self.openai_provider = None
             self.use_openai = False
         
-        # Initialize Anthropic client (fallback)
+        # Initialize Anthropic provider (fallback)
         anthropic_key = os.getenv("ANTHROPIC_API_KEY")
         if anthropic_key:
-            print(f"Initializing Anthropic fallback with API key: {anthropic_key[:10]}...{anthropic_key[-4:]}")
-            self.anthropic_client = anthropic.Anthropic(api_key=anthropic_key)
+            log.info("Initializing Anthropic fallback", key=f"{anthropic_key[:10]}...{anthropic_key[-4:]}")
+            self.anthropic_provider = AnthropicProvider(api_key=anthropic_key)
         else:
-            print("No Anthropic API key found")
-            self.anthropic_client = None
+            log.info("No Anthropic API key found")
+            self.anthropic_provider = None
+        
+        # Response cache shared by all providers (None disables caching)
+        self.cache = LLMCache() if LLM_CACHE_ENABLED else None
+        # Circuit breakers, fallback and hedging across the providers
+        self.router = ProviderRouter()
+        # Concurrency, RPM/TPM budgets and Retry-After handling per provider/model
+        self.limiters = RateLimiters()
             
+        self.streaming = LLM_STREAMING
+        self.structured_output = LLM_STRUCTURED_OUTPUT
         self.progress_callback = None
+        self.artifact_callback = None
+        self.latency_recorder = None
+        self.usage_recorder = None
+        
+    async def aclose(self):
+        """Close the pooled provider connections and the response cache"""
+        for provider in (self.openai_provider, self.anthropic_provider):
+            if provider:
+                await provider.aclose()
+        if self.cache:
+            self.cache.close()
         
     def set_progress_callback(self, callback):
         """Set callback function for progress updates"""
         self.progress_callback = callback
         
-    async def _send_progress(self, project_id: str, step: str, message: str, progress: int):
-        """Send progress update if callback is set"""
+    def set_artifact_callback(self, callback):
+        """Set callback receiving (project_id, artifact, index, content, complete)"""
+        self.artifact_callback = callback
+        
+    def set_latency_recorder(self, recorder):
+        """Set callback receiving (key, seconds) for every completed provider call"""
+        self.latency_recorder = recorder
+        
+    def set_usage_recorder(self, recorder):
+        """Set callback receiving (project_id, task, completion) for every answered request"""
+        self.usage_recorder = recorder
+        
+    async def _send_progress(self, project_id: str, step: str, message: str):
+        """Send progress update if callback is set; the callback derives the percentage"""
         if self.progress_callback:
-            await self.progress_callback(project_id, step, message, progress)
-        
-    async def generate_site_maps(self, project_description: str, count: int = 1, project_id: str = None) -> List[Dict[str, Any]]:
-        """Generate multiple site map options using sub-agents"""
-        print(f"\n{'='*60}")
-        print(f"GENERATING SITE MAPS")
-        print(f"Project Description: {project_description[:100]}...")
-        print(f"Count: {count}")
-        print(f"{'='*60}\n")
-        
-        results = []
-        for i in range(count):
-            system_prompt = """As a web architecture specialist, create a comprehensive site map for projects.
+            await self.progress_callback(project_id, step, message)
+            
+    async def _send_artifact(self, project_id: str, artifact: str, index: int, content: Any, complete: bool):
+        """Publish a partial or final artifact if callback is set"""
+        if self.artifact_callback and project_id:
+            await self.artifact_callback(project_id, artifact, index, content, complete)
+            
+    def _artifact_stream(self, stream_class, project_id: str, artifact: str, index: int):
+        """Stream handler publishing partial snapshots of one artifact, or None when not streaming"""
+        if not (self.streaming and project_id and self.artifact_callback):
+            return None
+        
+        async def emit(content):
+            await self._send_artifact(project_id, artifact, index, content, False)
+        return stream_class(emit)
+        
+    async def generate_site_maps(self, project_description: str, count: int = 1, project_id: str = None, use_cache: bool = True,
+                                 seed_site_map: Dict[str, Any] = None, indices: List[int] = None) -> List[Dict[str, Any]]:
+        """Generate multiple site map options using concurrent sub-agents
+        
+        ``indices`` picks which of the ``count`` options to generate (default all),
+        e.g. to regenerate a single one; results come back in that order.
+        """
+        log.info("Generating site maps", project_id=project_id, count=count, description=project_description[:100])
+        parsed_results = await asyncio.gather(*self.site_map_candidates(
+            project_description, count, project_id, use_cache, seed_site_map, indices
+        ))
+        log.info("Site maps generated", project_id=project_id, count=len(parsed_results))
+        return list(parsed_results)
+    
+    def site_map_candidates(self, project_description: str, count: int = 1, project_id: str = None, use_cache: bool = True,
+                            seed_site_map: Dict[str, Any] = None, indices: List[int] = None) -> List[Awaitable[Dict[str, Any]]]:
+        """One coroutine per sitemap option, each yielding its parsed sitemap"""
+        positions = list(range(count)) if indices is None else list(indices)
+        return [self._site_map_candidate(project_description, i, count, project_id, use_cache, seed_site_map)
+                for i in positions]
+    
+    async def _site_map_candidate(self, project_description: str, i: int, count: int, project_id: str, use_cache: bool,
+                                  seed_site_map: Dict[str, Any]) -> Dict[str, Any]:
+        system_prompt = """As a web architecture specialist, create a comprehensive site map for projects.
 
 Create a site map with 5-8 main pages. For each page include:
 - name (string)
@@ -72,97 +161,134 @@ Return ONLY valid JSON, no additional text. Example structure:
     }
   ]
 }"""
-            
-            user_prompt = f"Create a comprehensive site map for the following project:\n\n{project_description}"
-            await self._send_progress(project_id, "sitemap", f"Preparing sitemap generation {i+1} of {count}...", 25 + (i * 10))
-            await asyncio.sleep(0.3)
-            await self._send_progress(project_id, "sitemap", f"Analyzing project requirements for sitemap structure...", 25 + (i * 10) + 2)
-            print(f"\nGenerating sitemap {i+1} of {count}...")
-            prompt = f"{system_prompt}\n\n{user_prompt}"
-            result = await self._generate_with_model(prompt, project_id, f"Sitemap {i+1}/{count}")
-            await self._send_progress(project_id, "sitemap", f"Processing sitemap response {i+1}/{count}...", 25 + (i * 10) + 8)
-            results.append(result)
-        parsed_results = []
-        
-        # Save raw results to log file
-        import datetime
-        import os
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # Create logs directory if it doesn't exist
-        log_dir = os.path.join(os.path.dirname(__file__), "logs")
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-            print(f"Created logs directory: {log_dir}")
-            
-        log_file = os.path.join(log_dir, f"sitemap_generation_{timestamp}.log")
         
-        with open(log_file, 'w') as f:
-            f.write(f"Sitemap Generation Log - {timestamp}\n")
-            f.write(f"Project Description: {project_description}\n")
-            f.write(f"{'='*80}\n\n")
-            
-            for i, r in enumerate(results):
-                await self._send_progress(project_id, "sitemap", f"Validating sitemap {i+1} structure and content...", 35 + (i * 5))
-                
-                print(f"\n--- Result {i+1} ---")
-                print(f"Raw response length: {len(r) if r else 0}")
-                print(f"First 200 chars: {r[:200] if r else 'EMPTY'}")
-                
-                f.write(f"Result {i+1}:\n")
-                f.write(f"Raw response: {r}\n")
-                f.write(f"{'='*80}\n\n")
-                
-                await self._send_progress(project_id, "sitemap", f"Parsing JSON response for sitemap {i+1}...", 38 + (i * 5))
-                parsed = self._parse_json_response(r)
-                
-                # If parsing failed or result is empty, create a default sitemap
-                if not parsed or not isinstance(parsed, dict) or 'pages' not in parsed:
-                    await self._send_progress(project_id, "sitemap", f"Sitemap {i+1} parsing failed, using fallback structure...", 40 + (i * 5))
-                    print(f"WARNING: Failed to parse sitemap {i+1} or empty result, using fallback")
-                    print(f"Parsed result: {parsed}")
-                    f.write(f"PARSING FAILED - Using fallback\n")
-                    f.write(f"Parsed result: {parsed}\n\n")
-                    
-                    parsed = {
-                        "pages": [
-                            {
-                                "name": "Home",
-                                "path": "/",
-                                "description": "Main landing page",
-                                "features": ["Welcome message", "Navigation menu", "Call to action"],
-                                "children": []
-                            }
-                        ]
-                    }
-                else:
-                    await self._send_progress(project_id, "sitemap", f"Sitemap {i+1} validated: {len(parsed.get('pages', []))} pages created", 42 + (i * 5))
-                    print(f"SUCCESS: Parsed sitemap {i+1} with {len(parsed.get('pages', []))} pages")
-                    f.write(f"PARSING SUCCESS\n")
-                    f.write(f"Number of pages: {len(parsed.get('pages', []))}\n\n")
-                
-                parsed_results.append(parsed)
+        user_prompt = f"Create a comprehensive site map for the following project:\n\n{project_description}"
+        if seed_site_map:
+            # A very similar project already exists; let the model adapt its sitemap
+            user_prompt += f"\n\nA sitemap from a very similar project is below. Adapt it to this project rather than starting from scratch:\n{compact_json(seed_site_map)}"
+        await self._send_progress(project_id, "sitemap", f"Preparing sitemap generation {i+1} of {count}...")
+        await self._send_progress(project_id, "sitemap", f"Analyzing project requirements for sitemap structure...")
+        prompt = f"{system_prompt}\n\n{user_prompt}"
+        # Candidates share one prompt, so key each on its index to keep them distinct
+        stream = self._artifact_stream(SitemapStream, project_id, "site_maps", i)
+        r = await self._generate_with_model(prompt, project_id, f"Sitemap {i+1}/{count}", use_cache=use_cache,
+                                            cache_variant=i, stream_handler=stream, task="sitemap", schema=SITEMAP_SCHEMA,
+                                            validate=self._sitemap_is_valid)
+        await self._send_progress(project_id, "sitemap", f"Processing sitemap response {i+1}/{count}...")
         
-        print(f"\n{'='*60}")
-        print(f"SITEMAP GENERATION COMPLETE")
-        print(f"Log saved to: {log_file}")
-        print(f"{'='*60}\n")
+        await self._send_progress(project_id, "sitemap", f"Validating sitemap {i+1} structure and content...")
+        log.debug("Sitemap response", project_id=project_id, candidate=i + 1, length=len(r) if r else 0, preview=(r or "")[:200])
         
-        return parsed_results
+        await self._send_progress(project_id, "sitemap", f"Parsing JSON response for sitemap {i+1}...")
+        parsed, errors, parse_result = self._check_sitemap(r)
+        for _ in range(SCHEMA_REPAIR_ATTEMPTS):
+            if parsed is not None or not r:
+                break
+            await self._send_progress(project_id, "sitemap", f"Sitemap {i+1} failed validation ({len(errors)} errors), requesting a repair...")
+            log.warning("Sitemap failed validation", project_id=project_id, candidate=i + 1, errors=errors)
+            repaired = await self._repair_json(r, errors, SITEMAP_SCHEMA, project_id, f"Sitemap {i+1}/{count} repair",
+                                               use_cache=use_cache, cache_variant=i, validate=self._sitemap_is_valid)
+            if not repaired:
+                break
+            r = repaired
+            parsed, errors, parse_result = self._check_sitemap(r)
+        
+        if parsed is None:
+            # Keep the pages that did validate; only a sitemap without any is an error
+            pages = parse_result.data.get("pages") if isinstance(parse_result.data, dict) else None
+            if not pages:
+                await self._send_progress(project_id, "sitemap", f"Sitemap {i+1} could not be generated: {len(errors)} validation errors")
+                log.error("Sitemap could not be generated", project_id=project_id, candidate=i + 1, errors=errors)
+                raise StructuredOutputError(f"Sitemap {i+1} did not match the sitemap schema", errors)
+            parsed, _ = validate_sitemap({"pages": pages})
+        
+        if parse_result.rejected:
+            log.warning("Dropped invalid sitemap pages", project_id=project_id, candidate=i + 1, rejected=parse_result.rejected)
+        if parse_result.salvaged:
+            names = ", ".join(page["name"] for page in parse_result.salvaged)
+            await self._send_progress(project_id, "sitemap", f"Sitemap {i+1} was cut off; salvaged {len(parse_result.salvaged)} complete pages: {names}")
+            log.warning("Sitemap was incomplete, salvaged pages", project_id=project_id, candidate=i + 1, pages=names)
+        
+        await self._send_progress(project_id, "sitemap", f"Sitemap {i+1} validated: {len(parsed.get('pages', []))} pages created")
+        log.info("Sitemap parsed", project_id=project_id, candidate=i + 1, pages=len(parsed.get("pages", [])))
+        
+        await self._send_artifact(project_id, "site_maps", i, parsed, True)
+        return parsed
+    
+    def _check_sitemap(self, response: str) -> Tuple[Dict[str, Any], List[str], ParseResult]:
+        """Validate a sitemap response
+        
+        Returns the normalized sitemap (None if it needs repair), the schema
+        errors and the parse result. A truncated response is not repairable,
+        so its salvaged pages count as the sitemap.
+        """
+        if not response:
+            return None, ["no response was received"], ParseResult()
+        parse_result = parse_json_document(response, "pages", validate_sitemap_page)
+        if parse_result.data is None:
+            return None, ["the response does not contain a JSON object"], parse_result
+        parsed, errors = validate_sitemap(parse_result.data)
+        if parse_result.complete:
+            # The parser already dropped invalid pages; they need repairing too
+            errors = [f"pages[{index}]: {reason}" for index, reason in parse_result.rejected] + errors
+            if errors:
+                parsed = None
+        return parsed, errors, parse_result
     
-    async def generate_mermaid_diagrams(self, project_description: str, site_map: Dict, count: int = 1, project_id: str = None) -> List[str]:
-        """Generate multiple Mermaid diagram options for frontend architecture"""
-        await self._send_progress(project_id, "architecture", "Initializing frontend architecture design...", 55)
-        await asyncio.sleep(0.2)
-        await self._send_progress(project_id, "architecture", "Analyzing sitemap structure for component hierarchy...", 57)
-        
-        tasks = []
-        for i in range(count):
-            await self._send_progress(project_id, "architecture", f"Preparing architecture diagram {i+1}/{count}...", 58 + (i * 5))
-            prompt = f"""As a frontend architecture expert (Agent {i+1}), create a Mermaid diagram for:
+    def _sitemap_is_valid(self, response: str) -> bool:
+        return self._check_sitemap(response)[0] is not None
+    
+    async def _repair_json(self, response: str, errors: List[str], schema: JSONSchema, project_id: str = None,
+                           step_description: str = "Repair", use_cache: bool = True, cache_variant: Any = None,
+                           validate: Callable[[str], bool] = None) -> str:
+        """Ask for a corrected version of a JSON response, given only its validation errors
+        
+        Much cheaper than regenerating: the prompt is the response and its
+        errors rather than the original instructions.
+        """
+        error_list = "\n".join(f"- {error}" for error in errors)
+        prompt = f"""As a JSON repair tool, fix JSON documents so that they pass validation.
+
+Change only what the validation errors require and keep everything else as it is.
+
+Validation errors:
+{error_list}
+
+Document:
+{response}
+
+Return ONLY the corrected JSON, no additional text."""
+        
+        return await self._generate_with_model(prompt, project_id, step_description, use_cache=use_cache,
+                                               cache_variant=cache_variant, task="repair", schema=schema,
+                                               validate=validate)
+    
+    async def generate_mermaid_diagrams(self, project_description: str, site_map: Dict, count: int = 1, project_id: str = None, use_cache: bool = True,
+                                        indices: List[int] = None) -> List[str]:
+        """Generate multiple Mermaid diagram options for frontend architecture (``indices`` as for sitemaps)"""
+        await self._send_progress(project_id, "architecture", "Initializing frontend architecture design...")
+        await self._send_progress(project_id, "architecture", "Analyzing sitemap structure for component hierarchy...")
+        candidates = self.mermaid_diagram_candidates(project_description, site_map, count, project_id, use_cache, indices)
+        await self._send_progress(project_id, "architecture", f"Generating {len(candidates)} frontend architecture diagram(s)...")
+        results = await asyncio.gather(*candidates)
+        await self._send_progress(project_id, "architecture", "Frontend architecture diagrams complete!")
+        return list(results)
+    
+    def mermaid_diagram_candidates(self, project_description: str, site_map: Dict, count: int = 1, project_id: str = None,
+                                   use_cache: bool = True, indices: List[int] = None) -> List[Awaitable[str]]:
+        """One coroutine per frontend diagram option, each yielding its cleaned diagram"""
+        positions = list(range(count)) if indices is None else list(indices)
+        return [self._mermaid_diagram_candidate(project_description, site_map, i, count, project_id, use_cache)
+                for i in positions]
+    
+    async def _mermaid_diagram_candidate(self, project_description: str, site_map: Dict, i: int, count: int,
+                                         project_id: str, use_cache: bool) -> str:
+        await self._send_progress(project_id, "architecture", f"Preparing architecture diagram {i+1}/{count}...")
+        prompt = f"""As a frontend architecture expert (Agent {i+1}), create a Mermaid diagram for:
             
 Project: {project_description}
-Site Map: {json.dumps(site_map, indent=2)}
+Site Map (one page per line, nesting shows child pages):
+{fit_sitemap(site_map)}
 
 Focus on: {"component hierarchy" if i == 0 else "data flow" if i == 1 else "user interactions"}
 
@@ -183,30 +309,36 @@ IMPORTANT:
 - Do NOT use any colors - everything should be black and white only
 - Style example: A[Component]:::blackBox
 - classDef blackBox fill:#000,stroke:#fff,stroke-width:2px,color:#fff"""
-            tasks.append(self._generate_with_model(prompt, project_id, f"Frontend Diagram {i+1}/{count}"))
-        
-        await self._send_progress(project_id, "architecture", f"Generating {count} frontend architecture diagram(s)...", 60)
-        results = await asyncio.gather(*tasks)
-        
-        await self._send_progress(project_id, "architecture", "Processing and cleaning Mermaid diagrams...", 68)
-        cleaned_results = []
-        for i, r in enumerate(results):
-            await self._send_progress(project_id, "architecture", f"Cleaning diagram {i+1}/{count}...", 69 + i)
-            cleaned_results.append(self._clean_mermaid_diagram(r))
-        
-        await self._send_progress(project_id, "architecture", "Frontend architecture diagrams complete!", 72)
-        return cleaned_results
+        stream = self._artifact_stream(MermaidStream, project_id, "mermaid_diagrams", i)
+        r = await self._generate_with_model(prompt, project_id, f"Frontend Diagram {i+1}/{count}", use_cache=use_cache,
+                                            stream_handler=stream, task="frontend", validate=self._diagram_is_valid)
+        await self._send_progress(project_id, "architecture", f"Cleaning diagram {i+1}/{count}...")
+        cleaned = await self._validated_diagram(self._clean_mermaid_diagram(r), project_id, "architecture",
+                                                f"Frontend Diagram {i+1}/{count}", use_cache)
+        await self._send_artifact(project_id, "mermaid_diagrams", i, cleaned, True)
+        return cleaned
+    
+    async def generate_backend_diagrams(self, project_description: str, count: int = 1, project_id: str = None, use_cache: bool = True,
+                                        indices: List[int] = None) -> List[str]:
+        """Generate multiple backend architecture diagrams (``indices`` as for sitemaps)"""
+        await self._send_progress(project_id, "backend", "Initializing backend architecture design...")
+        await self._send_progress(project_id, "backend", "Analyzing data flow and API requirements...")
+        candidates = self.backend_diagram_candidates(project_description, count, project_id, use_cache, indices)
+        await self._send_progress(project_id, "backend", f"Generating {len(candidates)} backend architecture diagram(s)...")
+        results = await asyncio.gather(*candidates)
+        await self._send_progress(project_id, "backend", "Backend architecture diagrams complete!")
+        return list(results)
     
-    async def generate_backend_diagrams(self, project_description: str, count: int = 1, project_id: str = None) -> List[str]:
-        """Generate multiple backend architecture diagrams"""
-        await self._send_progress(project_id, "backend", "Initializing backend architecture design...", 75)
-        await asyncio.sleep(0.2)
-        await self._send_progress(project_id, "backend", "Analyzing data flow and API requirements...", 77)
-        
-        tasks = []
-        for i in range(count):
-            await self._send_progress(project_id, "backend", f"Setting up backend diagram {i+1}/{count}...", 78 + (i * 3))
-            prompt = f"""As a backend architecture specialist (Agent {i+1}), create a Mermaid diagram for the backend of:
+    def backend_diagram_candidates(self, project_description: str, count: int = 1, project_id: str = None,
+                                   use_cache: bool = True, indices: List[int] = None) -> List[Awaitable[str]]:
+        """One coroutine per backend diagram option, each yielding its cleaned diagram"""
+        positions = list(range(count)) if indices is None else list(indices)
+        return [self._backend_diagram_candidate(project_description, i, count, project_id, use_cache) for i in positions]
+    
+    async def _backend_diagram_candidate(self, project_description: str, i: int, count: int,
+                                         project_id: str, use_cache: bool) -> str:
+        await self._send_progress(project_id, "backend", f"Setting up backend diagram {i+1}/{count}...")
+        prompt = f"""As a backend architecture specialist (Agent {i+1}), create a Mermaid diagram for the backend of:
             
 {project_description}
 
@@ -229,28 +361,149 @@ IMPORTANT:
 - Do NOT use any colors - everything should be black and white only
 - Style example: A[Component]:::blackBox
 - classDef blackBox fill:#000,stroke:#fff,stroke-width:2px,color:#fff"""
-            tasks.append(self._generate_with_model(prompt, project_id, f"Backend Diagram {i+1}/{count}"))
+        stream = self._artifact_stream(MermaidStream, project_id, "backend_diagrams", i)
+        r = await self._generate_with_model(prompt, project_id, f"Backend Diagram {i+1}/{count}", use_cache=use_cache,
+                                            stream_handler=stream, task="backend", validate=self._diagram_is_valid)
+        await self._send_progress(project_id, "backend", f"Finalizing backend diagram {i+1}/{count}...")
+        cleaned = await self._validated_diagram(self._clean_mermaid_diagram(r), project_id, "backend",
+                                                f"Backend Diagram {i+1}/{count}", use_cache)
+        await self._send_artifact(project_id, "backend_diagrams", i, cleaned, True)
+        return cleaned
+    
+    async def _validated_diagram(self, diagram: str, project_id: str, step: str, step_description: str,
+                                 use_cache: bool = True) -> str:
+        """Parse a diagram and return it normalized, repairing it first if it does not parse
+        
+        Raises MermaidSyntaxError if it still fails after DIAGRAM_REPAIR_ATTEMPTS.
+        """
+        for attempt in range(DIAGRAM_REPAIR_ATTEMPTS + 1):
+            try:
+                normalized, chart = normalize_flowchart(diagram)
+            except MermaidSyntaxError as e:
+                log.warning("Diagram is not a valid flowchart", project_id=project_id, step=step_description, error=str(e))
+                if attempt == DIAGRAM_REPAIR_ATTEMPTS:
+                    await self._send_progress(project_id, step, f"{step_description} could not be repaired: {e}")
+                    raise
+                await self._send_progress(project_id, step, f"{step_description} has a syntax error, requesting a repair...")
+                repaired = await self._repair_diagram(diagram, str(e), project_id, f"{step_description} repair", use_cache)
+                if not repaired:
+                    raise
+                diagram = self._clean_mermaid_diagram(repaired)
+                continue
+            log.info("Diagram validated", project_id=project_id, step=step_description, nodes=chart.node_count, edges=chart.edge_count)
+            return normalized
+    
+    def _diagram_is_valid(self, response: str) -> bool:
+        try:
+            normalize_flowchart(self._clean_mermaid_diagram(response))
+        except MermaidSyntaxError:
+            return False
+        return True
+    
+    async def _repair_diagram(self, diagram: str, error: str, project_id: str = None,
+                              step_description: str = "Repair", use_cache: bool = True) -> str:
+        """Ask for a corrected diagram given only the diagram and its parse error"""
+        prompt = f"""As a Mermaid syntax expert, fix flowchart diagrams that fail to parse.
+
+Change only what the error requires and keep every node, edge and label.
+
+Parse error: {error}
+
+Diagram:
+{diagram}
+
+Return the corrected diagram in this EXACT format:
+<MERMAID_START>
+flowchart TB
+    [corrected diagram here]
+<MERMAID_END>"""
         
-        await self._send_progress(project_id, "backend", f"Generating {count} backend architecture diagram(s)...", 80)
-        results = await asyncio.gather(*tasks)
+        return await self._generate_with_model(prompt, project_id, step_description, use_cache=use_cache, task="repair",
+                                               validate=self._diagram_is_valid)
+    
+    async def rank_candidates(self, candidates: List[Awaitable[Any]], artifact_type: str, project_description: str,
+                              early_exit_score: float = None, quorum: int = None,
+                              use_cache: bool = True, project_id: str = None) -> Tuple[List[Any], List[Dict[str, Any]]]:
+        """Run candidates concurrently and rate them with one critic call
+        
+        Returns the finished artifacts in candidate order and their ratings,
+        whose ``index`` refers to that list. With ``early_exit_score``, the
+        first ``quorum`` finishers (default half) are rated as soon as they are
+        done; if one scores at least that much the slower candidates are
+        cancelled, otherwise the rest are awaited and rated in a second call.
+        A candidate that fails is left out; only if all fail is the first
+        error raised.
+        """
+        tasks = [asyncio.ensure_future(candidate) for candidate in candidates]
+        position = {task: i for i, task in enumerate(tasks)}
+        finished: Dict[int, Any] = {}
+        failures: List[BaseException] = []
+        ratings: Dict[int, Dict[str, Any]] = {}
+        pending = set(tasks)
         
-        await self._send_progress(project_id, "backend", "Processing backend diagrams and cleaning code...", 87)
-        cleaned_results = []
-        for i, r in enumerate(results):
-            await self._send_progress(project_id, "backend", f"Finalizing backend diagram {i+1}/{count}...", 88 + i)
-            cleaned_results.append(self._clean_mermaid_diagram(r))
+        def collect(done):
+            for task in done:
+                if task.exception() is None:
+                    finished[position[task]] = task.result()
+                else:
+                    log.warning("Candidate failed", project_id=project_id, artifact=artifact_type, candidate=position[task] + 1, error=repr(task.exception()))
+                    failures.append(task.exception())
         
-        await self._send_progress(project_id, "backend", "Backend architecture diagrams complete!", 90)
-        return cleaned_results
+        try:
+            if early_exit_score is not None and len(tasks) > 1:
+                quorum = min(quorum or (len(tasks) + 1) // 2, len(tasks))
+                while len(finished) < quorum and pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    collect(done)
+                if finished:
+                    ratings.update(await self.rate_candidates(finished, artifact_type, project_description, use_cache, project_id))
+                best = max((r["overall_score"] for r in ratings.values()), default=None)
+                if best is not None and best >= early_exit_score and pending:
+                    log.info("Early exit, skipping slower candidates", project_id=project_id, artifact=artifact_type, score=best, skipped=len(pending))
+                    for task in pending:
+                        task.cancel()
+                    pending = set()
+            if pending:
+                done, pending = await asyncio.wait(pending)
+                collect(done)
+            unrated = {i: artifact for i, artifact in finished.items() if i not in ratings}
+            if unrated:
+                ratings.update(await self.rate_candidates(unrated, artifact_type, project_description, use_cache, project_id))
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if not finished and failures:
+            raise failures[0]
+        
+        order = sorted(finished)
+        compact = {i: n for n, i in enumerate(order)}
+        return [finished[i] for i in order], [{**ratings[i], "index": compact[i]} for i in order if i in ratings]
+    
+    async def rate_candidates(self, artifacts: Dict[int, Any], artifact_type: str, project_description: str,
+                               use_cache: bool, project_id: str = None) -> Dict[int, Dict[str, Any]]:
+        """Rate candidates in one critic call, keyed by candidate position; malformed ratings are dropped"""
+        ids = sorted(artifacts)
+        response = await self.rate_artifacts([artifacts[i] for i in ids], artifact_type, project_description, use_cache,
+                                             project_id=project_id)
+        ratings = {}
+        for rating in response if isinstance(response, list) else []:
+            if not isinstance(rating, dict):
+                continue
+            index, score = rating.get("index"), rating.get("overall_score")
+            if isinstance(index, int) and 0 <= index < len(ids) and isinstance(score, (int, float)):
+                ratings[ids[index]] = rating
+        return ratings
     
-    async def rate_artifacts(self, artifacts: List[Any], artifact_type: str, project_description: str) -> List[Dict[str, Any]]:
+    async def rate_artifacts(self, artifacts: List[Any], artifact_type: str, project_description: str, use_cache: bool = True,
+                             project_id: str = None) -> List[Dict[str, Any]]:
         """Rate generated artifacts using a critic agent"""
         prompt = f"""As an expert reviewer, rate these {artifact_type} for the project:
         
 Project: {project_description}
 
 Artifacts to rate:
-{json.dumps(artifacts, indent=2)}
+{compact_json(artifacts)}
 
 Rate each on a scale of 1-10 for:
 - Completeness
@@ -261,117 +514,150 @@ Rate each on a scale of 1-10 for:
 Return JSON array with ratings for each artifact:
 [{{"index": 0, "overall_score": 8.5, "completeness": 9, "clarity": 8, "feasibility": 8, "innovation": 9, "feedback": "..."}}]"""
         
-        response = await self._generate_with_model(prompt)
+        response = await self._generate_with_model(prompt, project_id, "Rating", use_cache=use_cache, task="rating")
         return self._parse_json_response(response)
     
-    async def _generate_with_model(self, prompt: str, project_id: str = None, step_description: str = "Processing") -> str:
-        """Generate response using OpenAI GPT (primary) or Anthropic Claude (fallback)"""
+    async def _complete(self, provider: LLMProvider, prompt: str, instructions: str = None,
+                        use_cache: bool = True, cache_variant: Any = None,
+                        stream_handler: ArtifactStream = None, schema: JSONSchema = None,
+                        validate: Callable[[str], bool] = None) -> Completion:
+        """Call a provider, answering repeated identical requests from the response cache
         
-        # Try OpenAI first if available
-        if self.use_openai and self.openai_client:
-            try:
-                await self._send_progress(project_id, "ai_call", f"{step_description}: Sending request to OpenAI GPT-4...", 0)
-                
-                print(f"\n--- OPENAI API CALL ---")
-                print(f"Full prompt length: {len(prompt)} chars")
-                print(f"Model: gpt-4.1")
-                
-                # Split prompt into instructions (system) and input (user) for OpenAI
-                # Look for system-style prompts that start with "As a..."
-                if prompt.startswith("As a"):
-                    lines = prompt.split('\n\n', 1)
-                    if len(lines) > 1:
-                        instructions = lines[0]  # System prompt part
-                        input_text = lines[1]    # User content part
-                    else:
-                        instructions = "You are a helpful AI assistant."
-                        input_text = prompt
-                else:
-                    instructions = "You are a helpful AI assistant."
-                    input_text = prompt
-                
-                print(f"Instructions: {instructions[:100]}...")
-                print(f"Input: {input_text[:100]}...")
-                
-                await self._send_progress(project_id, "ai_call", f"{step_description}: OpenAI GPT-4.1 thinking and analyzing...", 0)
-                
-                # Use OpenAI's responses API format as requested
-                response = self.openai_client.responses.create(
-                    model="gpt-4.1",
-                    instructions=instructions,
-                    input=input_text,
-                    max_output_tokens=20000,
-                )
-                
-                result = response.output_text
-                await self._send_progress(project_id, "ai_call", f"{step_description}: OpenAI response received ({len(result)} chars)", 0)
-                
-                print(f"OpenAI response received: {len(result)} chars")
-                print(f"Response type: {type(result)}")
-                
-                return result
-                
-            except Exception as e:
-                print(f"ERROR with OpenAI API: {type(e).__name__}: {str(e)}")
-                print("Falling back to Anthropic Claude...")
-                await self._send_progress(project_id, "ai_call", f"{step_description}: OpenAI failed, trying Anthropic...", 0)
+        With a ``stream_handler`` the response is streamed and each delta is fed
+        to it; the handler can end the stream once its artifact is complete.
         
-        # Fallback to Anthropic Claude
-        if self.anthropic_client:
-            try:
-                await self._send_progress(project_id, "ai_call", f"{step_description}: Sending request to Claude AI...", 0)
-                
-                print(f"\n--- ANTHROPIC API CALL (FALLBACK) ---")
-                print(f"Prompt length: {len(prompt)} chars")
-                print(f"Model: claude-sonnet-4-20250514")
-                
-                await self._send_progress(project_id, "ai_call", f"{step_description}: Claude AI thinking and analyzing...", 0)
-                
-                # Make synchronous call directly
-                response = self.anthropic_client.messages.create(
-                    model="claude-sonnet-4-20250514",
-                    max_tokens=10000,  # Increased to handle even larger JSON responses
-                    temperature=0.7,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                
-                if response.content and len(response.content) > 0:
-                    result = response.content[0].text
-                    await self._send_progress(project_id, "ai_call", f"{step_description}: Claude response received ({len(result)} chars)", 0)
-                    
-                    print(f"Claude response received: {len(result)} chars")
-                    print(f"Response type: {type(response.content[0])}")
-                    print(f"Stop reason: {response.stop_reason}")
-                    
-                    if response.stop_reason == "max_tokens":
-                        print("WARNING: Response was truncated due to max_tokens limit!")
-                        await self._send_progress(project_id, "ai_call", f"{step_description}: Response truncated - may need adjustment", 0)
-                        
-                    return result
-                else:
-                    print("WARNING: Empty response.content from Claude API")
-                    print(f"Response object: {response}")
-                    await self._send_progress(project_id, "ai_call", f"{step_description}: Empty response from Claude", 0)
-                    return ""
-                    
-            except Exception as e:
-                print(f"ERROR generating with Anthropic model: {type(e).__name__}: {str(e)}")
-                import traceback
-                print(f"Traceback:\n{traceback.format_exc()}")
-                await self._send_progress(project_id, "ai_call", f"{step_description}: Both APIs failed - {str(e)[:50]}...", 0)
-                return ""
-        else:
-            print("ERROR: No AI clients available!")
-            await self._send_progress(project_id, "ai_call", f"{step_description}: No AI clients configured", 0)
+        With ``validate`` only responses it accepts are cached, and a cached
+        response it rejects is dropped and requested again, so a response that
+        failed its schema or did not parse is never replayed.
+        """
+        key = None
+        if use_cache and self.cache:
+            key = LLMCache.make_key(provider.name, provider.model, instructions, prompt, provider.max_tokens, cache_variant,
+                                    schema)
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None and validate and not validate(cached):
+                log.warning("Dropped invalid cached response", provider=provider.name, length=len(cached))
+                await asyncio.to_thread(self.cache.delete, key)
+            elif cached is not None:
+                log.debug("Cache hit", provider=provider.name, length=len(cached))
+                return Completion(text=cached, provider=provider.name, model=provider.model, stop_reason="cached")
+        
+        sent_at = None
+        
+        async def request() -> Completion:
+            nonlocal sent_at
+            request_sent()
+            sent_at = time.perf_counter()
+            if stream_handler:
+                # Discard anything a previously failed provider or attempt streamed
+                stream_handler.reset()
+                return await provider.stream(prompt, stream_handler.feed, instructions=instructions, schema=schema)
+            return await provider.complete(prompt, instructions=instructions, schema=schema)
+        
+        def usage(completion: Completion) -> int:
+            # Estimate what the provider didn't report, e.g. for a stream we ended early
+            if completion.input_tokens is None:
+                completion.input_tokens = count_tokens(f"{instructions or ''}{prompt}")
+            if completion.output_tokens is None:
+                completion.output_tokens = count_tokens(completion.text)
+            return completion.input_tokens + completion.output_tokens
+        
+        tokens = estimate_tokens(f"{instructions or ''}{prompt}", provider.max_tokens)
+        # Provider latency runs from the (last) send, not from while we queue for a limiter slot
+        request_queued()
+        completion = await self.limiters.get(provider).call(request, tokens, usage)
+        if self.latency_recorder:
+            self.latency_recorder(f"provider:{provider.name}", time.perf_counter() - sent_at)
+        
+        # Only keep complete, valid answers; truncated, empty or invalid ones should be retried
+        if key and completion.text and not completion.truncated and (not validate or validate(completion.text)):
+            await asyncio.to_thread(self.cache.set, key, completion.text)
+        return completion
+    
+    async def _generate_with_model(self, prompt: str, project_id: str = None, step_description: str = "Processing",
+                                   use_cache: bool = True, cache_variant: Any = None,
+                                   stream_handler: ArtifactStream = None, task: str = "default",
+                                   schema: JSONSchema = None, validate: Callable[[str], bool] = None) -> str:
+        """Generate response using OpenAI GPT (primary) or Anthropic Claude (fallback)
+        
+        With a ``schema`` (and structured output enabled) the providers are
+        constrained to JSON following it. ``validate`` decides which responses
+        may be cached (see ``_complete``).
+        
+        The router skips a provider whose circuit is open, falls back when a
+        call fails, and hedges with the fallback provider when the primary runs
+        past its usual latency for this ``task``. Only the first request
+        streams, so a hedged request never interleaves with its deltas.
+        """
+        providers = []
+        if self.use_openai and self.openai_provider:
+            providers.append(self.openai_provider)
+        if self.anthropic_provider:
+            providers.append(self.anthropic_provider)
+        if not providers:
+            log.error("No AI clients available")
+            await self._send_progress(project_id, "ai_call", f"{step_description}: No AI clients configured")
             return ""
+        
+        async def attempt(provider: LLMProvider, hedged: bool) -> Completion:
+            label = PROVIDER_LABELS.get(provider.name, provider.name)
+            if hedged:
+                await self._send_progress(project_id, "ai_call", f"{step_description}: Response is slow, also asking {label}...")
+            else:
+                await self._send_progress(project_id, "ai_call", f"{step_description}: Sending request to {label}...")
+            
+            log.debug("Provider call", project_id=project_id, step=step_description, provider=provider.name,
+                      model=provider.model, hedged=hedged, prompt_length=len(prompt))
+            
+            if provider is self.openai_provider:
+                instructions, input_text = self._split_prompt(prompt)
+            else:
+                instructions, input_text = None, prompt
+            
+            await self._send_progress(project_id, "ai_call", f"{step_description}: {label} thinking and analyzing...")
+            return await self._complete(provider, input_text, instructions,
+                                        use_cache=use_cache, cache_variant=cache_variant,
+                                        stream_handler=None if hedged else stream_handler,
+                                        schema=schema if self.structured_output else None, validate=validate)
+        
+        try:
+            completion = await self.router.call(providers, attempt, task=task)
+        except Exception as e:
+            log.error("All providers failed", project_id=project_id, step=step_description, error=f"{type(e).__name__}: {e}")
+            await self._send_progress(project_id, "ai_call", f"{step_description}: All providers failed - {str(e)[:50]}...")
+            return ""
+        
+        if self.usage_recorder and project_id:
+            self.usage_recorder(project_id, task, completion)
+        if completion.stop_reason != "cached":
+            record_raw_response(completion.text, project_id=project_id, task=task, step=step_description,
+                                provider=completion.provider, model=completion.model, stop_reason=completion.stop_reason,
+                                input_tokens=completion.input_tokens, output_tokens=completion.output_tokens)
+        
+        result = completion.text
+        label = PROVIDER_LABELS.get(completion.provider, completion.provider)
+        await self._send_progress(project_id, "ai_call", f"{step_description}: {label} response received ({len(result)} chars)")
+        log.debug("Response received", project_id=project_id, step=step_description, provider=completion.provider,
+                  length=len(result), stop_reason=completion.stop_reason)
+        if completion.truncated:
+            log.warning("Response was truncated by the max_tokens limit", project_id=project_id, step=step_description,
+                        provider=completion.provider)
+            await self._send_progress(project_id, "ai_call", f"{step_description}: Response truncated - may need adjustment")
+        return result
+    
+    def _split_prompt(self, prompt: str):
+        """Split prompt into instructions (system) and input (user) parts"""
+        # Look for system-style prompts that start with "As a..."
+        if prompt.startswith("As a"):
+            parts = prompt.split('\n\n', 1)
+            if len(parts) > 1:
+                return parts[0], parts[1]
+        return "You are a helpful AI assistant.", prompt
     
     def _parse_json_response(self, response: str) -> Any:
         """Parse JSON from model response"""
-        print(f"\n--- PARSING JSON ---")
-        print(f"Response length: {len(response) if response else 0}")
-        
         if not response:
-            print("ERROR: Empty response to parse")
+            log.warning("Empty response to parse")
             return {}
             
         try:
@@ -380,33 +666,27 @@ Return JSON array with ratings for each artifact:
             response = response.strip()
             
             if response.startswith("```json"):
-                print("Cleaning: Removing ```json prefix")
                 response = response[7:]
             if response.endswith("```"):
-                print("Cleaning: Removing ``` suffix")
                 response = response[:-3]
                 
             response = response.strip()
-            print(f"Cleaned response length: {len(response)}")
-            print(f"First 100 chars: {response[:100]}...")
-            print(f"Last 100 chars: ...{response[-100:]}")
             
             result = json.loads(response)
-            print(f"SUCCESS: Parsed JSON")
-            print(f"Type: {type(result)}")
-            print(f"Keys: {list(result.keys()) if isinstance(result, dict) else 'Not a dict'}")
-            
-            if isinstance(result, dict) and 'pages' in result:
-                print(f"Pages found: {len(result['pages'])}")
-                
+            log.debug("Parsed JSON", length=len(response), type=type(result).__name__)
             return result
         except json.JSONDecodeError as e:
-            print(f"ERROR parsing JSON: {e}")
-            print(f"Error position: {e.pos if hasattr(e, 'pos') else 'Unknown'}")
-            print(f"Raw response first 500 chars: {response[:500]}...")
+            log.warning("Could not parse JSON", error=str(e), position=e.pos)
+            
+            # The object may be wrapped in prose or cut off; recover what we can
+            recovered = parse_json_document(original_response)
+            if recovered.data is not None:
+                log.info("Recovered JSON object", complete=recovered.complete)
+                return recovered.data
+            log.warning("No JSON object in response", preview=response[:500])
             return {}
         except Exception as e:
-            print(f"ERROR parsing JSON (other): {type(e).__name__}: {str(e)}")
+            log.error("Could not parse JSON", error=f"{type(e).__name__}: {e}")
             return {}
     
     def _clean_mermaid_diagram(self, diagram: str) -> str:
@@ -441,5 +721,5 @@ Return JSON array with ratings for each artifact:
         if clean_lines:
             return '\n'.join(clean_lines).strip()
         
-        # Last resort: return a default diagram
-        return "flowchart TD\n    A[Component] --> B[Loading...]"
\ No newline at end of file
+        # No diagram keyword found; the parser reports what is wrong with it
+        return diagram.strip()
\ No newline at end of file
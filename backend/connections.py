@@ -0,0 +1,221 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+
+from fastapi import WebSocket
+
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "32"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "5"))
+WS_STALL_SECONDS = float(os.getenv("WS_STALL_SECONDS", "10"))
+
+TERMINAL_STEPS = {"error", "complete"}
+
+
+def is_terminal(step: str, progress: int) -> bool:
+    """Terminal events are never coalesced or dropped"""
+    return step in TERMINAL_STEPS or progress >= 100
+
+
+def progress_event(project_id: str, step: str, message: str, progress: int,
+                   eta_seconds: Optional[float] = None) -> Dict[str, Any]:
+    return {
+        "type": "progress",
+        "project_id": project_id,
+        "step": step,
+        "message": message,
+        "progress": progress,
+        "eta_seconds": eta_seconds,
+        # Wall clock, since events may be produced by another worker process
+        "timestamp": time.time()
+    }
+
+
+def artifact_event(project_id: str, artifact: str, index: int, content: Any, complete: bool) -> Dict[str, Any]:
+    return {
+        "type": "artifact",
+        "project_id": project_id,
+        "artifact": artifact,
+        "index": index,
+        "content": content,
+        "complete": complete,
+        "timestamp": time.time()
+    }
+
+
+class ClientChannel:
+    """Bounded outbound queue for one WebSocket, drained by its own writer task
+
+    Intermediate events are coalesced by key (progress per project, partial
+    artifacts per project/artifact/index): a newer event replaces the one
+    still waiting in the queue. Terminal events always get their own
+    slot and may push out pending intermediate events to make room. A channel
+    that stays full for ``stall_seconds`` or takes longer than
+    ``send_timeout`` to accept a frame is considered dead.
+    """
+
+    _sequence = itertools.count()
+
+    def __init__(self, websocket: WebSocket, max_pending: int = WS_QUEUE_SIZE,
+                 send_timeout: float = WS_SEND_TIMEOUT_SECONDS, stall_seconds: float = WS_STALL_SECONDS):
+        self.websocket = websocket
+        self.max_pending = max_pending
+        self.send_timeout = send_timeout
+        self.stall_seconds = stall_seconds
+        self.pending: "OrderedDict[tuple, str]" = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.full_since: Optional[float] = None
+        self.closed = False
+        self.dropped = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self, on_failure):
+        self.task = asyncio.create_task(self._writer(on_failure))
+
+    def offer(self, key: tuple, payload: str, terminal: bool) -> bool:
+        """Queue a frame without waiting; returns False if the consumer is stalled"""
+        if self.closed:
+            return False
+        if not terminal and key in self.pending:
+            # Supersede the queued intermediate event with the same key
+            self.pending[key] = payload
+            return True
+
+        if len(self.pending) >= self.max_pending:
+            if terminal and self._drop_intermediate():
+                pass
+            else:
+                self.dropped += 1
+                now = time.monotonic()
+                if self.full_since is None:
+                    self.full_since = now
+                return now - self.full_since < self.stall_seconds
+        self.full_since = None
+
+        if terminal:
+            key = ("terminal", next(self._sequence))
+        self.pending[key] = payload
+        self.wakeup.set()
+        return True
+
+    def _drop_intermediate(self) -> bool:
+        for key in self.pending:
+            if key[0] != "terminal":
+                del self.pending[key]
+                self.dropped += 1
+                return True
+        return False
+
+    async def _writer(self, on_failure):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.pending:
+                    _, payload = self.pending.popitem(last=False)
+                    await asyncio.wait_for(self.websocket.send_text(payload), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            on_failure(self.websocket)
+
+    def close(self):
+        self.closed = True
+        self.pending.clear()
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+
+class ConnectionManager:
+    """Routes progress and partial-artifact events to the sockets subscribed to each project
+
+    Delivery never waits on the network: events are handed to each
+    subscriber's ``ClientChannel`` and written by that channel's task.
+    """
+
+    def __init__(self):
+        self.topics: Dict[str, Set[WebSocket]] = {}  # project id -> subscribed sockets
+        self.subscriptions: Dict[WebSocket, Set[str]] = {}  # socket -> project ids
+        self.channels: Dict[WebSocket, ClientChannel] = {}
+
+    async def connect(self, websocket: WebSocket, project_id: Optional[str] = None):
+        await websocket.accept()
+        self.subscriptions[websocket] = set()
+        channel = ClientChannel(websocket)
+        channel.start(self.evict)
+        self.channels[websocket] = channel
+        if project_id:
+            self.subscribe(websocket, project_id)
+
+    def subscribe(self, websocket: WebSocket, project_id: str):
+        self.topics.setdefault(project_id, set()).add(websocket)
+        self.subscriptions.setdefault(websocket, set()).add(project_id)
+
+    def unsubscribe(self, websocket: WebSocket, project_id: str):
+        subscribers = self.topics.get(project_id)
+        if subscribers is not None:
+            subscribers.discard(websocket)
+            if not subscribers:
+                del self.topics[project_id]
+        self.subscriptions.get(websocket, set()).discard(project_id)
+
+    def disconnect(self, websocket: WebSocket):
+        channel = self.channels.pop(websocket, None)
+        if channel:
+            channel.close()
+        for project_id in self.subscriptions.pop(websocket, set()):
+            subscribers = self.topics.get(project_id)
+            if subscribers is not None:
+                subscribers.discard(websocket)
+                if not subscribers:
+                    del self.topics[project_id]
+
+    def evict(self, websocket: WebSocket):
+        """Drop a consumer that failed or stalled, and close its socket"""
+        known = websocket in self.channels
+        self.disconnect(websocket)
+        if known:
+            asyncio.ensure_future(self._close_quietly(websocket))
+
+    async def _close_quietly(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)  # Try again later
+        except Exception:
+            pass
+
+    async def send_progress(self, project_id: str, step: str, message: str, progress: int,
+                            eta_seconds: Optional[float] = None):
+        await self.deliver(progress_event(project_id, step, message, progress, eta_seconds))
+
+    async def send_artifact(self, project_id: str, artifact: str, index: int, content, complete: bool):
+        """Publish a partial (or, with ``complete``, final) generated artifact"""
+        await self.deliver(artifact_event(project_id, artifact, index, content, complete))
+
+    async def deliver(self, event: Dict[str, Any]):
+        """Hand a progress or artifact event to this process's subscribers"""
+        project_id = event["project_id"]
+        if not self.topics.get(project_id):
+            return
+        if event["type"] == "artifact":
+            # Final artifacts must arrive, so they are treated like terminal events
+            key = ("artifact", project_id, event["artifact"], event["index"])
+            terminal = event["complete"]
+        else:
+            key = ("progress", project_id)
+            terminal = is_terminal(event["step"], event["progress"])
+        self._publish(project_id, key, event, terminal)
+
+    def _publish(self, project_id: str, key: tuple, payload: dict, terminal: bool):
+        # Serialize once and share the payload across every subscriber
+        text = json.dumps(payload)
+        stalled = []
+        for connection in list(self.topics.get(project_id, ())):
+            channel = self.channels.get(connection)
+            if channel is None or not channel.offer(key, text, terminal):
+                stalled.append(connection)
+
+        for connection in stalled:
+            self.evict(connection)
@@ -1,19 +1,86 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 import os
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./site_planner.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./site_planner.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# Applied to every new SQLite connection. WAL lets readers proceed while a
+# generation commits. With synchronous=NORMAL a WAL database is never corrupted
+# and survives an application crash, but the last commits can be lost if the
+# OS crashes or power fails; set SQLITE_SYNCHRONOUS=FULL to fsync every commit.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "foreign_keys": "ON",
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-65536"),  # Negative values are KiB, i.e. 64 MiB
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    "temp_store": "MEMORY",
+}
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+def async_url(url: str) -> str:
+    """Async driver URL for a sync database URL (sqlite -> aiosqlite)"""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    # Other databases must name an async driver themselves, e.g. postgresql+asyncpg://
+    return url
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+def make_engines(url: str = SQLALCHEMY_DATABASE_URL):
+    """Create the sync engine (jobs, writes) and async engine (request reads) for one database"""
+    if is_sqlite(url):
+        options = {"connect_args": {"check_same_thread": False}}
+    else:
+        options = {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_pre_ping": True}
+    sync_engine = create_engine(url, **options)
+    async_engine = create_async_engine(async_url(url), **({} if is_sqlite(url) else options))
+    if is_sqlite(url):
+        event.listen(sync_engine, "connect", apply_sqlite_pragmas)
+        event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+    return sync_engine, async_engine
+
+engine, async_engine = make_engines()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
 Base = declarative_base()
 
+def init_db(bind=None):
+    """Create missing tables and indexes, and migrate legacy artifact columns"""
+    from models import Base as ModelBase, migrate_legacy_artifacts
+
+    bind = bind or engine
+    ModelBase.metadata.create_all(bind=bind)
+    # create_all skips columns and indexes added to tables that already exist
+    inspector = inspect(bind)
+    for table in ModelBase.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                with bind.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(bind.dialect)}"))
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+    migrate_legacy_artifacts(bind)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,44 @@
+import hashlib
+import json
+from typing import Any, Optional
+
+from fastapi import Response
+
+# Revalidate on every use; cheap because unchanged resources answer 304
+REVALIDATE = "no-cache"
+# For URLs pinned to an artifact checksum, whose body can never change
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def make_etag(*parts: Any) -> str:
+    """Weak ETag over the given validator parts (ids, timestamps, checksums)
+
+    Weak because it identifies the content, not the bytes: GZipMiddleware
+    sends the same resource compressed or not depending on Accept-Encoding.
+    """
+    raw = json.dumps(parts, default=str, sort_keys=True, separators=(",", ":"))
+    return 'W/"' + hashlib.sha256(raw.encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluate an If-None-Match header against the current ETag"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        # If-None-Match uses weak comparison
+        if candidate.removeprefix("W/") == etag.removeprefix("W/"):
+            return True
+    return False
+
+
+def not_modified(etag: str, cache_control: str = REVALIDATE) -> Response:
+    # GZipMiddleware adds Vary to the full responses it may compress, but never to an empty 304
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"})
+
+
+def set_cache_headers(response: Response, etag: str, cache_control: str = REVALIDATE):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
@@ -0,0 +1,330 @@
+import asyncio
+import datetime
+import os
+import socket
+import uuid
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from models import GenerationJob
+from structured_log import get_logger
+from write_batcher import WriteBatcher
+
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# A running job is leased to its worker; once the lease runs out, any worker may requeue it
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# How often a worker renews its leases and looks for jobs whose lease ran out
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+
+log = get_logger("jobs")
+
+# handler(job_id, project_id, payload, db) -> result dict
+JobHandler = Callable[[str, str, Dict[str, Any], Session], Awaitable[Dict[str, Any]]]
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class JobQueue:
+    """Persistent generation job queue drained by a bounded worker pool
+
+    Jobs are rows in the ``generation_jobs`` table, so queued work survives
+    restarts: ``start`` enqueues every queued job. A claimed job is leased to
+    this worker (``owner``) and the lease is renewed every heartbeat; a
+    running job is only requeued once its lease has expired, i.e. its worker
+    died or stopped, so workers sharing the database never take over each
+    other's live jobs. Every heartbeat also looks for such expired jobs.
+    The in-memory queue only carries ids.
+    Job state changes go through ``writer`` so concurrent jobs share commits.
+    Jobs whose payload names a ``group`` with a ``group_limit`` (e.g. one
+    bulk import) run at most that many at a time in this process; the rest
+    wait their turn without occupying a worker. Likewise only one job per
+    project runs at a time, since progress is tracked per project.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], concurrency: int = GENERATION_WORKERS,
+                 writer: Optional[WriteBatcher] = None, lease_seconds: float = JOB_LEASE_SECONDS,
+                 heartbeat_seconds: float = JOB_HEARTBEAT_SECONDS):
+        self.session_factory = session_factory
+        self.writer = writer or WriteBatcher(session_factory)
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.heartbeat: Optional[asyncio.Task] = None
+        self.handlers: Dict[str, JobHandler] = {}
+        self.queue: Optional[asyncio.Queue] = None
+        self.workers: List[asyncio.Task] = []
+        self.running_by_project: Dict[str, str] = {}
+        self.running_by_group: Dict[str, int] = {}
+        self.deferred: Dict[str, Deque[str]] = {}
+        self.waiting_by_project: Dict[str, Deque[str]] = {}
+
+    def register(self, kind: str, handler: JobHandler):
+        """Register the coroutine that executes jobs of the given kind"""
+        self.handlers[kind] = handler
+
+    @property
+    def started(self) -> bool:
+        return bool(self.workers)
+
+    async def start(self):
+        """Recover unfinished jobs and spawn the worker pool"""
+        if self.started:
+            return
+        self.queue = asyncio.Queue()
+        await self.writer.start()
+        await self.writer.write(self._requeue_expired)
+        for job_id in await asyncio.to_thread(self._queued_ids):
+            self.queue.put_nowait(job_id)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self.heartbeat = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        """Cancel workers; their running jobs' leases end now, so the next worker to look requeues them"""
+        tasks = self.workers + ([self.heartbeat] if self.heartbeat else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.workers = []
+        self.heartbeat = None
+        await self.writer.write(lambda db: self._renew(db, expires_at=_now()))
+        # Flush state changes still waiting for a group commit
+        await self.writer.stop()
+
+    def _queued_ids(self) -> List[str]:
+        db = self.session_factory()
+        try:
+            rows = db.query(GenerationJob.id).filter(GenerationJob.status == "queued").order_by(GenerationJob.created_at)
+            return [row.id for row in rows]
+        finally:
+            db.close()
+
+    @staticmethod
+    def _requeue_expired(db: Session) -> List[str]:
+        """Put running jobs whose lease ran out back in the queue; returns their ids"""
+        stale = (
+            GenerationJob.status == "running",
+            # Jobs claimed before leases existed have none
+            or_(GenerationJob.lease_expires_at.is_(None), GenerationJob.lease_expires_at < _now()),
+        )
+        job_ids = [row.id for row in db.query(GenerationJob.id).filter(*stale).order_by(GenerationJob.created_at)]
+        if job_ids:
+            db.query(GenerationJob).filter(GenerationJob.id.in_(job_ids), *stale).update({
+                "status": "queued",
+                "stage": "queued",
+                "message": "Requeued after its worker stopped",
+                "owner": None,
+                "lease_expires_at": None,
+            }, synchronize_session=False)
+            log.warning("Requeued jobs whose lease expired", job_ids=job_ids)
+        return job_ids
+
+    def _renew(self, db: Session, expires_at: Optional[datetime.datetime] = None):
+        """Extend the lease of every job this worker is running (or end it with ``expires_at``)"""
+        db.query(GenerationJob).filter(
+            GenerationJob.owner == self.worker_id, GenerationJob.status == "running"
+        ).update({
+            "lease_expires_at": expires_at or _now() + datetime.timedelta(seconds=self.lease_seconds),
+        }, synchronize_session=False)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                if self.running_by_project:
+                    await self.writer.write(self._renew, key=("lease", self.worker_id))
+                for job_id in await self.writer.write(self._requeue_expired, key=("requeue", self.worker_id)):
+                    self.queue.put_nowait(job_id)
+            except Exception:
+                log.exception("Job heartbeat failed", worker=self.worker_id)
+
+    async def enqueue(self, kind: str, project_id: str, payload: Dict[str, Any]) -> GenerationJob:
+        """Persist a new job and hand it to the worker pool once its row is committed"""
+        fields = dict(id=str(uuid.uuid4()), kind=kind, project_id=project_id, payload=payload,
+                      status="queued", stage="queued", message="Waiting for a worker...", progress=0, attempts=0)
+        await self.writer.write(lambda db: db.add(GenerationJob(**fields)))
+        if self.queue is not None:
+            self.queue.put_nowait(fields["id"])
+        # Detached copy for the caller; the committed row lives in the writer's session
+        return GenerationJob(**fields)
+
+    async def get(self, job_id: str) -> Optional[GenerationJob]:
+        """Load a job (detached) without blocking the event loop"""
+        return await asyncio.to_thread(self._load, job_id)
+
+    def _load(self, job_id: str) -> Optional[GenerationJob]:
+        db = self.session_factory()
+        try:
+            job = db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+            if job:
+                db.expunge(job)
+            return job
+        finally:
+            db.close()
+
+    def record_progress(self, project_id: str, step: str, message: str, progress: int):
+        """Store the latest stage/progress for the job generating ``project_id``
+
+        Progress is best effort: the write is queued without waiting, and a
+        newer update for the same job replaces one that is still queued.
+        """
+        job_id = self.running_by_project.get(project_id)
+        if not job_id:
+            return
+
+        def update(db: Session):
+            job = db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+            if job:
+                job.stage = step
+                job.message = message
+                # Stages run concurrently, so never move the bar backwards
+                job.progress = max(job.progress or 0, progress)
+
+        future = self.writer.submit(update, key=("progress", job_id))
+        future.add_done_callback(self._log_write_failure)
+
+    @staticmethod
+    def _log_write_failure(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            log.error("Could not save job progress", error=repr(future.exception()))
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                log.exception("Job failed", job_id=job_id)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job_id: str):
+        db = self.session_factory()
+        try:
+            job = await asyncio.to_thread(self._read_queued, db, job_id)
+            if job is None:
+                return
+            kind, project_id, payload, attempts = job
+
+            handler = self.handlers.get(kind)
+            if handler is None:
+                await self._finish(job_id, "failed", error=f"No handler registered for job kind '{kind}'")
+                return
+            if attempts >= JOB_MAX_ATTEMPTS:
+                await self._finish(job_id, "failed", error="Maximum attempts exceeded")
+                return
+
+            if project_id in self.running_by_project:
+                # Picked up again when the project's running job finishes
+                self.waiting_by_project.setdefault(project_id, deque()).append(job_id)
+                return
+            group, group_limit = payload.get("group"), payload.get("group_limit")
+            if group and group_limit and self.running_by_group.get(group, 0) >= group_limit:
+                # Picked up again when a job of the same group finishes
+                self.deferred.setdefault(group, deque()).append(job_id)
+                return
+            # Reserve the project and group slots before awaiting the claim so other workers see them
+            self.running_by_project[project_id] = job_id
+            if group:
+                self.running_by_group[group] = self.running_by_group.get(group, 0) + 1
+
+            claimed = False
+            try:
+                claimed = await self.writer.write(lambda session: self._claim(session, job_id))
+            finally:
+                if not claimed:
+                    self._release_project(project_id)
+                    if group:
+                        self._release_group(group)
+            if not claimed:
+                return  # Another API worker picked it up first
+
+            try:
+                result = await handler(job_id, project_id, payload, db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await asyncio.to_thread(db.rollback)
+                await self._finish(job_id, "failed", error=str(e))
+                return
+            finally:
+                self._release_project(project_id)
+                if group:
+                    self._release_group(group)
+
+            await self._finish(job_id, "completed", result=result or {})
+        finally:
+            db.close()
+
+    @staticmethod
+    def _read_queued(db: Session, job_id: str) -> Optional[tuple]:
+        """(kind, project_id, payload, attempts) of a job still queued, else None"""
+        try:
+            job = db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+            if not job or job.status != "queued":
+                return None
+            return job.kind, job.project_id, dict(job.payload or {}), job.attempts or 0
+        finally:
+            # End the read transaction; state changes are written by the batcher
+            db.rollback()
+
+    def _release_project(self, project_id: str):
+        self.running_by_project.pop(project_id, None)
+        waiting = self.waiting_by_project.get(project_id)
+        if waiting:
+            self.queue.put_nowait(waiting.popleft())
+            if not waiting:
+                del self.waiting_by_project[project_id]
+
+    def _release_group(self, group: str):
+        self.running_by_group[group] -= 1
+        if not self.running_by_group[group]:
+            del self.running_by_group[group]
+        waiting = self.deferred.get(group)
+        if waiting:
+            self.queue.put_nowait(waiting.popleft())
+            if not waiting:
+                del self.deferred[group]
+
+    def _claim(self, db: Session, job_id: str) -> bool:
+        """Atomically move a queued job to running under this worker's lease; False if it was already claimed"""
+        now = _now()
+        claimed = db.query(GenerationJob).filter(
+            GenerationJob.id == job_id, GenerationJob.status == "queued"
+        ).update({
+            "status": "running",
+            "stage": "planning",
+            "attempts": func.coalesce(GenerationJob.attempts, 0) + 1,
+            "started_at": now,
+            "owner": self.worker_id,
+            "lease_expires_at": now + datetime.timedelta(seconds=self.lease_seconds),
+        }, synchronize_session=False)
+        return claimed == 1
+
+    async def _finish(self, job_id: str, status: str,
+                      result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        def update(db: Session):
+            job = db.query(GenerationJob).filter(GenerationJob.id == job_id).one()
+            if job.owner not in (None, self.worker_id):
+                # Our lease ran out and another worker has taken the job over
+                log.warning("Lost the lease of a job, not recording its outcome", job_id=job_id, owner=job.owner)
+                return
+            job.status = status
+            job.lease_expires_at = None
+            job.stage = "complete" if status == "completed" else "error"
+            job.finished_at = _now()
+            if status == "completed":
+                job.progress = 100
+                job.message = "Generation complete"
+                job.result = result
+            else:
+                job.error = error
+                job.message = f"Error: {error}"
+
+        await self.writer.write(update)
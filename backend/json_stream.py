@@ -0,0 +1,168 @@
+import json
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from schemas import page_errors
+
+# Returns why an item is invalid, or None if it is acceptable
+ItemValidator = Callable[[Any], Optional[str]]
+
+
+def validate_sitemap_page(page: Any) -> Optional[str]:
+    """Check one sitemap page against the sitemap schema"""
+    return page_errors(page)
+
+
+@dataclass
+class ParseResult:
+    data: Any = None
+    complete: bool = False  # False when ``data`` was salvaged from a truncated response
+    salvaged: List[Any] = field(default_factory=list)  # Items recovered from a truncated response
+    rejected: List[Tuple[int, str]] = field(default_factory=list)  # (item index, reason)
+
+
+class IncrementalJSONParser:
+    """Scan a JSON object as it streams in and pull out finished array items
+
+    Text is fed in arbitrary chunks. Anything before the first ``{`` (prose,
+    code fences) is skipped. Every element of the top-level ``array_key``
+    array is decoded as soon as its closing brace arrives, and ``complete``
+    flips once the top-level object itself closes. Items failing
+    ``validate_item`` are left out of ``items`` and listed in ``rejected``.
+    """
+
+    def __init__(self, array_key: str = "pages", validate_item: Optional[ItemValidator] = None):
+        self.array_key = array_key
+        self.validate_item = validate_item
+        self.buffer = ""
+        self.position = 0
+        self.start: Optional[int] = None  # Index of the top-level "{"
+        self.end: Optional[int] = None  # Index just past the top-level "}"
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.last_string: Optional[str] = None
+        self.current_key: Optional[str] = None
+        self.array_depth: Optional[int] = None  # Depth inside the tracked array
+        self.item_start: Optional[int] = None
+        self.items: List[Any] = []
+        self.rejected: List[Tuple[int, str]] = []
+        self.item_count = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Consume more text and return the array items completed by it"""
+        self.buffer += chunk
+        completed = []
+        while self.position < len(self.buffer) and not self.complete:
+            char = self.buffer[self.position]
+            index = self.position
+            self.position += 1
+
+            if self.start is None:
+                if char == "{":
+                    self.start = index
+                    self.depth = 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = self.buffer[self.string_start:index]
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_start = index + 1
+            elif char == ":" and self.depth == 1:
+                self.current_key = self.last_string
+            elif char in "{[":
+                if (char == "[" and self.depth == 1 and self.current_key == self.array_key
+                        and self.array_depth is None):
+                    self.array_depth = self.depth + 1
+                elif self.array_depth is not None and self.depth == self.array_depth and self.item_start is None:
+                    self.item_start = index
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.array_depth is not None:
+                    if self.depth == self.array_depth and self.item_start is not None:
+                        item = self._accept(self.buffer[self.item_start:index + 1])
+                        if item is not None:
+                            self.items.append(item)
+                            completed.append(item)
+                        self.item_start = None
+                    elif self.depth < self.array_depth:
+                        self.array_depth = None
+                if self.depth == 0:
+                    self.end = index + 1
+        return completed
+
+    def document(self) -> Optional[str]:
+        """Text of the complete top-level object, if it has closed"""
+        if not self.complete:
+            return None
+        return self.buffer[self.start:self.end]
+
+    def _accept(self, text: str) -> Optional[Dict[str, Any]]:
+        index = self.item_count
+        self.item_count += 1
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError as e:
+            self.rejected.append((index, f"invalid JSON: {e.msg}"))
+            return None
+        reason = self.validate_item(item) if self.validate_item else None
+        if reason:
+            self.rejected.append((index, reason))
+            return None
+        return item
+
+
+def parse_json_document(text: str, array_key: str = "pages",
+                        validate_item: Optional[ItemValidator] = None) -> ParseResult:
+    """Find the JSON object in a model response, salvaging what it can
+
+    Surrounding prose and code fences are skipped, as are brace-delimited
+    fragments that are not JSON. If the response was cut off before the
+    object closed, the finished ``array_key`` items are returned as
+    ``{array_key: [...]}`` with ``complete`` False.
+    """
+    offset = 0
+    while text and offset < len(text):
+        parser = IncrementalJSONParser(array_key, validate_item)
+        parser.feed(text[offset:])
+        if parser.start is None:
+            break
+
+        if not parser.complete:
+            if not parser.items:
+                return ParseResult(rejected=parser.rejected)
+            return ParseResult(data={array_key: list(parser.items)}, complete=False,
+                               salvaged=list(parser.items), rejected=parser.rejected)
+
+        try:
+            data = json.loads(parser.document())
+        except json.JSONDecodeError:
+            if parser.items:
+                # Malformed outside the finished items, e.g. a broken trailing key
+                return ParseResult(data={array_key: list(parser.items)}, complete=False,
+                                   salvaged=list(parser.items), rejected=parser.rejected)
+            # Something like "{placeholder}" in prose; keep looking after it
+            offset += parser.start + 1
+            continue
+
+        if isinstance(data, dict) and isinstance(data.get(array_key), list):
+            # The parser already dropped items that failed validation
+            data[array_key] = list(parser.items)
+        return ParseResult(data=data, complete=True, rejected=parser.rejected)
+    return ParseResult()
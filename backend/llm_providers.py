@@ -0,0 +1,240 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import anthropic
+import openai
+from openai import AsyncOpenAI
+
+# Per-call timeout shared by every provider
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+# The SDKs' own retries are off: rate_limiter retries throttled and transient failures for every provider
+SDK_MAX_RETRIES = 0
+
+# Raised when a request never got a response (connection failures and timeouts)
+CONNECTION_ERRORS = (openai.APIConnectionError, anthropic.APIConnectionError)
+
+DEFAULT_INSTRUCTIONS = "You are a helpful AI assistant."
+
+# Stop reason used when the caller ended a stream because its artifact was complete
+ARTIFACT_COMPLETE = "artifact_complete"
+
+# Receives each text delta; returning True stops the stream early
+DeltaHandler = Callable[[str], Awaitable[Optional[bool]]]
+
+# JSON schema a structured response must follow (see schemas.response_schema)
+JSONSchema = Dict[str, Any]
+
+# Name of the structured-output format/tool the response is returned through
+STRUCTURED_OUTPUT_NAME = "structured_response"
+
+
+@dataclass
+class Completion:
+    """Text returned by a provider together with call metadata"""
+    text: str
+    provider: str
+    model: str
+    stop_reason: Optional[str] = None
+    # Token counts reported by the provider; None when it reported none (e.g. a stream cut short)
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+
+    @property
+    def truncated(self) -> bool:
+        return self.stop_reason in ("max_tokens", "max_output_tokens", "length")
+
+
+def token_usage(usage) -> Dict[str, Optional[int]]:
+    """input/output token counts from an SDK usage object (both SDKs name them the same)"""
+    counts = {}
+    for field in ("input_tokens", "output_tokens"):
+        value = getattr(usage, field, None)
+        counts[field] = value if isinstance(value, int) else None
+    return counts
+
+
+class LLMProvider:
+    """Base class for non-blocking LLM providers
+
+    Each provider owns one long-lived async SDK client, so every call made
+    through it reuses the same pooled keep-alive HTTP connections.
+    """
+    name = "base"
+
+    def __init__(self, model: str, max_tokens: int, timeout: float = LLM_TIMEOUT_SECONDS):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+
+    async def complete(self, prompt: str, instructions: Optional[str] = None,
+                       max_tokens: Optional[int] = None, timeout: Optional[float] = None,
+                       schema: Optional[JSONSchema] = None) -> Completion:
+        raise NotImplementedError
+
+    async def stream(self, prompt: str, on_delta: DeltaHandler, instructions: Optional[str] = None,
+                     max_tokens: Optional[int] = None, timeout: Optional[float] = None,
+                     schema: Optional[JSONSchema] = None) -> Completion:
+        """Like ``complete`` but hands text to ``on_delta`` as tokens arrive
+
+        With a ``schema`` the provider is made to answer with a JSON document
+        following it, returned as text like any other response.
+        """
+        raise NotImplementedError
+
+    async def aclose(self):
+        await self.client.close()
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI responses API through the async SDK client"""
+    name = "openai"
+
+    def __init__(self, api_key: str, model: str = "gpt-4.1", max_tokens: int = 20000,
+                 timeout: float = LLM_TIMEOUT_SECONDS):
+        super().__init__(model, max_tokens, timeout)
+        self.client = AsyncOpenAI(api_key=api_key, timeout=timeout, max_retries=SDK_MAX_RETRIES)
+
+    @staticmethod
+    def _format(schema: Optional[JSONSchema]) -> Dict[str, Any]:
+        if not schema:
+            return {}
+        return {"text": {"format": {"type": "json_schema", "name": STRUCTURED_OUTPUT_NAME, "schema": schema, "strict": True}}}
+
+    async def complete(self, prompt: str, instructions: Optional[str] = None,
+                       max_tokens: Optional[int] = None, timeout: Optional[float] = None,
+                       schema: Optional[JSONSchema] = None) -> Completion:
+        response = await self.client.responses.create(
+            model=self.model,
+            instructions=instructions or DEFAULT_INSTRUCTIONS,
+            input=prompt,
+            max_output_tokens=max_tokens or self.max_tokens,
+            timeout=timeout or self.timeout,
+            **self._format(schema),
+        )
+        stop_reason = None
+        if getattr(response, "incomplete_details", None):
+            stop_reason = response.incomplete_details.reason
+        return Completion(text=response.output_text, provider=self.name, model=self.model, stop_reason=stop_reason,
+                          **token_usage(getattr(response, "usage", None)))
+
+    async def stream(self, prompt: str, on_delta: DeltaHandler, instructions: Optional[str] = None,
+                     max_tokens: Optional[int] = None, timeout: Optional[float] = None,
+                     schema: Optional[JSONSchema] = None) -> Completion:
+        events = await self.client.responses.create(
+            model=self.model,
+            instructions=instructions or DEFAULT_INSTRUCTIONS,
+            input=prompt,
+            max_output_tokens=max_tokens or self.max_tokens,
+            timeout=timeout or self.timeout,
+            stream=True,
+            **self._format(schema),
+        )
+        chunks = []
+        stop_reason = None
+        usage = None
+        try:
+            async for event in events:
+                if event.type == "response.output_text.delta":
+                    chunks.append(event.delta)
+                    if await on_delta(event.delta):
+                        stop_reason = ARTIFACT_COMPLETE
+                        break
+                elif event.type == "response.incomplete":
+                    details = getattr(event.response, "incomplete_details", None)
+                    stop_reason = details.reason if details else "incomplete"
+                    usage = getattr(event.response, "usage", None)
+                elif event.type == "response.completed":
+                    usage = getattr(event.response, "usage", None)
+        finally:
+            await events.close()
+        return Completion(text="".join(chunks), provider=self.name, model=self.model, stop_reason=stop_reason,
+                          **token_usage(usage))
+
+
+class AnthropicProvider(LLMProvider):
+    """Anthropic messages API through the async SDK client
+
+    Structured responses are requested as a forced call to a tool whose input
+    schema is the response schema, which every Claude model supports; the
+    tool input is returned as the JSON text.
+    """
+    name = "anthropic"
+
+    def __init__(self, api_key: str, model: str = "claude-sonnet-4-20250514", max_tokens: int = 10000,
+                 timeout: float = LLM_TIMEOUT_SECONDS, temperature: float = 0.7):
+        super().__init__(model, max_tokens, timeout)
+        self.temperature = temperature
+        self.client = anthropic.AsyncAnthropic(api_key=api_key, timeout=timeout, max_retries=SDK_MAX_RETRIES)
+
+    @staticmethod
+    def _tool(schema: Optional[JSONSchema]) -> Dict[str, Any]:
+        if not schema:
+            return {}
+        return {
+            "tools": [{"name": STRUCTURED_OUTPUT_NAME, "description": "Submit the response.", "input_schema": schema}],
+            "tool_choice": {"type": "tool", "name": STRUCTURED_OUTPUT_NAME},
+        }
+
+    @staticmethod
+    def _text(response, schema: Optional[JSONSchema]) -> str:
+        if schema:
+            for block in response.content or []:
+                if getattr(block, "type", None) == "tool_use":
+                    return json.dumps(block.input, ensure_ascii=False)
+        return response.content[0].text if response.content else ""
+
+    @staticmethod
+    async def _tool_json(events) -> AsyncIterator[str]:
+        async for event in events:
+            if event.type == "input_json":
+                yield event.partial_json
+
+    async def complete(self, prompt: str, instructions: Optional[str] = None,
+                       max_tokens: Optional[int] = None, timeout: Optional[float] = None,
+                       schema: Optional[JSONSchema] = None) -> Completion:
+        kwargs = self._tool(schema)
+        if instructions:
+            kwargs["system"] = instructions
+        response = await self.client.messages.create(
+            model=self.model,
+            max_tokens=max_tokens or self.max_tokens,
+            temperature=self.temperature,
+            messages=[{"role": "user", "content": prompt}],
+            timeout=timeout or self.timeout,
+            **kwargs,
+        )
+        text = self._text(response, schema)
+        return Completion(text=text, provider=self.name, model=self.model, stop_reason=response.stop_reason,
+                          **token_usage(getattr(response, "usage", None)))
+
+    async def stream(self, prompt: str, on_delta: DeltaHandler, instructions: Optional[str] = None,
+                     max_tokens: Optional[int] = None, timeout: Optional[float] = None,
+                     schema: Optional[JSONSchema] = None) -> Completion:
+        kwargs = self._tool(schema)
+        if instructions:
+            kwargs["system"] = instructions
+        chunks = []
+        stop_reason = None
+        usage = None
+        async with self.client.messages.stream(
+            model=self.model,
+            max_tokens=max_tokens or self.max_tokens,
+            temperature=self.temperature,
+            messages=[{"role": "user", "content": prompt}],
+            timeout=timeout or self.timeout,
+            **kwargs,
+        ) as events:
+            deltas = self._tool_json(events) if schema else events.text_stream
+            async for text in deltas:
+                chunks.append(text)
+                if await on_delta(text):
+                    stop_reason = ARTIFACT_COMPLETE
+                    break
+            if stop_reason is None:
+                message = await events.get_final_message()
+                stop_reason = message.stop_reason
+                usage = getattr(message, "usage", None)
+        return Completion(text="".join(chunks), provider=self.name, model=self.model, stop_reason=stop_reason,
+                          **token_usage(usage))
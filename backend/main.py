@@ -1,20 +1,73 @@
-from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect, Response, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List, Dict, Any
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from typing import List, Dict, Any, Optional, Union
+from pydantic import BaseModel, Field, ValidationError
+from contextlib import asynccontextmanager
+from datetime import datetime
 import asyncio
+import base64
 import json
+import os
+import uuid
 
-from database import engine, get_db
-from models import Base, Project
-from ai_agents import AIAgents
+from database import async_engine, engine, get_async_db, init_db, SessionLocal
+from models import Project, ProjectArtifact, GenerationBatch, GenerationJob, ARTIFACT_DEFAULTS
+from ai_agents import AIAgents, best_rated
+from connections import ConnectionManager, artifact_event, progress_event
+from http_cache import IMMUTABLE, REVALIDATE, etag_matches, make_etag, not_modified, set_cache_headers
+from jobs import JobQueue
+from mermaid_parser import flowchart_graph
+from pipeline import Pipeline, Stage
+from progress import ProgressEstimator, ProgressTracker
+from progress_bus import create_progress_bus
+from similarity import SimilarityIndex, SIMILARITY_THRESHOLD, SITEMAP_REUSE_MODE
+from structured_log import get_logger, log_stats, setup_logging, shutdown_logging
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+log = get_logger("main")
 
-app = FastAPI()
 ai_agents = AIAgents()
+job_queue = JobQueue(SessionLocal)
+similarity_index = SimilarityIndex()
+estimator = ProgressEstimator()
+
+# Candidates generated per artifact; with more than one they are ranked by the critic
+CANDIDATE_COUNT = int(os.getenv("CANDIDATE_COUNT", "1"))
+# Stop waiting for slower candidates once one is rated at least this high (unset waits for all)
+CANDIDATE_EARLY_EXIT_SCORE = float(os.getenv("CANDIDATE_EARLY_EXIT_SCORE")) if os.getenv("CANDIDATE_EARLY_EXIT_SCORE") else None
+
+# Page size of GET /projects when the client does not pass ``limit``, and the largest it may ask for
+PROJECTS_PAGE_SIZE = int(os.getenv("PROJECTS_PAGE_SIZE", "50"))
+PROJECTS_MAX_PAGE_SIZE = int(os.getenv("PROJECTS_MAX_PAGE_SIZE", "200"))
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Started here rather than at import, so importing the app (e.g. in tests) writes no log files
+    setup_logging()
+    # Create or upgrade the schema before anything touches it
+    await asyncio.to_thread(init_db)
+    # Built once before any job can query or add to it
+    await asyncio.to_thread(load_similarity_index)
+    # Share progress with the other API workers, then recover jobs and start the pool
+    await progress_bus.start()
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    await progress_bus.stop()
+    # Release pooled provider and database connections
+    await ai_agents.aclose()
+    await async_engine.dispose()
+    engine.dispose()
+    # Flush queued log records last so shutdown messages are kept
+    shutdown_logging()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -23,20 +76,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-Artifact-Checksum"],
 )
+# Sitemaps and Mermaid sources are large, repetitive text
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 class ProjectCreate(BaseModel):
     name: str
     description: str
+    use_cache: bool = True  # Set False to force fresh LLM calls
+    reuse_similar: bool = True  # Allow reusing the sitemap of a near-duplicate project
+
+class BatchCreate(BaseModel):
+    # Items are validated one by one so a bad entry doesn't reject the whole import
+    items: List[Dict[str, Any]] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+    concurrency: Optional[int] = Field(None, ge=1)  # Max generations of this batch running at once
+
+class RegenerateRequest(BaseModel):
+    stage: str = Field(..., pattern="^(sitemap|frontend|backend)$")
+    index: Optional[int] = Field(None, ge=0)  # Regenerate one option instead of all of them
+    use_cache: bool = False  # The cached response is usually the one being replaced
 
 class ProjectResponse(BaseModel):
     id: str
     name: str
     description: str
-    site_maps: List[Dict[str, Any]]
-    mermaid_diagrams: List[str]
-    backend_diagrams: List[str]
-    ratings: Dict[str, Any]
+    # Artifacts are left out of GET /projects/{id} responses not asking for them via include=
+    site_maps: Optional[List[Dict[str, Any]]] = None
+    mermaid_diagrams: Optional[List[str]] = None
+    backend_diagrams: Optional[List[str]] = None
+    ratings: Optional[Dict[str, Any]] = None
+    diagram_graphs: Optional[Dict[str, Any]] = None
+    token_usage: Optional[Dict[str, Any]] = None
+    created_at: str
+
+class ArtifactResponse(BaseModel):
+    project_id: str
+    kind: str
+    content: Union[List[Any], Dict[str, Any]]
+
+class ProjectSummary(BaseModel):
+    id: str
+    name: str
+    description: str
     created_at: str
     
 class GenerationStatus(BaseModel):
@@ -44,13 +126,112 @@ class GenerationStatus(BaseModel):
     message: str
     progress: int
 
+class JobAccepted(BaseModel):
+    job_id: str
+    project_id: str
+    status: str
+
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    project_id: str
+    status: str
+    stage: Optional[str] = None
+    message: Optional[str] = None
+    progress: int
+    result: Dict[str, Any]
+    error: Optional[str] = None
+    attempts: int
+    created_at: Optional[str] = None
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
+class BatchItem(BaseModel):
+    index: int
+    status: str
+    job_id: Optional[str] = None
+    project_id: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchAccepted(BaseModel):
+    batch_id: str
+    accepted: int
+    rejected: int
+    items: List[BatchItem]
+
+class BatchResponse(BaseModel):
+    id: str
+    total: int
+    counts: Dict[str, int]  # Items per status: queued, running, completed, failed, rejected
+    items: List[Union[JobResponse, BatchItem]]
+    created_at: Optional[str] = None
+
 @app.get("/")
 async def root():
     return {"message": "Site Helper API"}
 
-@app.get("/projects", response_model=List[ProjectResponse])
-async def get_projects(db: Session = Depends(get_db)):
-    projects = db.query(Project).all()
+def encode_cursor(created_at: datetime, project_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), project_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, project_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), project_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/projects", response_model=List[Union[ProjectResponse, ProjectSummary]])
+async def get_projects(response: Response, db: AsyncSession = Depends(get_async_db),
+                       limit: int = Query(PROJECTS_PAGE_SIZE, ge=1, le=PROJECTS_MAX_PAGE_SIZE),
+                       cursor: Optional[str] = None,
+                       fields: str = Query("full", pattern="^(full|summary)$"),
+                       if_none_match: Optional[str] = Header(None)):
+    """List projects newest first
+    
+    Returns ``limit`` projects per page (PROJECTS_PAGE_SIZE by default, at most
+    PROJECTS_MAX_PAGE_SIZE); the cursor for the next page is returned in the
+    ``X-Next-Cursor`` header. ``fields=summary`` returns only
+    id, name, description and created_at without reading the artifact columns.
+    """
+    query = select(Project)
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        # Compare against the stored timestamp so its text format always matches
+        stored = select(Project.created_at).where(Project.id == last_id).scalar_subquery()
+        if (await db.execute(select(Project.id).where(Project.id == last_id))).first() is None:
+            stored = created_at
+        query = query.where(tuple_(Project.created_at, Project.id) < tuple_(stored, last_id))
+    # Fetch one extra row to learn whether another page exists
+    query = query.order_by(Project.created_at.desc(), Project.id.desc()).limit(limit + 1)
+    
+    # Validate against ids, timestamps and artifact checksums before reading any content
+    keys = (await db.execute(query.with_only_columns(Project.id, Project.created_at, Project.updated_at))).all()
+    checksums = []
+    if fields == "full":
+        page_ids = query.with_only_columns(Project.id).subquery()
+        checksums = (await db.execute(
+            select(ProjectArtifact.project_id, ProjectArtifact.kind, ProjectArtifact.checksum)
+            .where(ProjectArtifact.project_id.in_(select(page_ids.c.id)))
+            .order_by(ProjectArtifact.project_id, ProjectArtifact.kind)
+        )).all()
+    etag = make_etag(fields, limit, cursor, [tuple(k) for k in keys], [tuple(c) for c in checksums])
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
+    if len(keys) > limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(keys[limit - 1].created_at, keys[limit - 1].id)
+    
+    if fields == "summary":
+        rows = (await db.execute(
+            query.with_only_columns(Project.id, Project.name, Project.description, Project.created_at)
+        )).all()[:limit]
+        return [
+            ProjectSummary(id=p.id, name=p.name, description=p.description, created_at=p.created_at.isoformat())
+            for p in rows
+        ]
+    # Load every project's artifacts in one extra query instead of one per project
+    rows = (await db.execute(query.options(selectinload(Project.artifacts)))).scalars().all()[:limit]
     return [
         ProjectResponse(
             id=p.id,
@@ -60,162 +241,615 @@ async def get_projects(db: Session = Depends(get_db)):
             mermaid_diagrams=p.mermaid_diagrams or [],
             backend_diagrams=p.backend_diagrams or [],
             ratings=p.ratings or {},
+            diagram_graphs=p.diagram_graphs or {},
             created_at=p.created_at.isoformat()
         )
-        for p in projects
+        for p in rows
     ]
 
-@app.get("/projects/{project_id}", response_model=ProjectResponse)
-async def get_project(project_id: str, db: Session = Depends(get_db)):
-    project = db.query(Project).filter(Project.id == project_id).first()
+# Project fields besides the artifacts that ``include`` can ask for
+INCLUDE_FIELDS = ("token_usage",)
+
+def parse_include(include: Optional[str]) -> List[str]:
+    """Artifact kinds and fields requested by an ``include`` parameter; omitted means all"""
+    if include is None:
+        return list(ARTIFACT_DEFAULTS) + list(INCLUDE_FIELDS)
+    kinds = [kind.strip() for kind in include.split(",") if kind.strip()]
+    unknown = [kind for kind in kinds if kind not in ARTIFACT_DEFAULTS and kind not in INCLUDE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown artifact kind(s): {', '.join(unknown)}")
+    return kinds
+
+@app.get("/projects/{project_id}", response_model=ProjectResponse, response_model_exclude_unset=True)
+async def get_project(project_id: str, response: Response, include: Optional[str] = None,
+                      if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    """Fetch one project
+    
+    ``include`` is a comma-separated list of artifact kinds (and
+    ``token_usage``) to return, e.g. ``include=site_maps,ratings``; an empty
+    value returns none and omitting it returns all of them.
+    """
+    requested = parse_include(include)
+    kinds = [kind for kind in requested if kind in ARTIFACT_DEFAULTS]
+    project = (await db.execute(
+        select(Project.id, Project.name, Project.description, Project.created_at, Project.updated_at)
+        .where(Project.id == project_id)
+    )).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
+    checksums = []
+    if kinds:
+        checksums = (await db.execute(
+            select(ProjectArtifact.kind, ProjectArtifact.checksum)
+            .where(ProjectArtifact.project_id == project_id, ProjectArtifact.kind.in_(kinds))
+            .order_by(ProjectArtifact.kind)
+        )).all()
+    etag = make_etag(tuple(project), sorted(requested), [tuple(c) for c in checksums])
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
+    
+    # Read only the requested artifact rows
+    artifacts = {}
+    if kinds:
+        rows = (await db.execute(
+            select(ProjectArtifact.kind, ProjectArtifact.content)
+            .where(ProjectArtifact.project_id == project_id, ProjectArtifact.kind.in_(kinds))
+        )).all()
+        artifacts = {row.kind: row.content for row in rows}
+    if "token_usage" in requested:
+        artifacts["token_usage"] = await db.scalar(select(Project.token_usage).where(Project.id == project_id))
+    
     return ProjectResponse(
         id=project.id,
         name=project.name,
         description=project.description,
-        site_maps=project.site_maps or [],
-        mermaid_diagrams=project.mermaid_diagrams or [],
-        backend_diagrams=project.backend_diagrams or [],
-        ratings=project.ratings or {},
-        created_at=project.created_at.isoformat()
+        created_at=project.created_at.isoformat(),
+        **{kind: artifacts.get(kind) or ARTIFACT_DEFAULTS[kind]() for kind in kinds},
+        **({"token_usage": artifacts["token_usage"]} if "token_usage" in requested else {})
     )
 
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def send_progress(self, project_id: str, step: str, message: str, progress: int):
-        progress_data = {
-            "project_id": project_id,
-            "step": step,
-            "message": message,
-            "progress": progress,
-            "timestamp": asyncio.get_event_loop().time()
-        }
-        
-        # Send to all connected clients (in production, you'd filter by project_id)
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(json.dumps(progress_data))
-            except:
-                disconnected.append(connection)
-        
-        # Remove disconnected clients
-        for connection in disconnected:
-            self.active_connections.remove(connection)
+@app.get("/projects/{project_id}/artifacts/{kind}", response_model=ArtifactResponse)
+async def get_project_artifact(project_id: str, kind: str, response: Response, v: Optional[str] = None,
+                               if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    """Fetch one artifact
+    
+    Requests pinned to the artifact's current checksum with ``v`` may be
+    cached indefinitely, since a changed artifact gets a new checksum.
+    """
+    if kind not in ARTIFACT_DEFAULTS:
+        raise HTTPException(status_code=404, detail="Unknown artifact kind")
+    artifact = select(ProjectArtifact).where(ProjectArtifact.project_id == project_id, ProjectArtifact.kind == kind)
+    checksum = await db.scalar(artifact.with_only_columns(ProjectArtifact.checksum))
+    if checksum is None and await db.scalar(select(Project.id).where(Project.id == project_id)) is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    etag = make_etag(project_id, kind, checksum)
+    cache_control = IMMUTABLE if checksum and v == checksum else REVALIDATE
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, cache_control)
+    set_cache_headers(response, etag, cache_control)
+    response.headers["X-Artifact-Checksum"] = checksum or ""
+    
+    content = None
+    if checksum is not None:
+        content = await db.scalar(artifact.with_only_columns(ProjectArtifact.content))
+    if content is None:
+        content = ARTIFACT_DEFAULTS[kind]()
+    return ArtifactResponse(project_id=project_id, kind=kind, content=content)
 
+# WebSocket connection manager for this process's sockets
 manager = ConnectionManager()
+# Progress published by any API worker reaches every worker's manager
+progress_bus = create_progress_bus(manager.deliver)
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def handle_client_messages(websocket: WebSocket):
+    """Apply subscribe/unsubscribe requests until the client disconnects"""
     try:
         while True:
-            # Keep connection alive
-            await websocket.receive_text()
+            text = await websocket.receive_text()
+            try:
+                message = json.loads(text)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(message, dict) or not message.get("project_id"):
+                continue
+            if message.get("action") == "subscribe":
+                manager.subscribe(websocket, message["project_id"])
+            elif message.get("action") == "unsubscribe":
+                manager.unsubscribe(websocket, message["project_id"])
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
-@app.post("/projects", response_model=ProjectResponse)
-async def create_project(project: ProjectCreate, db: Session = Depends(get_db)):
-    # Create new project
-    db_project = Project(
-        name=project.name,
-        description=project.description
-    )
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    # Clients send {"action": "subscribe", "project_id": ...} to pick their topics
+    await manager.connect(websocket)
+    await handle_client_messages(websocket)
+
+@app.websocket("/ws/{project_id}")
+async def project_websocket_endpoint(websocket: WebSocket, project_id: str):
+    await manager.connect(websocket, project_id)
+    await handle_client_messages(websocket)
+
+# Live progress trackers for generations running in this process
+progress_trackers: Dict[str, ProgressTracker] = {}
+
+async def report_progress(project_id: str, step: str, message: str, progress: Optional[int] = None):
+    """Forward progress to WebSocket clients and the owning job record
+    
+    When ``progress`` is omitted, the percentage and ETA come from the
+    project's tracker, i.e. from measured stage durations.
+    """
+    tracker = progress_trackers.get(project_id)
+    eta_seconds = None
+    if tracker and progress is None:
+        progress = tracker.progress()
+        eta_seconds = tracker.eta()
+    elif progress is None:
+        progress = 0
+    job_queue.record_progress(project_id, step, message, progress)
+    await progress_bus.publish(progress_event(project_id, step, message, progress, eta_seconds))
+
+async def report_artifact(project_id: str, artifact: str, index: int, content: Any, complete: bool):
+    """Forward partial and final generated artifacts to WebSocket clients"""
+    await progress_bus.publish(artifact_event(project_id, artifact, index, content, complete))
+
+ai_agents.set_progress_callback(report_progress)
+ai_agents.set_artifact_callback(report_artifact)
+ai_agents.set_latency_recorder(estimator.record)
+
+# Token usage of generations running in this process, saved with the project
+project_usage: Dict[str, Dict[str, Any]] = {}
+
+def add_usage(usage: Dict[str, Any], stage: str, input_tokens: int, output_tokens: int, calls: int = 1, cached_calls: int = 0):
+    """Add token counts to a usage record, in total and under ``stage``"""
+    for bucket in (usage, usage.setdefault("stages", {}).setdefault(stage, {})):
+        bucket["input_tokens"] = bucket.get("input_tokens", 0) + input_tokens
+        bucket["output_tokens"] = bucket.get("output_tokens", 0) + output_tokens
+        bucket["calls"] = bucket.get("calls", 0) + calls
+        bucket["cached_calls"] = bucket.get("cached_calls", 0) + cached_calls
+
+def merge_usage(total: Optional[Dict[str, Any]], usage: Dict[str, Any]) -> Dict[str, Any]:
+    merged = {}
+    for record in (total or {}, usage):
+        for stage, counts in record.get("stages", {}).items():
+            add_usage(merged, stage, counts["input_tokens"], counts["output_tokens"], counts["calls"], counts["cached_calls"])
+    return merged
+
+def record_usage(project_id: str, task: str, completion):
+    usage = project_usage.get(project_id)
+    if usage is None:
+        return
+    if completion.stop_reason == "cached":
+        # Answered from the response cache: no tokens sent
+        add_usage(usage, task, 0, 0, cached_calls=1)
+    else:
+        add_usage(usage, task, completion.input_tokens or 0, completion.output_tokens or 0)
+
+ai_agents.set_usage_recorder(record_usage)
+
+def diagram_graphs(diagrams: List[Optional[str]]) -> List[Optional[Dict[str, Any]]]:
+    """Parsed graph of each diagram (None where one does not parse), stored so clients need not parse them"""
+    return [flowchart_graph(diagram) if diagram else None for diagram in diagrams]
+
+def load_similarity_index():
+    """Rebuild the near-duplicate index from the stored project descriptions"""
+    db = job_queue.session_factory()
+    try:
+        similarity_index.load(db.query(Project.id, Project.description).all())
+    finally:
+        db.close()
+
+async def find_similar_project(db: Session, description: str):
+    """Return (project id, site maps, similarity) for the closest stored description above the threshold"""
+    match = similarity_index.best_match(description, SIMILARITY_THRESHOLD)
+    if not match:
+        return None
+    
+    def load_site_maps():
+        similar = db.query(Project).filter(Project.id == match[0]).first()
+        return similar.site_maps if similar else None
+    
+    site_maps = await asyncio.to_thread(load_site_maps)
+    if not site_maps:
+        return None
+    return match[0], site_maps, match[1]
+
+async def generate_sitemap_stage(project_id: str, description: str, db: Session,
+                                 use_cache: bool = True, reuse_similar: bool = True) -> Dict[str, Any]:
+    """Pipeline stage: reuse a near-duplicate's sitemap or generate new candidates"""
+    source = {"mode": "generated"}
+    seed_site_map = None
+    
+    if reuse_similar and SITEMAP_REUSE_MODE in ("draft", "seed"):
+        match = await find_similar_project(db, description)
+        if match:
+            similar_id, similar_site_maps, score = match
+            source = {
+                "mode": "reused" if SITEMAP_REUSE_MODE == "draft" else "seeded",
+                "project_id": similar_id,
+                "similarity": round(score, 3)
+            }
+            if SITEMAP_REUSE_MODE == "draft":
+                await report_progress(project_id, "sitemap", f"Found a {score:.0%} similar project, reusing its sitemap...")
+                return {"site_maps": similar_site_maps, "source": source}
+            seed_site_map = similar_site_maps[0]
+            await report_progress(project_id, "sitemap", f"Found a {score:.0%} similar project, using its sitemap as a starting point...")
+    
+    ratings = []
+    if CANDIDATE_COUNT > 1:
+        site_maps, ratings = await rank_stage(project_id, "sitemap", "site maps", description, ai_agents.site_map_candidates(
+            description, CANDIDATE_COUNT, project_id, use_cache, seed_site_map
+        ), use_cache)
+    else:
+        site_maps = await ai_agents.generate_site_maps(description, project_id=project_id, use_cache=use_cache,
+                                                       seed_site_map=seed_site_map)
+    await report_progress(project_id, "sitemap", "Page hierarchy and navigation flow established")
+    return {"site_maps": site_maps, "source": source, "ratings": ratings}
+
+async def rank_stage(project_id: str, step: str, artifact_type: str, description: str, candidates: List[Any],
+                     use_cache: bool = True):
+    """Generate a stage's candidates concurrently and have the critic rate them"""
+    await report_progress(project_id, step, f"Generating {len(candidates)} {artifact_type} candidates...")
+    artifacts, ratings = await ai_agents.rank_candidates(candidates, artifact_type, description,
+                                                         early_exit_score=CANDIDATE_EARLY_EXIT_SCORE, use_cache=use_cache,
+                                                         project_id=project_id)
+    if ratings:
+        best = max(ratings, key=lambda rating: rating["overall_score"])
+        await report_progress(project_id, step, f"Best of {len(artifacts)} {artifact_type} scored {best['overall_score']}")
+    return artifacts, ratings
+
+async def frontend_stage(project_id: str, description: str, sitemap: Dict[str, Any], use_cache: bool = True):
+    """Pipeline stage: frontend diagrams for the best rated sitemap"""
+    site_maps = sitemap["site_maps"]
+    site_map = site_maps[best_rated(sitemap.get("ratings"))] if site_maps else {"pages": []}
+    if CANDIDATE_COUNT > 1:
+        return await rank_stage(project_id, "architecture", "frontend architecture diagrams", description,
+                                ai_agents.mermaid_diagram_candidates(description, site_map, CANDIDATE_COUNT, project_id, use_cache),
+                                use_cache)
+    return await ai_agents.generate_mermaid_diagrams(description, site_map, project_id=project_id, use_cache=use_cache), []
+
+async def backend_stage(project_id: str, description: str, use_cache: bool = True):
+    """Pipeline stage: backend diagrams, which only need the description"""
+    if CANDIDATE_COUNT > 1:
+        return await rank_stage(project_id, "backend", "backend architecture diagrams", description,
+                                ai_agents.backend_diagram_candidates(description, CANDIDATE_COUNT, project_id, use_cache),
+                                use_cache)
+    return await ai_agents.generate_backend_diagrams(description, project_id=project_id, use_cache=use_cache), []
+
+async def generate_project(job_id: str, project_id: str, payload: Dict[str, Any], db: Session) -> Dict[str, Any]:
+    """Run the full generation pipeline for a queued project creation job"""
+    description = payload["description"]
+    use_cache = payload.get("use_cache", True)
+    reuse_similar = payload.get("reuse_similar", True)
     
     try:
-        project_id = db_project.id
+        # Backend diagrams only need the description, so they run alongside the sitemap
+        pipeline = Pipeline([
+            Stage("sitemap", lambda deps: generate_sitemap_stage(project_id, description, db, use_cache, reuse_similar)),
+            Stage("frontend", lambda deps: frontend_stage(project_id, description, deps["sitemap"], use_cache),
+                  depends_on=["sitemap"]),
+            Stage("backend", lambda deps: backend_stage(project_id, description, use_cache)),
+        ])
+        tracker = ProgressTracker(estimator, {**pipeline.plan(), "finalize": list(pipeline.stages)})
+        pipeline.on_stage_start = tracker.start
+        pipeline.on_stage_end = tracker.finish
+        progress_trackers[project_id] = tracker
+        project_usage[project_id] = {}
         
-        # Set up progress callback for AI agents
-        ai_agents.set_progress_callback(manager.send_progress)
+        await report_progress(project_id, "planning", "Starting AI project analysis...")
+        outcome = await pipeline.run()
+        site_maps = outcome.results["sitemap"]["site_maps"]
+        sitemap_source = outcome.results["sitemap"]["source"]
+        mermaid_diagrams, frontend_ratings = outcome.results["frontend"]
+        backend_diagrams, backend_ratings = outcome.results["backend"]
+        # Keyed like the artifacts; the project pages show the best rated option
+        ratings = {kind: value for kind, value in (
+            ("site_maps", outcome.results["sitemap"].get("ratings")),
+            ("mermaid_diagrams", frontend_ratings),
+            ("backend_diagrams", backend_ratings),
+        ) if value}
+        log.info("Pipeline finished", project_id=project_id, timings=outcome.timings_dict())
         
-        # Step 1: Planning site structure
-        await manager.send_progress(project_id, "planning", "Starting AI project analysis...", 5)
-        await asyncio.sleep(0.3)
-        await manager.send_progress(project_id, "planning", "Analyzing project requirements and planning site structure...", 10)
-        await asyncio.sleep(0.5)
-        await manager.send_progress(project_id, "planning", "Identifying key user personas and use cases...", 15)
-        await asyncio.sleep(0.3)
-        await manager.send_progress(project_id, "planning", "Determining core functionality and features...", 20)
+        # Final step: Finalizing
+        tracker.start("finalize")
+        await report_progress(project_id, "finalize", "Saving project artifacts to database...")
         
-        site_maps = await ai_agents.generate_site_maps(project.description, project_id=project_id)
+        graphs = {"mermaid_diagrams": diagram_graphs(mermaid_diagrams),
+                  "backend_diagrams": diagram_graphs(backend_diagrams)}
         
-        # Step 2: Creating site maps  
-        await manager.send_progress(project_id, "sitemap", "Sitemap generation completed, validating structure...", 48)
-        await asyncio.sleep(0.3)
-        best_site_map = site_maps[0] if site_maps else {"pages": []}
-        await manager.send_progress(project_id, "sitemap", "Page hierarchy and navigation flow established", 52)
+        def save_project(session: Session):
+            session.add(Project(
+                id=project_id,
+                name=payload["name"],
+                description=description,
+                site_maps=site_maps,
+                mermaid_diagrams=mermaid_diagrams,
+                backend_diagrams=backend_diagrams,
+                ratings=ratings,
+                diagram_graphs=graphs,
+                token_usage=project_usage.get(project_id) or None
+            ))
         
-        # Step 3: Designing architecture diagrams
-        mermaid_diagrams = await ai_agents.generate_mermaid_diagrams(project.description, best_site_map, project_id=project_id)
+        # Group-committed with other generations' writes; returns once durable
+        await job_queue.writer.write(save_project)
+        similarity_index.add(project_id, description)
+        tracker.finish("finalize")
         
-        # Step 4: Backend diagrams
-        backend_diagrams = await ai_agents.generate_backend_diagrams(project.description, project_id=project_id)
+        await report_progress(project_id, "finalize", "Project structure complete! Redirecting...", 100)
+        return {"project_id": project_id, "timings": outcome.timings_dict(), "sitemap_source": sitemap_source,
+                "token_usage": project_usage.get(project_id) or {}}
         
-        # Final step: Finalizing
-        await manager.send_progress(project_id, "finalize", "Saving project artifacts to database...", 92)
-        await asyncio.sleep(0.5)
-        await manager.send_progress(project_id, "finalize", "Securing project data and setting permissions...", 95)
-        await asyncio.sleep(0.3)
-        await manager.send_progress(project_id, "finalize", "Project structure complete! Redirecting...", 100)
+    except Exception as e:
+        await asyncio.to_thread(db.rollback)
+        await report_progress(project_id, "error", f"Error: {str(e)}", 0)
+        raise
+    finally:
+        progress_trackers.pop(project_id, None)
+        project_usage.pop(project_id, None)
+
+job_queue.register("create_project", generate_project)
+
+# Pipeline stage -> the artifact kind it produces
+STAGE_ARTIFACTS = {"sitemap": "site_maps", "frontend": "mermaid_diagrams", "backend": "backend_diagrams"}
+DIAGRAM_KINDS = ("mermaid_diagrams", "backend_diagrams")
+ARTIFACT_TYPES = {"site_maps": "site maps", "mermaid_diagrams": "frontend architecture diagrams",
+                  "backend_diagrams": "backend architecture diagrams"}
+
+async def regenerate_artifact(job_id: str, project_id: str, payload: Dict[str, Any], db: Session) -> Dict[str, Any]:
+    """Re-run one pipeline stage for a stored project and replace only its artifact"""
+    stage = payload["stage"]
+    kind = STAGE_ARTIFACTS[stage]
+    use_cache = payload.get("use_cache", False)
+    
+    def load():
+        try:
+            project = db.query(Project).filter(Project.id == project_id).first()
+            if not project:
+                raise ValueError("Project not found")
+            return project.description, project.site_maps or [], project.ratings or {}, list(getattr(project, kind) or [])
+        finally:
+            db.rollback()
+    
+    description, site_maps, stored_ratings, existing = await asyncio.to_thread(load)
+    # The frontend is drawn from the best rated sitemap, as when the project was created
+    site_map = site_maps[best_rated(stored_ratings.get("site_maps"))] if site_maps else {"pages": []}
+    count = len(existing) or 1
+    indices = [payload["index"]] if payload.get("index") is not None else list(range(count))
+    
+    tracker = ProgressTracker(estimator, {stage: [], "finalize": [stage]})
+    progress_trackers[project_id] = tracker
+    project_usage[project_id] = {}
+    try:
+        await report_progress(project_id, "planning", f"Regenerating {stage} artifact(s) {', '.join(str(i + 1) for i in indices)}...")
+        tracker.start(stage)
+        if stage == "sitemap":
+            results = await ai_agents.generate_site_maps(description, count=count, project_id=project_id,
+                                                         use_cache=use_cache, indices=indices)
+        elif stage == "frontend":
+            results = await ai_agents.generate_mermaid_diagrams(description, site_map, count=count, project_id=project_id,
+                                                                use_cache=use_cache, indices=indices)
+        else:
+            results = await ai_agents.generate_backend_diagrams(description, count=count, project_id=project_id,
+                                                                use_cache=use_cache, indices=indices)
         
-        # Store results
-        db_project.site_maps = site_maps
-        db_project.mermaid_diagrams = mermaid_diagrams
-        db_project.backend_diagrams = backend_diagrams
-        db_project.ratings = {}
+        # Stored ratings describe the old artifacts; rate the new set so the best one is shown
+        ratings = None
+        merged = existing + [None] * (count - len(existing))
+        for index, content in zip(indices, results):
+            merged[index] = content
+        if count > 1:
+            await report_progress(project_id, stage, f"Rating the {ARTIFACT_TYPES[kind]}...")
+            rated = await ai_agents.rate_candidates({i: a for i, a in enumerate(merged) if a is not None},
+                                                    ARTIFACT_TYPES[kind], description, use_cache, project_id)
+            ratings = [{**rated[i], "index": i} for i in sorted(rated)] or None
+        tracker.finish(stage)
         
-        db.add(db_project)
-        db.commit()
-        db.refresh(db_project)
+        tracker.start("finalize")
+        await report_progress(project_id, "finalize", "Saving regenerated artifact...")
         
-        return ProjectResponse(
-            id=db_project.id,
-            name=db_project.name,
-            description=db_project.description,
-            site_maps=db_project.site_maps,
-            mermaid_diagrams=db_project.mermaid_diagrams,
-            backend_diagrams=db_project.backend_diagrams,
-            ratings=db_project.ratings,
-            created_at=db_project.created_at.isoformat()
-        )
+        def save_artifact(session: Session):
+            # Merge into the current list rather than the one read at the start, which may be stale
+            stored = session.query(Project).filter(Project.id == project_id).first()
+            if stored is None:
+                raise ValueError("Project was deleted during regeneration")
+            current = list(getattr(stored, kind) or [])
+            for index, content in zip(indices, results):
+                current.extend([None] * (index + 1 - len(current)))
+                current[index] = content
+            setattr(stored, kind, current)
+            stored_ratings = dict(stored.ratings or {})
+            if ratings:
+                stored_ratings[kind] = ratings
+            else:
+                stored_ratings.pop(kind, None)
+            stored.ratings = stored_ratings
+            if kind in DIAGRAM_KINDS:
+                stored.diagram_graphs = {**(stored.diagram_graphs or {}), kind: diagram_graphs(current)}
+            if project_usage.get(project_id):
+                stored.token_usage = merge_usage(stored.token_usage, project_usage[project_id])
         
+        await job_queue.writer.write(save_artifact)
+        tracker.finish("finalize")
+        await report_progress(project_id, "finalize", "Artifact regenerated!", 100)
+        return {"project_id": project_id, "stage": stage, "artifact": kind, "indices": indices,
+                "token_usage": project_usage.get(project_id) or {}}
     except Exception as e:
-        db.rollback()
-        await manager.send_progress(project_id, "error", f"Error: {str(e)}", 0)
-        raise HTTPException(status_code=500, detail=str(e))
+        await report_progress(project_id, "error", f"Error: {str(e)}", 0)
+        raise
+    finally:
+        progress_trackers.pop(project_id, None)
+        project_usage.pop(project_id, None)
+
+job_queue.register("regenerate_artifact", regenerate_artifact)
+
+def job_to_response(job: GenerationJob) -> JobResponse:
+    return JobResponse(
+        id=job.id,
+        kind=job.kind,
+        project_id=job.project_id,
+        status=job.status,
+        stage=job.stage,
+        message=job.message,
+        progress=job.progress or 0,
+        result=job.result or {},
+        error=job.error,
+        attempts=job.attempts or 0,
+        created_at=job.created_at.isoformat() if job.created_at else None,
+        started_at=job.started_at.isoformat() if job.started_at else None,
+        finished_at=job.finished_at.isoformat() if job.finished_at else None
+    )
+
+@app.post("/projects", response_model=JobAccepted, status_code=202)
+async def create_project(project: ProjectCreate, response: Response):
+    # Queue generation and return immediately; progress is reported via /ws and /jobs/{id}
+    project_id = str(uuid.uuid4())
+    job = await job_queue.enqueue("create_project", project_id, {
+        "name": project.name,
+        "description": project.description,
+        "use_cache": project.use_cache,
+        "reuse_similar": project.reuse_similar
+    })
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return JobAccepted(job_id=job.id, project_id=project_id, status=job.status)
+
+@app.post("/projects/batch", response_model=BatchAccepted, status_code=202)
+async def create_projects_batch(batch: BatchCreate, response: Response):
+    """Queue one generation per valid item
+    
+    Invalid items are reported as rejected and the rest are still queued.
+    At most ``concurrency`` (default ``BATCH_CONCURRENCY``) of the batch's
+    generations run at once, leaving workers free for other requests; track
+    the whole import with ``GET /batches/{batch_id}``.
+    """
+    batch_id = str(uuid.uuid4())
+    concurrency = batch.concurrency or BATCH_CONCURRENCY
+    items: List[Optional[ProjectCreate]] = []
+    results: List[BatchItem] = []
+    for index, raw in enumerate(batch.items):
+        try:
+            items.append(ProjectCreate.model_validate(raw))
+        except ValidationError as e:
+            items.append(None)
+            results.append(BatchItem(index=index, status="rejected", error=str(e.errors()[0]["msg"])))
+    
+    async def enqueue(index: int, project: ProjectCreate) -> BatchItem:
+        project_id = str(uuid.uuid4())
+        job = await job_queue.enqueue("create_project", project_id, {
+            **project.model_dump(), "group": batch_id, "group_limit": concurrency
+        })
+        return BatchItem(index=index, status=job.status, job_id=job.id, project_id=project_id)
+    
+    # Concurrent enqueues share group commits instead of one transaction per item
+    results += await asyncio.gather(*(enqueue(i, p) for i, p in enumerate(items) if p is not None))
+    results.sort(key=lambda item: item.index)
+    
+    rejected = [{"index": item.index, "error": item.error} for item in results if item.status == "rejected"]
+    job_ids = [item.job_id for item in results]
+    await job_queue.writer.write(lambda db: db.add(GenerationBatch(
+        id=batch_id, job_ids=job_ids, rejected=rejected, concurrency=concurrency
+    )))
+    response.headers["Location"] = f"/batches/{batch_id}"
+    return BatchAccepted(batch_id=batch_id, accepted=len(results) - len(rejected), rejected=len(rejected), items=results)
+
+@app.get("/batches/{batch_id}", response_model=BatchResponse)
+async def get_batch(batch_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Per-item status, progress and result of a bulk import"""
+    batch = await db.get(GenerationBatch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    jobs = {
+        job.id: job for job in
+        (await db.execute(select(GenerationJob).where(GenerationJob.id.in_([i for i in batch.job_ids if i])))).scalars()
+    }
+    errors = {entry["index"]: entry["error"] for entry in batch.rejected or []}
+    items = []
+    counts: Dict[str, int] = {}
+    for index, job_id in enumerate(batch.job_ids):
+        job = jobs.get(job_id)
+        item = job_to_response(job) if job else BatchItem(index=index, status="rejected", error=errors.get(index))
+        counts[item.status] = counts.get(item.status, 0) + 1
+        items.append(item)
+    return BatchResponse(id=batch.id, total=len(items), counts=counts, items=items,
+                         created_at=batch.created_at.isoformat() if batch.created_at else None)
+
+@app.post("/projects/{project_id}/regenerate", response_model=JobAccepted, status_code=202)
+async def regenerate_project_artifact(project_id: str, request: RegenerateRequest, response: Response,
+                                      db: AsyncSession = Depends(get_async_db)):
+    """Queue a re-run of one stage (optionally one option of it) using the project's stored inputs
+    
+    Only that artifact is replaced; progress is reported via /ws and /jobs/{id}.
+    """
+    if await db.scalar(select(Project.id).where(Project.id == project_id)) is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if request.index is not None:
+        content = await db.scalar(select(ProjectArtifact.content).where(
+            ProjectArtifact.project_id == project_id, ProjectArtifact.kind == STAGE_ARTIFACTS[request.stage]
+        ))
+        if request.index >= max(len(content or []), 1):
+            raise HTTPException(status_code=400, detail="Artifact index out of range")
+    # Progress, usage and the saved artifact list of a regeneration are per project; one at a time
+    if await db.scalar(select(GenerationJob.id).where(
+        GenerationJob.project_id == project_id, GenerationJob.kind == "regenerate_artifact",
+        GenerationJob.status.in_(("queued", "running"))
+    ).limit(1)) is not None:
+        raise HTTPException(status_code=409, detail="A regeneration of this project is already in progress")
+    
+    job = await job_queue.enqueue("regenerate_artifact", project_id, request.model_dump())
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return JobAccepted(job_id=job.id, project_id=project_id, status=job.status)
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_to_response(job)
+
+@app.get("/progress/stats")
+async def get_progress_stats():
+    # Rolling stage and provider latency percentiles behind the progress/ETA estimates
+    return estimator.snapshot()
+
+@app.get("/llm-cache/stats")
+async def get_llm_cache_stats():
+    if not ai_agents.cache:
+        return {"enabled": False}
+    return {"enabled": True, **ai_agents.cache.get_stats()}
+
+@app.get("/providers/stats")
+async def get_provider_stats():
+    # Circuit breaker states, hedging/fallback counters and rate limiter queues
+    return {**ai_agents.router.snapshot(), "limits": ai_agents.limiters.snapshot()}
+
+@app.get("/logging/stats")
+async def get_logging_stats():
+    # Records waiting for the log writer and records dropped because its queue was full
+    return log_stats()
 
 @app.delete("/projects")
-async def delete_all_projects(db: Session = Depends(get_db)):
+async def delete_all_projects(db: AsyncSession = Depends(get_async_db)):
     try:
-        # Delete all projects
-        deleted_count = db.query(Project).delete()
-        db.commit()
+        # Delete all projects; bulk deletes bypass the ORM cascade, so clear artifacts too
+        await db.execute(delete(ProjectArtifact))
+        deleted_count = (await db.execute(delete(Project))).rowcount
+        await db.commit()
+        similarity_index.clear()
         return {"message": f"Successfully deleted {deleted_count} projects"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/projects/{project_id}")
-async def delete_project(project_id: str, db: Session = Depends(get_db)):
-    project = db.query(Project).filter(Project.id == project_id).first()
-    if not project:
+async def delete_project(project_id: str, db: AsyncSession = Depends(get_async_db)):
+    await db.execute(delete(ProjectArtifact).where(ProjectArtifact.project_id == project_id))
+    if not (await db.execute(delete(Project).where(Project.id == project_id))).rowcount:
+        await db.rollback()
         raise HTTPException(status_code=404, detail="Project not found")
-    
-    db.delete(project)
-    db.commit()
+    await db.commit()
+    similarity_index.remove(project_id)
     return {"message": "Project deleted successfully"}
 
 if __name__ == "__main__":
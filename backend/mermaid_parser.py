@@ -0,0 +1,385 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+# Parsed diagrams kept in memory, keyed by their source text
+MERMAID_CACHE_SIZE = int(os.getenv("MERMAID_CACHE_SIZE", "512"))
+
+# House style every node is drawn in: black boxes with white text and outlines
+BLACK_BOX_CLASS = "blackBox"
+BLACK_BOX_STYLE = "fill:#000,stroke:#fff,stroke-width:2px,color:#fff"
+
+# TD is an alias of TB; both are kept as written
+DIRECTIONS = {"TB", "TD", "BT", "LR", "RL"}
+
+# Node shapes as (opening, closing, name); longer openers are tried first
+SHAPES = [
+    ("(((", ")))", "double_circle"),
+    ("([", "])", "stadium"),
+    ("[[", "]]", "subroutine"),
+    ("[(", ")]", "cylinder"),
+    ("((", "))", "circle"),
+    ("{{", "}}", "hexagon"),
+    ("[/", "/]", "parallelogram"),
+    ("[/", "\\]", "trapezoid"),
+    ("[\\", "\\]", "parallelogram_alt"),
+    ("[\\", "/]", "trapezoid_alt"),
+    ("[", "]", "rect"),
+    ("(", ")", "round"),
+    ("{", "}", "rhombus"),
+    (">", "]", "asymmetric"),
+]
+SHAPE_DELIMITERS = {name: (opening, closing) for opening, closing, name in SHAPES}
+
+NODE_ID = re.compile(r"\s*([A-Za-z0-9_]+(?:[.\-][A-Za-z0-9_]+)*)")
+NODE_CLASS = re.compile(r":::([A-Za-z0-9_\-]+)")
+NODE_SEPARATOR = re.compile(r"\s*&\s*")
+QUOTE = re.compile(r'\s*"')
+SPACE = re.compile(r"\s*")
+# A -- text --> B, A -. text .-> B, A == text ==> B
+TEXT_LINK = re.compile(r"\s*(<?)(--|==|-\.)\s*(?![-=>.|\s])(.+?)\s*(-{2,}|={2,}|\.-+)(>|[ox](?!\w))?\s*")
+# A --> B, A -.-> B, A ==> B, A --- B, A ~~~ B, with an optional |text|
+LINK = re.compile(r"\s*(<?)(-{2,}|={2,}|-\.+-|~{3,})(>|[ox](?!\w))?\s*(?:\|([^|]*)\|\s*)?")
+# Labels that render the same without quotes
+PLAIN_LABEL = re.compile(r"^[\w ,.:'!?/+-]*$")
+
+IGNORED_STATEMENTS = ("class", "style", "linkStyle", "click")
+
+
+class MermaidSyntaxError(ValueError):
+    """A diagram outside the flowchart subset we generate, with the line it failed on"""
+
+    def __init__(self, message: str, line: Optional[int] = None):
+        super().__init__(f"line {line}: {message}" if line else message)
+        self.line = line
+
+
+@dataclass(frozen=True)
+class Node:
+    id: str
+    label: str
+    shape: str = "rect"
+    subgraph: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Edge:
+    source: str
+    target: str
+    arrow: str = "-->"  # Normalized link, e.g. "-->", "---", "-.->", "==>", "<-->"
+    label: str = ""
+
+
+@dataclass(frozen=True)
+class Subgraph:
+    id: str
+    title: str
+    parent: Optional[str] = None
+    direction: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Flowchart:
+    """Node/edge AST of a flowchart; styling is not kept, every node renders as a black box"""
+    direction: str
+    nodes: Tuple[Node, ...]
+    edges: Tuple[Edge, ...]
+    subgraphs: Tuple[Subgraph, ...] = ()
+
+    @property
+    def node_count(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.edges)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Compact JSON form: rows instead of objects"""
+        return {
+            "direction": self.direction,
+            "nodes": [[n.id, n.label, n.shape, n.subgraph] for n in self.nodes],
+            "edges": [[e.source, e.target, e.arrow, e.label] for e in self.edges],
+            "subgraphs": [[s.id, s.title, s.parent, s.direction] for s in self.subgraphs],
+            "counts": {"nodes": self.node_count, "edges": self.edge_count},
+        }
+
+    def render(self) -> str:
+        """Normalized Mermaid text: one statement per line, black-box styling on every node"""
+        lines = [f"flowchart {self.direction}", f"    classDef {BLACK_BOX_CLASS} {BLACK_BOX_STYLE}"]
+
+        def emit(parent: Optional[str], indent: str):
+            for subgraph in self.subgraphs:
+                if subgraph.parent == parent:
+                    lines.append(f"{indent}subgraph {subgraph.id} [{_quote(subgraph.title)}]")
+                    if subgraph.direction:
+                        lines.append(f"{indent}    direction {subgraph.direction}")
+                    emit(subgraph.id, indent + "    ")
+                    lines.append(f"{indent}end")
+            for node in self.nodes:
+                if node.subgraph == parent:
+                    if node.label == node.id and node.shape == "rect":
+                        lines.append(f"{indent}{node.id}:::{BLACK_BOX_CLASS}")
+                    else:
+                        opening, closing = SHAPE_DELIMITERS[node.shape]
+                        lines.append(f"{indent}{node.id}{opening}{_quote(node.label)}{closing}:::{BLACK_BOX_CLASS}")
+
+        emit(None, "    ")
+        for edge in self.edges:
+            label = f"|{_quote(edge.label)}|" if edge.label else ""
+            lines.append(f"    {edge.source} {edge.arrow}{label} {edge.target}")
+        return "\n".join(lines)
+
+
+def _quote(label: str) -> str:
+    # A leading slash would read as a parallelogram or trapezoid opener
+    if PLAIN_LABEL.match(label) and not label.startswith("/"):
+        return label
+    return '"' + label.replace('"', "#quot;") + '"'
+
+
+def _arrow(bidirectional: str, body: str, head: Optional[str]) -> str:
+    if body.startswith("~"):
+        return "~~~"
+    kind = "==" if body.startswith("=") else "-.-" if "." in body else "--"
+    if not head:
+        return {"--": "---", "==": "===", "-.-": "-.-"}[kind]
+    return ("<" if bidirectional else "") + kind + head
+
+
+def _statements(text: str) -> List[Tuple[int, str]]:
+    """Split into (line number, statement) on newlines and on ``;`` outside labels"""
+    statements = []
+    for number, line in enumerate(text.split("\n"), 1):
+        if line.strip().startswith("%%"):
+            continue
+        current = []
+        depth = 0
+        quoted = False
+        for char in line:
+            if char == '"':
+                quoted = not quoted
+            elif not quoted and char in "[({":
+                depth += 1
+            elif not quoted and char in "])}":
+                depth = max(0, depth - 1)
+            elif char == ";" and not quoted and depth == 0:
+                statements.append((number, "".join(current).strip()))
+                current = []
+                continue
+            current.append(char)
+        statements.append((number, "".join(current).strip()))
+    return [(number, statement) for number, statement in statements if statement]
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.text = text
+        self.nodes: "OrderedDict[str, Node]" = OrderedDict()
+        self.labelled = set()
+        self.edges: List[Edge] = []
+        self.subgraphs: "OrderedDict[str, Subgraph]" = OrderedDict()
+        self.open: List[str] = []  # Subgraph ids, innermost last
+        self.line = 0
+
+    def error(self, message: str):
+        raise MermaidSyntaxError(message, self.line)
+
+    def parse(self) -> Flowchart:
+        statements = _statements(self.text)
+        if not statements:
+            raise MermaidSyntaxError("empty diagram")
+        self.line, header = statements[0]
+        words = header.split()
+        if words[0] not in ("flowchart", "graph"):
+            self.error(f"expected 'flowchart' or 'graph', found '{words[0]}'")
+        if len(words) > 2 or (len(words) == 2 and words[1] not in DIRECTIONS):
+            self.error(f"invalid flowchart direction '{' '.join(words[1:])}'")
+        direction = words[1] if len(words) == 2 else "TB"
+
+        for self.line, statement in statements[1:]:
+            self.statement(statement)
+        if self.open:
+            raise MermaidSyntaxError(f"subgraph '{self.open[-1]}' is never closed with 'end'")
+
+        # An edge may point at a subgraph; that is not a node of its own
+        nodes = tuple(node for node_id, node in self.nodes.items()
+                      if not (node_id in self.subgraphs and node_id not in self.labelled))
+        if not nodes:
+            raise MermaidSyntaxError("diagram has no nodes")
+        return Flowchart(direction, nodes, tuple(self.edges), tuple(self.subgraphs.values()))
+
+    def statement(self, statement: str):
+        keyword = statement.split(None, 1)[0]
+        rest = statement[len(keyword):].strip()
+        if keyword == "classDef" or keyword in IGNORED_STATEMENTS:
+            # Styling is normalized to the house style when rendering
+            return
+        if keyword == "subgraph":
+            self.subgraph(rest)
+        elif keyword == "end" and not rest:
+            if not self.open:
+                self.error("'end' without an open subgraph")
+            self.open.pop()
+        elif keyword == "direction" and self.open:
+            if rest not in DIRECTIONS:
+                self.error(f"invalid subgraph direction '{rest}'")
+            subgraph = self.subgraphs[self.open[-1]]
+            self.subgraphs[subgraph.id] = Subgraph(subgraph.id, subgraph.title, subgraph.parent, rest)
+        else:
+            self.chain(statement)
+
+    def subgraph(self, rest: str):
+        if not rest:
+            self.error("subgraph without a name")
+        match = re.fullmatch(r"([A-Za-z0-9_\-]+)\s*\[\s*(\"?)(.*?)\2\s*\]", rest)
+        if match:
+            subgraph_id, title = match.group(1), match.group(3)
+        else:
+            title = rest.strip('"')
+            subgraph_id = title if NODE_ID.fullmatch(title) else f"subgraph{len(self.subgraphs) + 1}"
+        if subgraph_id in self.subgraphs:
+            self.error(f"subgraph '{subgraph_id}' is defined twice")
+        self.subgraphs[subgraph_id] = Subgraph(subgraph_id, title, self.open[-1] if self.open else None)
+        self.open.append(subgraph_id)
+
+    def chain(self, statement: str):
+        """Parse ``A & B --> C -->|text| D`` into nodes and edges"""
+        position, sources = self.node_group(statement, 0)
+        while position < len(statement):
+            position, arrow, label = self.link(statement, position)
+            position, targets = self.node_group(statement, position)
+            for source in sources:
+                for target in targets:
+                    self.edges.append(Edge(source, target, arrow, label))
+            sources = targets
+
+    def node_group(self, statement: str, position: int) -> Tuple[int, List[str]]:
+        ids = []
+        while True:
+            position, node_id = self.node(statement, position)
+            ids.append(node_id)
+            match = NODE_SEPARATOR.match(statement, position)
+            if not match:
+                return position, ids
+            position = match.end()
+
+    def node(self, statement: str, position: int) -> Tuple[int, str]:
+        match = NODE_ID.match(statement, position)
+        if not match:
+            self.error(f"expected a node id at '{statement[position:].strip()[:30]}'")
+        node_id = match.group(1)
+        position = match.end()
+
+        label, shape = None, "rect"
+        for opening, closing, name in SHAPES:
+            if statement.startswith(opening, position):
+                found = self.label(statement, position + len(opening), closing)
+                if found:
+                    position, label = found
+                    shape = name
+                    break
+        else:
+            if position < len(statement) and statement[position] in "[({>":
+                self.error(f"unclosed shape for node '{node_id}'")
+        suffix = NODE_CLASS.match(statement, position)
+        if suffix:
+            position = suffix.end()
+
+        current = self.nodes.get(node_id)
+        if label is not None:
+            self.labelled.add(node_id)
+            subgraph = current.subgraph if current else self.innermost()
+            self.nodes[node_id] = Node(node_id, label, shape, subgraph)
+        elif current is None:
+            self.nodes[node_id] = Node(node_id, node_id, "rect", self.innermost())
+        return position, node_id
+
+    def label(self, statement: str, position: int, closing: str) -> Optional[Tuple[int, str]]:
+        """Position after ``closing`` and the label text, or None if the label does not end there"""
+        quote = QUOTE.match(statement, position)
+        if quote:
+            end = statement.find('"', quote.end())
+            if end == -1:
+                self.error("unterminated quoted label")
+            after = SPACE.match(statement, end + 1).end()
+            if not statement.startswith(closing, after):
+                return None
+            return after + len(closing), statement[quote.end():end]
+        end = statement.find(closing, position)
+        # An unquoted label never spans into another bracket, e.g. A[/api/users] is a rect
+        if end == -1 or any(char in statement[position:end] for char in '[]"'):
+            return None
+        label = statement[position:end].strip()
+        if not label:
+            self.error("empty node label")
+        return end + len(closing), label
+
+    def link(self, statement: str, position: int) -> Tuple[int, str, str]:
+        match = TEXT_LINK.match(statement, position)
+        if match and match.end() < len(statement):
+            bidirectional, opening, text, closing, head = match.groups()
+            return match.end(), _arrow(bidirectional, opening + closing, head), text.strip('"')
+        match = LINK.match(statement, position)
+        if not match:
+            self.error(f"expected a link at '{statement[position:].strip()[:30]}'")
+        if match.end() >= len(statement):
+            self.error("link without a target node")
+        bidirectional, body, head, text = match.groups()
+        return match.end(), _arrow(bidirectional, body, head), (text or "").strip().strip('"')
+
+    def innermost(self) -> Optional[str]:
+        return self.open[-1] if self.open else None
+
+
+_cache: "OrderedDict[str, Flowchart]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _remember(text: str, chart: Flowchart):
+    with _cache_lock:
+        _cache[text] = chart
+        _cache.move_to_end(text)
+        while len(_cache) > MERMAID_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def parse_flowchart(text: str) -> Flowchart:
+    """Parse a flowchart, raising MermaidSyntaxError where Mermaid would fail to render it
+
+    Covers the subset the diagram prompts produce: flowchart/graph headers,
+    node shapes, quoted labels, ``:::class`` suffixes, ``&`` groups, linked
+    chains with edge text, subgraphs and comments. ``classDef``, ``class``,
+    ``style``, ``linkStyle`` and ``click`` statements are accepted and
+    dropped. Results are cached by text.
+    """
+    with _cache_lock:
+        chart = _cache.get(text)
+        if chart is not None:
+            _cache.move_to_end(text)
+            return chart
+    chart = _Parser(text).parse()
+    _remember(text, chart)
+    return chart
+
+
+def normalize_flowchart(text: str) -> Tuple[str, Flowchart]:
+    """Validated diagram re-rendered in normalized form, with its AST
+
+    The normalized text is cached too, so later lookups of it are free.
+    """
+    chart = parse_flowchart(text)
+    normalized = chart.render()
+    _remember(normalized, chart)
+    return normalized, chart
+
+
+def flowchart_graph(text: str) -> Optional[Dict[str, Any]]:
+    """Compact AST of a diagram, or None if it does not parse"""
+    try:
+        return parse_flowchart(text).to_dict()
+    except MermaidSyntaxError:
+        return None
@@ -1,9 +1,57 @@
-from sqlalchemy import Column, String, DateTime, Text, JSON
-from sqlalchemy.orm import declarative_base
+from sqlalchemy import Column, String, DateTime, Text, JSON, Integer, Index, ForeignKey, inspect, text
+from sqlalchemy.orm import declarative_base, relationship, attribute_keyed_dict, validates
 from sqlalchemy.sql import func
+import hashlib
+import json
 import uuid
 
+from structured_log import get_logger
+
 Base = declarative_base()
+log = get_logger("models")
+
+# Artifact kinds stored per project, with the value used when one is missing
+ARTIFACT_DEFAULTS = {
+    "site_maps": list,  # List of AI-generated site maps
+    "mermaid_diagrams": list,  # List of AI-generated diagrams
+    "backend_diagrams": list,  # List of backend architecture diagrams
+    "ratings": dict,  # Ratings for each generated artifact
+    "diagram_graphs": dict,  # Parsed node/edge graph of each diagram, keyed like the diagram artifacts
+}
+
+def content_checksum(content) -> str:
+    """Stable hash of an artifact's JSON content"""
+    raw = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+class ProjectArtifact(Base):
+    __tablename__ = "project_artifacts"
+    
+    project_id = Column(String, ForeignKey("projects.id", ondelete="CASCADE"), primary_key=True)
+    kind = Column(String, primary_key=True)  # One of ARTIFACT_DEFAULTS
+    content = Column(JSON, nullable=False)
+    checksum = Column(String(64), nullable=False)  # Lets readers validate caches without loading content
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    @validates("content")
+    def _update_checksum(self, key, content):
+        self.checksum = content_checksum(content)
+        return content
+
+def artifact_property(kind: str):
+    """Expose one artifact row as a plain attribute on Project"""
+    def getter(self):
+        artifact = self.artifacts.get(kind)
+        return artifact.content if artifact is not None else ARTIFACT_DEFAULTS[kind]()
+    
+    def setter(self, value):
+        artifact = self.artifacts.get(kind)
+        if artifact is None:
+            self.artifacts[kind] = ProjectArtifact(kind=kind, content=value)
+        else:
+            artifact.content = value
+    
+    return property(getter, setter)
 
 class Project(Base):
     __tablename__ = "projects"
@@ -11,9 +59,83 @@ class Project(Base):
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String, nullable=False)
     description = Column(Text, nullable=False)
-    site_maps = Column(JSON, default=list)  # List of AI-generated site maps
-    mermaid_diagrams = Column(JSON, default=list)  # List of AI-generated diagrams
-    backend_diagrams = Column(JSON, default=list)  # List of backend architecture diagrams
-    ratings = Column(JSON, default=dict)  # Ratings for each generated artifact
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Prompt/completion tokens spent generating the project, in total and per stage
+    token_usage = Column(JSON, nullable=True)
+    
+    # Artifacts live in their own table and are only loaded when accessed
+    artifacts = relationship(
+        ProjectArtifact,
+        collection_class=attribute_keyed_dict("kind"),
+        cascade="all, delete-orphan",
+    )
+    site_maps = artifact_property("site_maps")
+    mermaid_diagrams = artifact_property("mermaid_diagrams")
+    backend_diagrams = artifact_property("backend_diagrams")
+    ratings = artifact_property("ratings")
+    diagram_graphs = artifact_property("diagram_graphs")
+    
+    __table_args__ = (
+        # Keyset pagination of the project list walks (created_at, id)
+        Index("ix_projects_created_at_id", "created_at", "id"),
+    )
+
+class GenerationJob(Base):
+    __tablename__ = "generation_jobs"
+    
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    kind = Column(String, nullable=False, default="create_project")
+    project_id = Column(String, nullable=False, index=True)
+    status = Column(String, nullable=False, default="queued", index=True)  # queued, running, completed, failed
+    stage = Column(String, default="queued")
+    message = Column(Text, default="")
+    progress = Column(Integer, default=0)
+    payload = Column(JSON, default=dict)  # Inputs needed to (re)run the job
+    result = Column(JSON, default=dict)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    owner = Column(String, nullable=True)  # Worker running the job
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)  # Renewed by the owner while it runs the job
+
+class GenerationBatch(Base):
+    __tablename__ = "generation_batches"
+    
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    job_ids = Column(JSON, nullable=False, default=list)  # In submission order; None for rejected items
+    rejected = Column(JSON, nullable=False, default=list)  # [{"index": ..., "error": ...}]
+    concurrency = Column(Integer, nullable=True)  # Max jobs of this batch running at once
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+def migrate_legacy_artifacts(engine):
+    """Copy artifacts from the old JSON columns on projects into project_artifacts
+    
+    Databases created before artifacts were split out still carry the JSON
+    columns; rows already migrated are skipped, so this is safe to rerun.
+    """
+    legacy = {column["name"] for column in inspect(engine).get_columns("projects")} & set(ARTIFACT_DEFAULTS)
+    if not legacy:
+        return
+    
+    with engine.begin() as conn:
+        rows = conn.execute(text(f"SELECT id, {', '.join(sorted(legacy))} FROM projects")).mappings().all()
+        existing = {(row.project_id, row.kind) for row in conn.execute(text("SELECT project_id, kind FROM project_artifacts"))}
+        migrated = 0
+        for row in rows:
+            for kind in legacy:
+                if row[kind] is None or (row["id"], kind) in existing:
+                    continue
+                content = json.loads(row[kind]) if isinstance(row[kind], str) else row[kind]
+                conn.execute(
+                    text("INSERT INTO project_artifacts (project_id, kind, content, checksum) "
+                         "VALUES (:project_id, :kind, :content, :checksum)"),
+                    {"project_id": row["id"], "kind": kind, "content": json.dumps(content),
+                     "checksum": content_checksum(content)},
+                )
+                migrated += 1
+    if migrated:
+        log.info("Migrated legacy project artifacts", count=migrated)
@@ -0,0 +1,137 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+@dataclass
+class Stage:
+    """One unit of pipeline work
+
+    ``run`` receives a dict with the results of every stage listed in
+    ``depends_on`` and returns this stage's result.
+    """
+    name: str
+    run: Callable[[Dict[str, Any]], Awaitable[Any]]
+    depends_on: List[str] = field(default_factory=list)
+
+
+@dataclass
+class StageTiming:
+    started: float  # Seconds since the pipeline started
+    duration: float
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"started": round(self.started, 3), "duration": round(self.duration, 3)}
+
+
+@dataclass
+class PipelineResult:
+    results: Dict[str, Any]
+    timings: Dict[str, StageTiming]
+    total: float
+
+    def timings_dict(self) -> Dict[str, Any]:
+        return {
+            "stages": {name: timing.to_dict() for name, timing in self.timings.items()},
+            "total": round(self.total, 3),
+        }
+
+
+class PipelineError(Exception):
+    """Raised when a stage fails; the original exception is chained"""
+
+    def __init__(self, stage: str, error: Exception):
+        super().__init__(str(error))
+        self.stage = stage
+        self.error = error
+
+
+class Pipeline:
+    """Dependency-aware scheduler for a small DAG of async stages
+
+    Every stage starts as soon as all of its dependencies have finished, so
+    independent branches run concurrently. If any stage fails, the remaining
+    in-flight stages are cancelled and a ``PipelineError`` is raised.
+    """
+
+    def __init__(self, stages: List[Stage], on_stage_start: Optional[Callable[[str], None]] = None,
+                 on_stage_end: Optional[Callable[[str], None]] = None):
+        self.on_stage_start = on_stage_start
+        self.on_stage_end = on_stage_end
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage '{stage.name}'")
+            self.stages[stage.name] = stage
+        for stage in stages:
+            for dep in stage.depends_on:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+        self._check_acyclic()
+
+    def plan(self) -> Dict[str, List[str]]:
+        """Stage name -> dependency names"""
+        return {name: list(stage.depends_on) for name, stage in self.stages.items()}
+
+    def _check_acyclic(self):
+        visiting, done = set(), set()
+
+        def visit(name: str):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle detected at stage '{name}'")
+            visiting.add(name)
+            for dep in self.stages[name].depends_on:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    async def run(self) -> PipelineResult:
+        results: Dict[str, Any] = {}
+        timings: Dict[str, StageTiming] = {}
+        running: Dict[asyncio.Task, str] = {}
+        pending = dict(self.stages)
+        origin = time.perf_counter()
+
+        async def execute(stage: Stage):
+            inputs = {dep: results[dep] for dep in stage.depends_on}
+            started = time.perf_counter()
+            if self.on_stage_start:
+                self.on_stage_start(stage.name)
+            try:
+                result = await stage.run(inputs)
+            finally:
+                timings[stage.name] = StageTiming(started - origin, time.perf_counter() - started)
+            if self.on_stage_end:
+                self.on_stage_end(stage.name)
+            return result
+
+        def launch_ready():
+            for name, stage in list(pending.items()):
+                if all(dep in results for dep in stage.depends_on):
+                    del pending[name]
+                    running[asyncio.create_task(execute(stage))] = name
+
+        launch_ready()
+        try:
+            while running:
+                finished, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    name = running.pop(task)
+                    error = task.exception()
+                    if error is not None:
+                        raise PipelineError(name, error) from error
+                    results[name] = task.result()
+                launch_ready()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running.keys(), return_exceptions=True)
+
+        return PipelineResult(results=results, timings=timings, total=time.perf_counter() - origin)
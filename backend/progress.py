@@ -0,0 +1,132 @@
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+PROGRESS_WINDOW = int(os.getenv("PROGRESS_WINDOW", "100"))
+
+# Prior guesses (seconds) used until enough real samples have been recorded
+DEFAULT_DURATIONS = {
+    "stage:sitemap": 30.0,
+    "stage:frontend": 25.0,
+    "stage:backend": 25.0,
+    "stage:finalize": 0.5,
+}
+MIN_SAMPLES = 3
+
+
+class RollingStats:
+    """Fixed-size window of recent durations with percentile lookups"""
+
+    def __init__(self, window: int = PROGRESS_WINDOW):
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def add(self, value: float):
+        self.samples.append(value)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        # Linear interpolation between closest ranks
+        rank = (len(ordered) - 1) * p / 100
+        low = int(rank)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class ProgressEstimator:
+    """Rolling per-stage and per-provider latency measurements
+
+    Keys are free-form strings such as ``stage:sitemap`` or
+    ``provider:openai``; until a key has ``MIN_SAMPLES`` samples its
+    expected duration falls back to ``DEFAULT_DURATIONS``.
+    """
+
+    def __init__(self, window: int = PROGRESS_WINDOW, defaults: Dict[str, float] = None):
+        self.window = window
+        self.defaults = dict(DEFAULT_DURATIONS if defaults is None else defaults)
+        self.stats: Dict[str, RollingStats] = {}
+
+    def record(self, key: str, seconds: float):
+        self.stats.setdefault(key, RollingStats(self.window)).add(seconds)
+
+    def percentile(self, key: str, p: float) -> Optional[float]:
+        stats = self.stats.get(key)
+        return stats.percentile(p) if stats else None
+
+    def expected(self, key: str) -> float:
+        stats = self.stats.get(key)
+        if stats is not None and len(stats) >= MIN_SAMPLES:
+            return stats.percentile(50)
+        return self.defaults.get(key, 10.0)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {
+            key: {
+                "samples": len(stats),
+                "p50": round(stats.percentile(50), 3),
+                "p90": round(stats.percentile(90), 3),
+                "p95": round(stats.percentile(95), 3),
+            }
+            for key, stats in self.stats.items() if len(stats)
+        }
+
+
+class ProgressTracker:
+    """Progress and ETA for one generation, derived from measured stage durations
+
+    ``plan`` maps stage name -> list of dependency stage names, mirroring the
+    pipeline DAG. Progress is the expected-time-weighted fraction of work
+    done; ETA is the longest remaining dependency chain.
+    """
+
+    def __init__(self, estimator: ProgressEstimator, plan: Dict[str, List[str]]):
+        self.estimator = estimator
+        self.plan = plan
+        self.expected = {stage: estimator.expected(f"stage:{stage}") for stage in plan}
+        self.started: Dict[str, float] = {}
+        self.finished: Dict[str, float] = {}
+
+    def start(self, stage: str):
+        self.started[stage] = time.monotonic()
+
+    def finish(self, stage: str, record: bool = True):
+        now = time.monotonic()
+        self.finished[stage] = now
+        if record and stage in self.started:
+            self.estimator.record(f"stage:{stage}", now - self.started[stage])
+
+    def _remaining(self, stage: str, now: float) -> float:
+        if stage in self.finished:
+            return 0.0
+        expected = self.expected[stage]
+        if stage in self.started:
+            elapsed = now - self.started[stage]
+            # Overrunning stages are assumed to be nearly (not fully) done
+            return max(expected - elapsed, expected * 0.05)
+        return expected
+
+    def progress(self) -> int:
+        now = time.monotonic()
+        total = sum(self.expected.values())
+        if not total:
+            return 0
+        done = sum(self.expected[stage] - self._remaining(stage, now) for stage in self.plan)
+        # 100 is reserved for the terminal "complete" event
+        return max(0, min(99, round(done / total * 100)))
+
+    def eta(self) -> float:
+        now = time.monotonic()
+        finish: Dict[str, float] = {}
+
+        def finish_time(stage: str) -> float:
+            if stage not in finish:
+                ready = max((finish_time(dep) for dep in self.plan[stage]), default=0.0)
+                finish[stage] = ready + self._remaining(stage, now)
+            return finish[stage]
+
+        return round(max((finish_time(stage) for stage in self.plan), default=0.0), 1)
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from structured_log import get_logger
+
+PROGRESS_BUS = os.getenv("PROGRESS_BUS", "memory")  # memory | sqlite
+PROGRESS_BUS_PATH = os.getenv("PROGRESS_BUS_PATH", "./progress_bus.db")
+PROGRESS_BUS_POLL_MS = float(os.getenv("PROGRESS_BUS_POLL_MS", "50"))
+PROGRESS_BUS_RETENTION_SECONDS = float(os.getenv("PROGRESS_BUS_RETENTION_SECONDS", "60"))
+
+log = get_logger("progress_bus")
+
+# Delivers one event to this process's WebSocket subscribers
+Deliver = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class ProgressBus:
+    """Carries progress and artifact events to every API process
+
+    ``publish`` always delivers to the local process right away; buses that
+    span processes also forward the event to the other workers, which hand
+    it to their own ``deliver`` callback.
+    """
+
+    def __init__(self, deliver: Deliver):
+        self.deliver = deliver
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, event: Dict[str, Any]):
+        raise NotImplementedError
+
+
+class InProcessBus(ProgressBus):
+    """Single-process bus: publishing is delivering"""
+
+    async def publish(self, event: Dict[str, Any]):
+        await self.deliver(event)
+
+
+class SQLiteBus(ProgressBus):
+    """Cross-process bus over a shared SQLite file
+
+    Each worker appends its events to a small log table and polls it for
+    events written by the others, so ``uvicorn --workers N`` needs no
+    external broker. Outgoing events are written and incoming ones read in
+    one transaction per poll tick; rows older than ``retention`` seconds are
+    pruned.
+    """
+
+    def __init__(self, deliver: Deliver, path: str = PROGRESS_BUS_PATH,
+                 poll_interval: float = PROGRESS_BUS_POLL_MS / 1000,
+                 retention: float = PROGRESS_BUS_RETENTION_SECONDS):
+        super().__init__(deliver)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.node_id = uuid.uuid4().hex
+        self.outbox: List[tuple] = []
+        self.last_id = 0
+        self.last_prune = 0.0
+        self.task: Optional[asyncio.Task] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    async def start(self):
+        if self.task:
+            return
+        await asyncio.to_thread(self._open)
+        self.task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if not self.task:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        if self.outbox:
+            outgoing, self.outbox = self.outbox, []
+            await asyncio.to_thread(self._exchange, outgoing)
+        with self._lock:
+            self._conn.close()
+            self._conn = None
+
+    async def publish(self, event: Dict[str, Any]):
+        await self.deliver(event)
+        if self.task:
+            self.outbox.append((time.time(), json.dumps(event)))
+
+    def _open(self):
+        with self._lock:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=OFF")  # Events are transient
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS progress_events ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, origin TEXT NOT NULL, payload TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_progress_events_created ON progress_events (created)")
+            # Only events published from now on are of interest
+            self.last_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM progress_events").fetchone()[0]
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            # Swap the outbox on the loop thread so no event is appended mid-write
+            outgoing, self.outbox = self.outbox, []
+            try:
+                incoming = await asyncio.to_thread(self._exchange, outgoing)
+            except sqlite3.Error as e:
+                log.error("Could not exchange progress events", error=str(e))
+                self.outbox = outgoing + self.outbox
+                continue
+            for event in incoming:
+                await self.deliver(event)
+
+    def _exchange(self, outgoing: List[tuple]) -> List[Dict[str, Any]]:
+        """Write queued outgoing events and read the ones other workers wrote"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO progress_events (created, origin, payload) VALUES (?, ?, ?)",
+                    [(created, self.node_id, payload) for created, payload in outgoing]
+                )
+                rows = self._conn.execute(
+                    "SELECT id, origin, payload FROM progress_events WHERE id > ? ORDER BY id", (self.last_id,)
+                ).fetchall()
+                if now - self.last_prune > self.retention:
+                    self._conn.execute("DELETE FROM progress_events WHERE created < ?", (now - self.retention,))
+                    self.last_prune = now
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if rows:
+            self.last_id = rows[-1][0]
+        return [json.loads(payload) for _, origin, payload in rows if origin != self.node_id]
+
+
+def create_progress_bus(deliver: Deliver, kind: str = PROGRESS_BUS) -> ProgressBus:
+    if kind == "sqlite":
+        return SQLiteBus(deliver)
+    if kind != "memory":
+        log.warning("Unknown PROGRESS_BUS, using the in-process bus", kind=kind)
+    return InProcessBus(deliver)
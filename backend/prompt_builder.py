@@ -0,0 +1,89 @@
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+# Per-stage token budgets for context embedded in prompts
+FRONTEND_SITEMAP_TOKEN_BUDGET = int(os.getenv("FRONTEND_SITEMAP_TOKEN_BUDGET", "1500"))
+
+# Rough average for English prose and JSON; providers report exact counts afterwards
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count of ``text``"""
+    return len(text or "") // CHARS_PER_TOKEN + 1
+
+
+def compact_json(value: Any) -> str:
+    """JSON without indentation or spaces after separators"""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def _outline_lines(pages: List[Dict[str, Any]], depth: int, max_depth: Optional[int],
+                   details: bool, features: bool) -> List[str]:
+    lines = []
+    for page in pages:
+        if not isinstance(page, dict):
+            continue
+        line = f"{'  ' * depth}- {page.get('name', '?')}"
+        if page.get("path"):
+            line += f" ({page['path']})"
+        if details and page.get("description"):
+            line += f": {page['description']}"
+        if features and page.get("features"):
+            line += f" [{'; '.join(str(f) for f in page['features'])}]"
+        lines.append(line)
+
+        children = page.get("children") or []
+        if not isinstance(children, list) or not children:
+            continue
+        if max_depth is not None and depth + 1 > max_depth:
+            lines.append(f"{'  ' * (depth + 1)}- (+{_count_pages(children)} more pages)")
+        else:
+            lines.extend(_outline_lines(children, depth + 1, max_depth, details, features))
+    return lines
+
+
+def _count_pages(pages: List[Any]) -> int:
+    return sum(1 + _count_pages(page.get("children") or []) for page in pages if isinstance(page, dict))
+
+
+def sitemap_outline(site_map: Dict[str, Any], max_depth: Optional[int] = None,
+                    details: bool = True, features: bool = True) -> str:
+    """Indented one-line-per-page outline of a sitemap
+
+    Much shorter than indented JSON: no keys, quotes or braces. Children
+    deeper than ``max_depth`` are summarized as a page count.
+    """
+    pages = site_map.get("pages", []) if isinstance(site_map, dict) else []
+    return "\n".join(_outline_lines(pages, 0, max_depth, details, features))
+
+
+def fit_sitemap(site_map: Dict[str, Any], budget: int = FRONTEND_SITEMAP_TOKEN_BUDGET) -> str:
+    """Outline of ``site_map`` trimmed until it fits ``budget`` tokens
+
+    Detail is dropped in order of usefulness to a diagram: features, then
+    descriptions, then nested levels (summarized as counts). As a last
+    resort the outline is cut at a page boundary.
+    """
+    attempts = [
+        dict(details=True, features=True),
+        dict(details=True, features=False),
+        dict(details=False, features=False),
+        dict(details=False, features=False, max_depth=2),
+        dict(details=False, features=False, max_depth=1),
+        dict(details=False, features=False, max_depth=0),
+    ]
+    outline = ""
+    for options in attempts:
+        outline = sitemap_outline(site_map, **options)
+        if count_tokens(outline) <= budget:
+            return outline
+
+    kept = []
+    for line in outline.split("\n"):
+        if count_tokens("\n".join(kept + [line])) > budget:
+            break
+        kept.append(line)
+    omitted = len(outline.split("\n")) - len(kept)
+    return "\n".join(kept + [f"- (+{omitted} more top-level pages)"])
@@ -0,0 +1,263 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from llm_providers import Completion, LLMProvider
+from progress import RollingStats
+from structured_log import get_logger
+
+# Race a second provider once the first runs past its usual latency
+LLM_HEDGING = os.getenv("LLM_HEDGING", "true").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "10"))
+
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "90"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+
+log = get_logger("provider_router")
+
+# Runs one request against a provider; the flag is True for a hedged (second) request
+Attempt = Callable[[LLMProvider, bool], Awaitable[Completion]]
+
+
+class NoProviderAvailable(Exception):
+    """Every configured provider is failing or has its circuit open"""
+
+
+class Dispatch:
+    """When a routed request actually went out to its provider
+
+    Latency, slow calls and the hedge deadline are measured from here, so
+    time an attempt spends queued on our side (e.g. in a rate limiter) is
+    never blamed on the provider. An attempt that queues calls
+    ``request_queued`` first and ``request_sent`` once it is let through;
+    other attempts count as sent from launch.
+    """
+
+    def __init__(self):
+        self.sent_at: Optional[float] = time.perf_counter()
+
+    def elapsed(self) -> Optional[float]:
+        """Seconds since the request was sent, None while it is still queued"""
+        return None if self.sent_at is None else time.perf_counter() - self.sent_at
+
+
+_dispatch: ContextVar[Optional[Dispatch]] = ContextVar("dispatch", default=None)
+
+
+def request_queued():
+    """Mark the current routed attempt as waiting on our side"""
+    dispatch = _dispatch.get()
+    if dispatch is not None:
+        dispatch.sent_at = None
+
+
+def request_sent():
+    """Mark the current routed attempt's request as sent to the provider"""
+    dispatch = _dispatch.get()
+    if dispatch is not None:
+        dispatch.sent_at = time.perf_counter()
+
+
+class CircuitBreaker:
+    """Stops sending requests to a provider that keeps failing or stalling
+
+    Outcomes of the last ``window`` calls are kept; a call counts as bad if
+    it raised, returned nothing, or took longer than ``slow_call_seconds``.
+    Once at least ``min_calls`` are recorded and the bad fraction reaches
+    ``failure_rate`` the circuit opens and calls are refused for
+    ``open_seconds``. After that a single probe is let through
+    (half-open): it closes the circuit on success and reopens it on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_rate: float = BREAKER_FAILURE_RATE, slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS,
+                 open_seconds: float = BREAKER_OPEN_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.outcomes: Deque[bool] = deque(maxlen=window)  # True for a bad call
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self) -> bool:
+        """Whether a call may be made now; in half-open state only one probe is admitted"""
+        if self.state == self.OPEN:
+            if self.clock() - self.opened_at < self.open_seconds:
+                return False
+            self.state = self.HALF_OPEN
+            self.probing = False
+        if self.state == self.HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def record_success(self, seconds: float):
+        self._record(bad=seconds >= self.slow_call_seconds)
+
+    def record_failure(self):
+        self._record(bad=True)
+
+    def release(self):
+        """Forget an admitted call that ended without an outcome (cancelled or cached)"""
+        if self.state == self.HALF_OPEN:
+            self.probing = False
+
+    def _record(self, bad: bool):
+        if self.state == self.HALF_OPEN:
+            self.probing = False
+            if bad:
+                self._trip()
+            else:
+                log.info("Circuit closed after a successful probe", provider=self.name)
+                self.state = self.CLOSED
+                self.outcomes.clear()
+            return
+        self.outcomes.append(bad)
+        if len(self.outcomes) >= self.min_calls and sum(self.outcomes) / len(self.outcomes) >= self.failure_rate:
+            self._trip()
+
+    def _trip(self):
+        log.warning("Circuit opened", provider=self.name, open_seconds=self.open_seconds)
+        self.state = self.OPEN
+        self.opened_at = self.clock()
+        self.outcomes.clear()
+
+
+class ProviderRouter:
+    """Sends a request to the first healthy provider, hedging and falling back
+
+    Providers are tried in the order given. One whose circuit is open is
+    skipped without waiting. If the running request has not finished after
+    the provider's observed p95 latency for the task, the next provider is
+    started as well and whichever answers first wins; the other request is
+    cancelled. A request that fails or comes back empty falls through to the
+    next provider. Latencies are timed from each request's ``Dispatch``.
+    """
+
+    def __init__(self, hedging: bool = LLM_HEDGING, hedge_percentile: float = LLM_HEDGE_PERCENTILE,
+                 hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+                 breaker_factory: Callable[[str], CircuitBreaker] = CircuitBreaker):
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker_factory = breaker_factory
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latencies: Dict[Tuple[str, str], RollingStats] = {}
+        self.stats = {"hedged": 0, "hedge_wins": 0, "fallbacks": 0, "short_circuited": 0}
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        if name not in self.breakers:
+            self.breakers[name] = self.breaker_factory(name)
+        return self.breakers[name]
+
+    def hedge_delay(self, provider: str, task: str) -> Optional[float]:
+        """Seconds to wait on ``provider`` before hedging, or None without enough samples"""
+        stats = self.latencies.get((provider, task))
+        if stats is None or len(stats) < self.hedge_min_samples:
+            return None
+        return stats.percentile(self.hedge_percentile)
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        return {
+            "breakers": {name: breaker.state for name, breaker in self.breakers.items()},
+            **self.stats,
+        }
+
+    async def call(self, providers: Sequence[LLMProvider], attempt: Attempt, task: str = "default") -> Completion:
+        candidates: List[LLMProvider] = list(providers)
+        running: Dict[asyncio.Task, Tuple[LLMProvider, Dispatch, bool]] = {}
+
+        def launch(hedged: bool) -> bool:
+            while candidates:
+                provider = candidates.pop(0)
+                if self.breaker(provider.name).allow():
+                    dispatch = Dispatch()
+                    # The task copies the context here, so the attempt sees its own Dispatch
+                    token = _dispatch.set(dispatch)
+                    try:
+                        request = asyncio.create_task(attempt(provider, hedged))
+                    finally:
+                        _dispatch.reset(token)
+                    running[request] = (provider, dispatch, hedged)
+                    return True
+                self.stats["short_circuited"] += 1
+                log.info("Circuit is open, skipping provider", provider=provider.name)
+            return False
+
+        last_error: Optional[Exception] = None
+        launch(False)
+        try:
+            while running:
+                timeout = None
+                if self.hedging and len(running) == 1 and candidates:
+                    provider, dispatch, _ = next(iter(running.values()))
+                    delay = self.hedge_delay(provider.name, task)
+                    if delay is not None:
+                        elapsed = dispatch.elapsed()
+                        # While the request is still queued on our side, check again later
+                        timeout = delay if elapsed is None else max(0.0, delay - elapsed)
+
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    elapsed = dispatch.elapsed()
+                    if elapsed is None or elapsed < delay:
+                        continue
+                    log.info("Provider is past its latency percentile, hedging", provider=provider.name, task=task,
+                             percentile=self.hedge_percentile)
+                    if launch(True):
+                        self.stats["hedged"] += 1
+                    continue
+
+                for request in done:
+                    provider, dispatch, hedged = running.pop(request)
+                    breaker = self.breaker(provider.name)
+                    try:
+                        completion = request.result()
+                    except Exception as e:
+                        breaker.record_failure()
+                        last_error = e
+                        log.error("Provider call failed", provider=provider.name, error=f"{type(e).__name__}: {e}")
+                        continue
+                    if not completion.text:
+                        breaker.record_failure()
+                        last_error = NoProviderAvailable(f"Empty response from {provider.name}")
+                        log.warning("Empty response", provider=provider.name)
+                        continue
+
+                    if completion.stop_reason == "cached":
+                        breaker.release()
+                    else:
+                        elapsed = dispatch.elapsed() or 0.0
+                        breaker.record_success(elapsed)
+                        self.latencies.setdefault((provider.name, task), RollingStats()).add(elapsed)
+                    if hedged:
+                        self.stats["hedge_wins"] += 1
+                    return completion
+
+                if not running and candidates:
+                    self.stats["fallbacks"] += 1
+                    launch(False)
+            raise last_error or NoProviderAvailable("No provider available")
+        finally:
+            # Cancel the losing request and give its probe slot back
+            for request, (provider, _, _) in running.items():
+                request.cancel()
+                self.breaker(provider.name).release()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
@@ -0,0 +1,230 @@
+import asyncio
+import email.utils
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from llm_providers import CONNECTION_ERRORS
+from prompt_builder import count_tokens
+from structured_log import get_logger
+
+# Defaults for every provider; override per provider with e.g. OPENAI_RPM or ANTHROPIC_TPM.
+# A budget of 0 leaves that dimension unlimited.
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))
+# Retries of a throttled (429) or transient (timeout, connection, 5xx) failure; the only retry layer
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "2"))
+LLM_RATE_LIMIT_BACKOFF_SECONDS = float(os.getenv("LLM_RATE_LIMIT_BACKOFF_SECONDS", "5"))
+# First backoff after a transient failure, doubled on each further retry
+LLM_RETRY_BACKOFF_SECONDS = float(os.getenv("LLM_RETRY_BACKOFF_SECONDS", "1"))
+
+# Statuses worth retrying besides 429: request timeout, conflict and server errors
+TRANSIENT_STATUSES = {408, 409, 500, 502, 503, 504}
+
+log = get_logger("rate_limiter")
+
+
+def estimate_tokens(text: str, max_output_tokens: int = 0) -> int:
+    """Rough token cost of a request: its prompt plus the output it may produce"""
+    return count_tokens(text) + max_output_tokens
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds a rate-limited (429) provider asked us to wait, or None for other errors"""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            # Retry-After may also be an HTTP date
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return LLM_RATE_LIMIT_BACKOFF_SECONDS
+
+
+def transient_delay(error: Exception, attempt: int) -> Optional[float]:
+    """Seconds to back off before retrying a transient failure, or None if ``error`` is not one"""
+    if isinstance(error, CONNECTION_ERRORS) or getattr(error, "status_code", None) in TRANSIENT_STATUSES:
+        return LLM_RETRY_BACKOFF_SECONDS * 2 ** attempt
+    return None
+
+
+class TokenBucket:
+    """Refills ``capacity`` units evenly over ``period`` seconds"""
+
+    def __init__(self, capacity: float, period: float, clock: Callable[[], float]):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.level = capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` units are available (requests above capacity wait for a full bucket)"""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class ProviderLimiter:
+    """Keeps one provider/model inside its concurrency and rate budgets
+
+    Callers queue in arrival order: the caller at the head waits until a
+    request slot, the requests-per-minute bucket and the tokens-per-minute
+    bucket all have room, and everyone behind it waits their turn. A 429
+    pauses the whole queue for the provider's ``Retry-After`` before the
+    request is retried; a transient failure is retried after a backoff.
+    This is the only retry layer, the SDK clients do not retry.
+
+    A request reserves its prompt plus the most output it may produce;
+    what it did not use is returned to the tokens-per-minute bucket once
+    its actual usage is known.
+    """
+
+    def __init__(self, name: str, max_in_flight: int = LLM_MAX_IN_FLIGHT, rpm: int = LLM_RPM, tpm: int = LLM_TPM,
+                 period: float = 60.0, retries: int = LLM_RATE_LIMIT_RETRIES,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.clock = clock
+        self.requests = TokenBucket(rpm, period, clock) if rpm else None
+        self.tokens = TokenBucket(tpm, period, clock) if tpm else None
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.queue = asyncio.Lock()  # asyncio.Lock wakes waiters first-in, first-out
+        self.released = asyncio.Event()
+        self.stats = {"requests": 0, "queued": 0, "rate_limited": 0, "retried": 0}
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = self.paused_until - self.clock()
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    async def acquire(self, tokens: int):
+        waited = self.queue.locked()
+        async with self.queue:
+            while True:
+                wait = self._wait_time(tokens)
+                full = self.max_in_flight and self.in_flight >= self.max_in_flight
+                if wait <= 0 and not full:
+                    break
+                waited = True
+                # Wake early when a request finishes; budgets are rechecked either way
+                self.released.clear()
+                try:
+                    await asyncio.wait_for(self.released.wait(), wait if wait > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+            if waited:
+                self.stats["queued"] += 1
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+            self.in_flight += 1
+            self.stats["requests"] += 1
+
+    def release(self, reserved: int = 0, used: int = 0):
+        """Free the request slot and return the unused part of a ``reserved`` token budget"""
+        self.in_flight -= 1
+        if self.tokens and used < reserved:
+            taken = min(reserved, self.tokens.capacity)
+            self.tokens.give_back(taken - min(max(used, 0), taken))
+        self.released.set()
+
+    def pause(self, seconds: float):
+        """Hold every queued request for ``seconds``, e.g. after a 429"""
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+    async def call(self, request: Callable[[], Awaitable[Any]], tokens: int,
+                   usage: Optional[Callable[[Any], int]] = None) -> Any:
+        """Run ``request`` inside the budgets, retrying it after a 429 or a transient failure
+
+        ``usage(result)`` gives the tokens the request actually used; without
+        it the whole reservation counts as used.
+        """
+        for attempt in range(self.retries + 1):
+            await self.acquire(tokens)
+            used = tokens
+            try:
+                result = await request()
+                if usage:
+                    used = usage(result)
+                return result
+            except Exception as e:
+                throttled = retry_after(e)
+                if throttled is not None:
+                    # The provider turned the request away, so it used none of its reservation
+                    used = 0
+                delay = throttled if throttled is not None else transient_delay(e, attempt)
+                if delay is None or attempt == self.retries:
+                    raise
+                if throttled is not None:
+                    self.stats["rate_limited"] += 1
+                    log.warning("Rate limited, retrying", limiter=self.name, delay=round(delay, 1))
+                    self.pause(delay)
+                else:
+                    self.stats["retried"] += 1
+                    log.warning("Transient failure, retrying", limiter=self.name, delay=round(delay, 1),
+                                error=f"{type(e).__name__}: {e}")
+            finally:
+                self.release(tokens, used)
+            if throttled is None:
+                # Only a 429 holds back the whole queue; this request alone backs off
+                await asyncio.sleep(delay)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"in_flight": self.in_flight, "paused_for": round(max(0.0, self.paused_until - self.clock()), 3),
+                **self.stats}
+
+
+class RateLimiters:
+    """One limiter per provider/model, configured from ``<PROVIDER>_MAX_IN_FLIGHT``/``_RPM``/``_TPM``"""
+
+    def __init__(self):
+        self.limiters: Dict[str, ProviderLimiter] = {}
+
+    def get(self, provider) -> ProviderLimiter:
+        key = f"{provider.name}:{provider.model}"
+        if key not in self.limiters:
+            prefix = provider.name.upper()
+            self.limiters[key] = ProviderLimiter(
+                key,
+                max_in_flight=int(os.getenv(f"{prefix}_MAX_IN_FLIGHT", LLM_MAX_IN_FLIGHT)),
+                rpm=int(os.getenv(f"{prefix}_RPM", LLM_RPM)),
+                tpm=int(os.getenv(f"{prefix}_TPM", LLM_TPM)),
+            )
+        return self.limiters[key]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {key: limiter.snapshot() for key, limiter in self.limiters.items()}
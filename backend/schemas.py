@@ -0,0 +1,114 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+# Levels of pages (top-level pages, their children, ...) spelled out in the schema sent to providers
+SITEMAP_SCHEMA_DEPTH = int(os.getenv("SITEMAP_SCHEMA_DEPTH", "3"))
+
+# JSON Schema keywords both providers accept in structured-output mode
+SCHEMA_KEYWORDS = {"type", "properties", "items", "required", "additionalProperties", "enum", "anyOf", "description"}
+
+
+class StructuredOutputError(ValueError):
+    """A model response that still fails its schema after repair"""
+
+    def __init__(self, message: str, errors: List[str]):
+        super().__init__(message)
+        self.errors = errors
+
+
+class SitemapPage(BaseModel):
+    name: str
+    path: str
+    description: str = ""
+    features: List[str] = Field(default_factory=list)
+    children: List["SitemapChild"] = Field(default_factory=list)
+
+    @field_validator("name", "path")
+    @classmethod
+    def not_blank(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError("must not be blank")
+        return value
+
+
+class SitemapChild(SitemapPage):
+    # Nested pages have always been accepted without a path
+    path: str = ""
+
+    @field_validator("path")
+    @classmethod
+    def not_blank(cls, value: str) -> str:
+        return value
+
+
+class Sitemap(BaseModel):
+    pages: List[SitemapPage] = Field(min_length=1)
+
+
+def format_errors(error: ValidationError, prefix: str = "") -> List[str]:
+    """One ``location: message`` line per validation error"""
+    lines = []
+    for item in error.errors():
+        location = ".".join(str(part) for part in (prefix, *item["loc"]) if part != "")
+        lines.append(f"{location or 'document'}: {item['msg']}")
+    return lines
+
+
+def page_errors(page: Any) -> Optional[str]:
+    """Why ``page`` is not a valid sitemap page, or None"""
+    try:
+        SitemapPage.model_validate(page)
+    except ValidationError as e:
+        return "; ".join(format_errors(e))
+    return None
+
+
+def validate_sitemap(data: Any) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """Normalized sitemap (defaults filled in) and an empty list, or None and the errors"""
+    try:
+        return Sitemap.model_validate(data).model_dump(), []
+    except ValidationError as e:
+        return None, format_errors(e)
+
+
+def response_schema(model: Type[BaseModel], max_depth: int) -> Dict[str, Any]:
+    """JSON schema of ``model`` in the subset providers enforce natively
+
+    References are inlined, since structured-output modes handle recursion
+    poorly: a recursive field is spelled out ``max_depth`` levels deep and
+    left out below that. Every property is required and no others are
+    allowed, as strict mode demands; optional fields still validate locally.
+    """
+    schema = model.model_json_schema()
+    definitions = schema.pop("$defs", {})
+
+    def strict(node: Dict[str, Any], depth: int) -> Dict[str, Any]:
+        if "$ref" in node:
+            return strict(definitions[node["$ref"].split("/")[-1]], depth)
+        result = {key: value for key, value in node.items() if key in SCHEMA_KEYWORDS}
+        if "items" in node:
+            result["items"] = strict(node["items"], depth)
+        if "anyOf" in node:
+            result["anyOf"] = [strict(option, depth) for option in node["anyOf"]]
+        if "properties" in node:
+            properties = {}
+            for name, child in node["properties"].items():
+                nested = depth + 1 if _is_recursive(child) else depth
+                if nested <= max_depth:
+                    properties[name] = strict(child, nested)
+            result["properties"] = properties
+            result["required"] = list(properties)
+            result["additionalProperties"] = False
+        return result
+
+    return strict(schema, 0)
+
+
+def _is_recursive(node: Dict[str, Any]) -> bool:
+    # Each list of objects (pages, their children, ...) is one level deeper
+    return "$ref" in node.get("items", {})
+
+
+SITEMAP_SCHEMA = response_schema(Sitemap, SITEMAP_SCHEMA_DEPTH)
@@ -0,0 +1,187 @@
+import hashlib
+import os
+import random
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.7"))
+# "seed" hands the matched sitemap to the model as a starting point, "draft" reuses it as-is
+# without an LLM call, "off" disables the lookup
+SITEMAP_REUSE_MODE = os.getenv("SITEMAP_REUSE_MODE", "seed")
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+_STOPWORDS = {
+    "a", "an", "and", "the", "for", "of", "to", "in", "on", "with", "that", "this", "is", "are",
+    "be", "it", "its", "as", "by", "or", "at", "from", "we", "our", "i", "my", "you", "your",
+    "want", "need", "build", "create", "make", "site", "website", "web", "app", "application",
+    "online", "where", "who", "can", "their", "them", "they", "which", "also", "like", "all", "some",
+}
+
+
+def _stem(token: str) -> str:
+    """Strip common English inflections so "schedules" and "scheduling" both become "schedul" """
+    if len(token) > 4 and token.endswith("ies"):
+        token = token[:-3] + "y"
+    elif len(token) > 4 and token.endswith(("ses", "xes", "zes", "ches", "shes")):
+        token = token[:-2]
+    elif len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        token = token[:-1]
+    for suffix in ("ing", "ed"):
+        if len(token) > len(suffix) + 3 and token.endswith(suffix) and not token.endswith("eed"):
+            token = token[:-len(suffix)]
+            if token[-1] == token[-2] and token[-1] not in "lsz":
+                token = token[:-1]
+            break
+    if len(token) > 4 and token.endswith("e"):
+        token = token[:-1]
+    return token
+
+
+# Different words for the same kind of product, folded into one feature
+_SYNONYMS = {_stem(word): _stem(canonical) for word, canonical in {
+    "store": "shop", "ecommerce": "shop", "webshop": "shop", "storefront": "shop", "sell": "shop",
+    "buy": "shop", "purchase": "shop", "retail": "shop",
+    "weblog": "blog", "post": "article",
+    "signup": "account", "login": "account", "register": "account", "registration": "account",
+}.items()}
+
+# Features most sites share; they count for less than the words saying what the project is about
+_GENERIC = {_stem(word) for word in (
+    "shop", "blog", "account", "user", "profile", "customer", "admin", "dashboard", "review", "rating",
+    "comment", "cart", "checkout", "payment", "search", "filter", "category", "tag", "wishlist",
+    "newsletter", "notification", "message", "page", "feature", "platform", "portal", "mobile",
+    "responsive", "management", "system", "tool", "service", "content", "article", "form",
+)}
+# Times a topic word counts relative to a generic one
+TOPIC_WEIGHT = 4
+
+
+def normalize(text: str) -> List[str]:
+    """Lowercase, join hyphenated words, drop filler words, stem and fold synonyms"""
+    tokens = re.findall(r"[a-z0-9]+(?:-[a-z0-9]+)*", text.lower())
+    words = []
+    for token in tokens:
+        token = token.replace("-", "")
+        if token not in _STOPWORDS:
+            stem = _stem(token)
+            words.append(_SYNONYMS.get(stem, stem))
+    return words
+
+
+def features(text: str) -> Set[str]:
+    """Weighted word features of a description
+
+    Word features match paraphrases that share no characters ("online store
+    for shoes" vs "e-commerce site selling shoes"), unlike character
+    shingles. Topic words are repeated ``TOPIC_WEIGHT`` times so that the
+    Jaccard similarity MinHash estimates is weighted towards what a project
+    is about: a jewelry store and a furniture store share their generic
+    features but not their topic.
+    """
+    result = set()
+    for word in normalize(text):
+        result.add(word)
+        if word not in _GENERIC:
+            result.update(f"{word}#{copy}" for copy in range(1, TOPIC_WEIGHT))
+    return result
+
+
+def _hash32(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+class MinHash:
+    """Fixed family of universal hash functions used to sign feature sets"""
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.params = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+                       for _ in range(num_perm)]
+
+    def signature(self, items: Iterable[str]) -> Tuple[int, ...]:
+        hashes = [_hash32(item) for item in items]
+        if not hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self.params
+        )
+
+    @staticmethod
+    def similarity(left: Tuple[int, ...], right: Tuple[int, ...]) -> float:
+        """Estimated Jaccard similarity of the underlying feature sets"""
+        return sum(1 for x, y in zip(left, right) if x == y) / len(left)
+
+
+class SimilarityIndex:
+    """In-process MinHash/LSH index over project descriptions
+
+    Signatures are split into ``bands`` bands; two descriptions become
+    candidates when any band matches exactly, and candidates are then
+    ranked by their estimated Jaccard similarity.
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 32):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.minhash = MinHash(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.signatures: Dict[str, Tuple[int, ...]] = {}
+        self.buckets: List[Dict[Tuple[int, ...], Set[str]]] = [{} for _ in range(bands)]
+        self.loaded = False
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def _bands(self, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def add(self, key: str, text: str):
+        if key in self.signatures:
+            self.remove(key)
+        signature = self.minhash.signature(features(text))
+        self.signatures[key] = signature
+        for band, chunk in self._bands(signature):
+            self.buckets[band].setdefault(chunk, set()).add(key)
+
+    def remove(self, key: str):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, chunk in self._bands(signature):
+            bucket = self.buckets[band].get(chunk)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band][chunk]
+
+    def clear(self):
+        self.signatures.clear()
+        self.buckets = [{} for _ in range(self.bands)]
+
+    def query(self, text: str, threshold: float = SIMILARITY_THRESHOLD, limit: int = 5) -> List[Tuple[str, float]]:
+        """Return up to ``limit`` (key, similarity) pairs at or above ``threshold``"""
+        signature = self.minhash.signature(features(text))
+        candidates: Set[str] = set()
+        for band, chunk in self._bands(signature):
+            candidates |= self.buckets[band].get(chunk, set())
+        scored = [(key, MinHash.similarity(signature, self.signatures[key])) for key in candidates]
+        scored = [item for item in scored if item[1] >= threshold]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:limit]
+
+    def best_match(self, text: str, threshold: float = SIMILARITY_THRESHOLD) -> Optional[Tuple[str, float]]:
+        matches = self.query(text, threshold, limit=1)
+        return matches[0] if matches else None
+
+    def load(self, rows: Iterable[Tuple[str, str]]):
+        """Rebuild the index from (key, text) pairs"""
+        self.clear()
+        for key, text in rows:
+            self.add(key, text)
+        self.loaded = True
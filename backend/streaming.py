@@ -0,0 +1,76 @@
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from json_stream import IncrementalJSONParser, validate_sitemap_page
+
+MERMAID_START = "<MERMAID_START>"
+MERMAID_END = "<MERMAID_END>"
+
+
+class ArtifactStream:
+    """Receives token deltas for one artifact and reports when it is complete
+
+    ``feed`` returns True once the artifact is complete, which tells the
+    provider it can stop reading the response. Handlers only publish partial
+    snapshots; the caller publishes the final, cleaned artifact.
+    """
+
+    def reset(self):
+        """Forget partial state before a (re)try with another provider"""
+        raise NotImplementedError
+
+    async def feed(self, delta: str) -> bool:
+        raise NotImplementedError
+
+
+class SitemapStream(ArtifactStream):
+    """Emits the sitemap's pages as each page object finishes streaming"""
+
+    def __init__(self, emit: Callable[[Dict[str, Any]], Awaitable[None]]):
+        self.emit = emit
+        self.reset()
+
+    def reset(self):
+        self.parser = IncrementalJSONParser("pages", validate_sitemap_page)
+
+    async def feed(self, delta: str) -> bool:
+        new_pages = self.parser.feed(delta)
+        if self.parser.complete:
+            return True
+        if new_pages:
+            await self.emit({"pages": list(self.parser.items)})
+        return False
+
+
+class MermaidStream(ArtifactStream):
+    """Emits the diagram text line by line, throttled to ``min_interval`` seconds"""
+
+    def __init__(self, emit: Callable[[str], Awaitable[None]], min_interval: float = 0.25):
+        self.emit = emit
+        self.min_interval = min_interval
+        self.reset()
+
+    def reset(self):
+        self.text = ""
+        self.emitted_lines = 0
+        self.last_emit = 0.0
+
+    def _diagram(self) -> str:
+        body = self.text
+        if MERMAID_START in body:
+            body = body.split(MERMAID_START, 1)[1]
+        return body.split(MERMAID_END, 1)[0]
+
+    async def feed(self, delta: str) -> bool:
+        self.text += delta
+        if MERMAID_END in self.text:
+            return True
+
+        # Only publish whole lines so clients never render half a node
+        lines: List[str] = self._diagram().split("\n")[:-1]
+        now = time.monotonic()
+        if len(lines) > self.emitted_lines and now - self.last_emit >= self.min_interval:
+            self.emitted_lines = len(lines)
+            self.last_emit = now
+            await self.emit("\n".join(lines).strip())
+        return False
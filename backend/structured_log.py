@@ -0,0 +1,219 @@
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
+import sys
+from typing import Any, Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of DEBUG/INFO records kept; warnings and errors are always kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_DIR = os.getenv("LOG_DIR", os.path.join(os.path.dirname(__file__), "logs"))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Echo records to stderr as one readable line each
+LOG_CONSOLE = os.getenv("LOG_CONSOLE", "true").lower() in ("1", "true", "yes")
+# Records waiting for the writer thread; beyond this new records are dropped rather than blocking
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Raw model responses, kept apart from the application log
+RAW_RESPONSE_LOG = os.getenv("RAW_RESPONSE_LOG", "true").lower() in ("1", "true", "yes")
+RAW_RESPONSE_MAX_BYTES = int(os.getenv("RAW_RESPONSE_MAX_BYTES", str(50 * 1024 * 1024)))
+RAW_RESPONSE_BACKUP_COUNT = int(os.getenv("RAW_RESPONSE_BACKUP_COUNT", "5"))
+
+ROOT_LOGGER = "architect"
+RAW_LOGGER = "architect_raw"
+
+
+class EventLogger(logging.LoggerAdapter):
+    """Logger taking structured fields as keyword arguments: ``log.info("Sitemap parsed", pages=5)``"""
+    RESERVED = {"exc_info", "stack_info", "stacklevel", "extra"}
+
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in self.RESERVED}
+        kwargs["extra"] = {**kwargs.get("extra", {}), "fields": fields}
+        return msg, kwargs
+
+
+def get_logger(name: str) -> EventLogger:
+    return EventLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"), {})
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message and the record's fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {**getattr(record, "fields", {})}
+        entry.update(ts=round(record.created, 3), level=record.levelname, logger=record.name, msg=record.getMessage())
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{key}={value}" for key, value in getattr(record, "fields", {}).items())
+        line = f"{record.levelname} {record.name}: {record.getMessage()}{' ' + fields if fields else ''}"
+        return f"{line}\n{record.exc_text}" if record.exc_text else line
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a ``rate`` fraction of records below WARNING"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread, dropping them when its queue is full instead of blocking"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Like the base class, but the traceback stays out of the message so it gets its own field
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.getMessage(), None, None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _gzip_rotator(source: str, dest: str):
+    with open(source, "rb") as plain, gzip.open(dest, "wb") as compressed:
+        shutil.copyfileobj(plain, compressed)
+    os.remove(source)
+
+
+def rotating_handler(path: str, max_bytes: int, backup_count: int) -> logging.Handler:
+    """Size-rotated JSONL file whose rotated segments are gzip-compressed (``name.1.gz``, ...)"""
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                   encoding="utf-8", delay=True)
+    handler.namer = lambda name: f"{name}.gz"
+    handler.rotator = _gzip_rotator
+    handler.setFormatter(JSONFormatter())
+    return handler
+
+
+class _OnlyLogger(logging.Filter):
+    def __init__(self, name: str, include: bool):
+        super().__init__()
+        self.name_ = name
+        self.include = include
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return (record.name == self.name_) == self.include
+
+
+class LogWriter:
+    """Moves log records off the calling thread
+
+    Loggers only put records on a bounded queue; one background thread
+    formats them and writes ``app.jsonl`` (and the console), plus
+    ``raw_responses.jsonl`` for raw model output, into ``log_dir``
+    (LOG_DIR by default). The live files are plain JSONL; only their
+    rotated segments are gzip-compressed.
+    """
+
+    def __init__(self, log_dir: Optional[str] = None, level: str = LOG_LEVEL, sample_rate: float = LOG_SAMPLE_RATE,
+                 console: bool = LOG_CONSOLE, raw_responses: bool = RAW_RESPONSE_LOG):
+        # Looked up at call time so the directory can be redirected, e.g. by tests
+        log_dir = log_dir or LOG_DIR
+        os.makedirs(log_dir, exist_ok=True)
+        self.queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+
+        app = rotating_handler(os.path.join(log_dir, "app.jsonl"), LOG_MAX_BYTES, LOG_BACKUP_COUNT)
+        app.addFilter(_OnlyLogger(RAW_LOGGER, include=False))
+        handlers = [app]
+        if console:
+            stream = logging.StreamHandler(sys.stderr)
+            stream.setFormatter(ConsoleFormatter())
+            stream.addFilter(_OnlyLogger(RAW_LOGGER, include=False))
+            handlers.append(stream)
+        if raw_responses:
+            raw = rotating_handler(os.path.join(log_dir, "raw_responses.jsonl"), RAW_RESPONSE_MAX_BYTES,
+                                   RAW_RESPONSE_BACKUP_COUNT)
+            raw.addFilter(_OnlyLogger(RAW_LOGGER, include=True))
+            handlers.append(raw)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers)
+
+        self.handler = DroppingQueueHandler(self.queue)
+        self.handler.addFilter(SamplingFilter(sample_rate))
+        self.logger = logging.getLogger(ROOT_LOGGER)
+        self.logger.setLevel(level)
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+
+        # Raw responses are never sampled
+        self.raw_handler = DroppingQueueHandler(self.queue) if raw_responses else None
+        self.raw_logger = logging.getLogger(RAW_LOGGER)
+        self.raw_logger.setLevel(logging.INFO)
+        self.raw_logger.propagate = False
+        if self.raw_handler:
+            self.raw_logger.addHandler(self.raw_handler)
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        """Flush what is queued and stop the writer thread"""
+        self.listener.stop()
+        self.logger.removeHandler(self.handler)
+        if self.raw_handler:
+            self.raw_logger.removeHandler(self.raw_handler)
+        for handler in self.listener.handlers:
+            handler.close()
+
+    def stats(self) -> Dict[str, Any]:
+        dropped = self.handler.dropped + (self.raw_handler.dropped if self.raw_handler else 0)
+        return {"queued": self.queue.qsize(), "dropped": dropped}
+
+
+_writer: Optional[LogWriter] = None
+
+
+def setup_logging(**options) -> LogWriter:
+    """Start the background log writer once per process"""
+    global _writer
+    if _writer is None:
+        _writer = LogWriter(**options)
+        _writer.start()
+    return _writer
+
+
+def shutdown_logging():
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+def log_stats() -> Dict[str, Any]:
+    if _writer is None:
+        return {"enabled": False}
+    return {"enabled": True, **_writer.stats()}
+
+
+def record_raw_response(text: str, **fields):
+    """Store one raw model response; a no-op until logging is set up or with RAW_RESPONSE_LOG off"""
+    raw_logger = logging.getLogger(RAW_LOGGER)
+    if raw_logger.handlers:
+        raw_logger.info(text, extra={"fields": fields})
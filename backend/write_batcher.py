@@ -0,0 +1,160 @@
+import asyncio
+import itertools
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "64"))
+WRITE_BATCH_INTERVAL_MS = float(os.getenv("WRITE_BATCH_INTERVAL_MS", "10"))
+
+# A write receives the batch's session and must not commit; it may return a plain value
+WriteOp = Callable[[Session], Any]
+
+
+class WriteBatcher:
+    """Group commit for database writes from concurrent generations
+
+    Writes are queued and applied together in one transaction, committed
+    from a worker thread once ``max_batch`` writes are waiting or
+    ``interval`` seconds after the first one arrived. ``write`` resolves
+    only after the commit, so callers get a durability acknowledgement.
+    Writes submitted with the same ``key`` while still queued coalesce into
+    the latest one. A failing write is retried alone, so it cannot fail the
+    others in its batch.
+    """
+
+    _sequence = itertools.count()
+
+    def __init__(self, session_factory: Callable[[], Session], max_batch: int = WRITE_BATCH_SIZE,
+                 interval: float = WRITE_BATCH_INTERVAL_MS / 1000):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.interval = interval
+        self.pending: "OrderedDict[Hashable, Tuple[WriteOp, List[asyncio.Future]]]" = OrderedDict()
+        self.wakeup: Optional[asyncio.Event] = None
+        self.full: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.closing = False
+        self.stats = {"batches": 0, "writes": 0, "coalesced": 0, "failed": 0}
+
+    @property
+    def started(self) -> bool:
+        return self.task is not None
+
+    async def start(self):
+        if self.started:
+            return
+        self.wakeup = asyncio.Event()
+        self.full = asyncio.Event()
+        self.closing = False
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Commit everything still queued, then stop the committer"""
+        if not self.started:
+            return
+        self.closing = True
+        self.wakeup.set()
+        self.full.set()
+        try:
+            await self.task
+        finally:
+            self.task = None
+
+    def submit(self, op: WriteOp, key: Optional[Hashable] = None) -> asyncio.Future:
+        """Queue a write without waiting; the returned future resolves after its commit"""
+        future = asyncio.get_running_loop().create_future()
+        if not self.started:
+            # No committer running (e.g. during startup): write straight through
+            ok, result = self._commit_one(op)
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+            return future
+
+        if key is not None and key in self.pending:
+            _, futures = self.pending[key]
+            self.pending[key] = (op, futures + [future])
+            self.stats["coalesced"] += 1
+        else:
+            self.pending[key if key is not None else ("write", next(self._sequence))] = (op, [future])
+        self.wakeup.set()
+        if len(self.pending) >= self.max_batch:
+            self.full.set()
+        return future
+
+    async def write(self, op: WriteOp, key: Optional[Hashable] = None) -> Any:
+        """Queue a write and wait until it is committed"""
+        if not self.started:
+            ok, result = await asyncio.to_thread(self._commit_one, op)
+            if not ok:
+                raise result
+            return result
+        return await self.submit(op, key)
+
+    async def _run(self):
+        while True:
+            await self.wakeup.wait()
+            if not self.closing:
+                # Give concurrent writers a moment to join the batch
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush()
+            if not self.pending:
+                if self.closing:
+                    return
+                self.wakeup.clear()
+
+    async def _flush(self):
+        batch = []
+        while self.pending and len(batch) < self.max_batch:
+            batch.append(self.pending.popitem(last=False)[1])
+        if len(self.pending) < self.max_batch and not self.closing:
+            self.full.clear()
+        if not batch:
+            return
+
+        # Commit off the event loop; a batch is never split across threads
+        outcomes = await asyncio.to_thread(self._commit_batch, [op for op, _ in batch])
+        self.stats["batches"] += 1
+        self.stats["writes"] += len(batch)
+        for (_, futures), (ok, result) in zip(batch, outcomes):
+            if not ok:
+                self.stats["failed"] += 1
+            for future in futures:
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+
+    def _commit_batch(self, ops: List[WriteOp]) -> List[Tuple[bool, Any]]:
+        db = self.session_factory()
+        try:
+            results = [op(db) for op in ops]
+            db.commit()
+            return [(True, result) for result in results]
+        except Exception:
+            db.rollback()
+        finally:
+            db.close()
+        # Isolate the failing write so it doesn't take the rest of the batch down
+        return [self._commit_one(op) for op in ops]
+
+    def _commit_one(self, op: WriteOp) -> Tuple[bool, Any]:
+        db = self.session_factory()
+        try:
+            result = op(db)
+            db.commit()
+            return True, result
+        except Exception as e:
+            db.rollback()
+            return False, e
+        finally:
+            db.close()
@@ -0,0 +1,14 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+import structured_log
+
+@pytest.fixture(autouse=True, scope="session")
+def log_dir(tmp_path_factory):
+    """Send the logs of apps started by tests to a temporary directory instead of backend/logs"""
+    structured_log.LOG_DIR = str(tmp_path_factory.mktemp("logs"))
+    yield structured_log.LOG_DIR
+    structured_log.shutdown_logging()
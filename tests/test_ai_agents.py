@@ -1,88 +1,90 @@
 import pytest
 import asyncio
-from unittest.mock import Mock, patch, AsyncMock
+from unittest.mock import Mock, AsyncMock
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
 
-from backend.ai_agents import AIAgents
+from backend.ai_agents import AIAgents, MermaidSyntaxError, StructuredOutputError
+from backend.llm_cache import LLMCache
+from backend.llm_providers import Completion
 
 @pytest.fixture
 def ai_agents():
-    return AIAgents()
+    agents = AIAgents()
+    # Route every call through a mocked Anthropic provider
+    agents.use_openai = False
+    agents.openai_provider = None
+    agents.anthropic_provider = Mock()
+    agents.anthropic_provider.model = "claude-test"
+    agents.anthropic_provider.name = "anthropic"
+    agents.anthropic_provider.max_tokens = 10000
+    agents.anthropic_provider.complete = AsyncMock()
+    # Fresh in-memory cache so results never leak between tests
+    agents.cache = LLMCache(path=":memory:")
+    return agents
+
+def make_completion(text, stop_reason="end_turn"):
+    return Completion(text=text, provider="anthropic", model="claude-test", stop_reason=stop_reason)
 
 @pytest.fixture
 def mock_anthropic_response():
     """Mock Anthropic API response"""
-    mock_response = Mock()
-    mock_response.content = [Mock()]
-    mock_response.content[0].text = '{"pages": [{"name": "Home", "path": "/"}]}'
-    return mock_response
+    return make_completion('{"pages": [{"name": "Home", "path": "/"}]}')
 
 @pytest.mark.asyncio
 async def test_generate_site_maps(ai_agents, mock_anthropic_response):
     """Test site map generation"""
-    with patch.object(ai_agents.client.messages, 'create') as mock_create:
-        mock_create.return_value = mock_anthropic_response
-        
-        result = await ai_agents.generate_site_maps("Test project", count=2)
-        
-        assert len(result) == 2
-        assert all(isinstance(r, dict) for r in result)
-        assert mock_create.call_count == 2
+    mock_create = ai_agents.anthropic_provider.complete
+    mock_create.return_value = mock_anthropic_response
+    
+    result = await ai_agents.generate_site_maps("Test project", count=2)
+    
+    assert len(result) == 2
+    assert all(isinstance(r, dict) for r in result)
+    assert mock_create.call_count == 2
 
 @pytest.mark.asyncio
 async def test_generate_mermaid_diagrams(ai_agents):
     """Test Mermaid diagram generation"""
-    mock_response = Mock()
-    mock_response.content = [Mock()]
-    mock_response.content[0].text = 'graph TD\nA[Home] --> B[About]'
+    mock_create = ai_agents.anthropic_provider.complete
+    mock_create.return_value = make_completion('graph TD\nA[Home] --> B[About]')
     
-    with patch.object(ai_agents.client.messages, 'create') as mock_create:
-        mock_create.return_value = mock_response
-        
-        site_map = {"pages": [{"name": "Home", "path": "/"}]}
-        result = await ai_agents.generate_mermaid_diagrams("Test project", site_map, count=2)
-        
-        assert len(result) == 2
-        assert all("graph TD" in r for r in result)
-        assert mock_create.call_count == 2
+    site_map = {"pages": [{"name": "Home", "path": "/"}]}
+    result = await ai_agents.generate_mermaid_diagrams("Test project", site_map, count=2)
+    
+    assert len(result) == 2
+    assert all(r.startswith("flowchart TD\n") and "A[Home]:::blackBox" in r for r in result)
+    assert mock_create.call_count == 2
 
 @pytest.mark.asyncio
 async def test_generate_backend_diagrams(ai_agents):
     """Test backend diagram generation"""
-    mock_response = Mock()
-    mock_response.content = [Mock()]
-    mock_response.content[0].text = 'flowchart TD\nAPI --> Database'
+    mock_create = ai_agents.anthropic_provider.complete
+    mock_create.return_value = make_completion('flowchart TD\nAPI --> Database')
+    
+    result = await ai_agents.generate_backend_diagrams("Test project", count=3)
     
-    with patch.object(ai_agents.client.messages, 'create') as mock_create:
-        mock_create.return_value = mock_response
-        
-        result = await ai_agents.generate_backend_diagrams("Test project", count=3)
-        
-        assert len(result) == 3
-        assert all("flowchart TD" in r for r in result)
-        assert mock_create.call_count == 3
+    assert len(result) == 3
+    assert all("flowchart TD" in r for r in result)
+    assert mock_create.call_count == 3
 
 @pytest.mark.asyncio
 async def test_rate_artifacts(ai_agents):
     """Test artifact rating"""
-    mock_response = Mock()
-    mock_response.content = [Mock()]
-    mock_response.content[0].text = '''[
+    mock_create = ai_agents.anthropic_provider.complete
+    mock_create.return_value = make_completion('''[
         {"index": 0, "overall_score": 8.5, "completeness": 9, "clarity": 8, "feasibility": 8, "innovation": 9}
-    ]'''
-    
-    with patch.object(ai_agents.client.messages, 'create') as mock_create:
-        mock_create.return_value = mock_response
-        
-        artifacts = [{"pages": [{"name": "Home"}]}]
-        result = await ai_agents.rate_artifacts(artifacts, "site maps", "Test project")
-        
-        assert isinstance(result, list)
-        assert len(result) == 1
-        assert result[0]["overall_score"] == 8.5
-        assert result[0]["completeness"] == 9
+    ]''')
+    
+    artifacts = [{"pages": [{"name": "Home"}]}]
+    result = await ai_agents.rate_artifacts(artifacts, "site maps", "Test project")
+    
+    assert isinstance(result, list)
+    assert len(result) == 1
+    assert result[0]["overall_score"] == 8.5
+    assert result[0]["completeness"] == 9
 
 def test_parse_json_response(ai_agents):
     """Test JSON parsing from model responses"""
@@ -115,8 +117,328 @@ def test_clean_mermaid_diagram(ai_agents):
 @pytest.mark.asyncio
 async def test_error_handling(ai_agents):
     """Test error handling in AI agent methods"""
-    with patch.object(ai_agents.client.messages, 'create') as mock_create:
-        mock_create.side_effect = Exception("API Error")
-        
-        result = await ai_agents._generate_with_model("Test prompt")
-        assert result == ""
\ No newline at end of file
+    mock_create = ai_agents.anthropic_provider.complete
+    mock_create.side_effect = Exception("API Error")
+
+    result = await ai_agents._generate_with_model("Test prompt")
+    assert result == ""
+@pytest.mark.asyncio
+async def test_diagram_generation_runs_concurrently(ai_agents):
+    """Test that multiple diagram requests are in flight at the same time"""
+    in_flight = 0
+    max_in_flight = 0
+    
+    async def slow_complete(*args, **kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return make_completion('flowchart TD\nAPI --> Database')
+    
+    ai_agents.anthropic_provider.complete.side_effect = slow_complete
+    
+    result = await ai_agents.generate_backend_diagrams("Test project", count=3)
+    
+    assert len(result) == 3
+    assert max_in_flight == 3
+
+
+@pytest.mark.asyncio
+async def test_repeated_prompt_served_from_cache(ai_agents):
+    """Test that an identical request is answered without calling the provider"""
+    mock_create = ai_agents.anthropic_provider.complete
+    mock_create.return_value = make_completion('flowchart TD\nAPI --> Database')
+    
+    first = await ai_agents.generate_backend_diagrams("Cached project")
+    second = await ai_agents.generate_backend_diagrams("Cached project")
+    
+    assert first == second
+    assert mock_create.call_count == 1
+    assert ai_agents.cache.get_stats()["hits"] == 1
+
+@pytest.mark.asyncio
+async def test_cache_bypass_and_truncated_results(ai_agents):
+    """Test the per-request bypass switch and that truncated output is not cached"""
+    mock_create = ai_agents.anthropic_provider.complete
+    mock_create.return_value = make_completion('{"pages": [', stop_reason="max_tokens")
+    
+    await ai_agents._generate_with_model("Truncated prompt")
+    await ai_agents._generate_with_model("Truncated prompt")
+    assert mock_create.call_count == 2
+    
+    mock_create.return_value = make_completion("complete answer")
+    await ai_agents._generate_with_model("Fresh prompt")
+    await ai_agents._generate_with_model("Fresh prompt", use_cache=False)
+    assert mock_create.call_count == 4
+
+@pytest.mark.asyncio
+async def test_streaming_publishes_partial_and_final_artifacts(ai_agents):
+    """Test streamed sitemaps emit partial pages, then the final artifact"""
+    text = '{"pages": [{"name": "Home", "path": "/"}, {"name": "About", "path": "/about"}]}'
+    
+    async def fake_stream(prompt, on_delta, instructions=None, schema=None):
+        for i in range(0, len(text), 10):
+            if await on_delta(text[i:i + 10]):
+                break
+        return make_completion(text, stop_reason="artifact_complete")
+    
+    ai_agents.anthropic_provider.stream = AsyncMock(side_effect=fake_stream)
+    ai_agents.streaming = True
+    published = []
+    async def on_artifact(project_id, artifact, index, content, complete):
+        published.append((artifact, index, complete, content))
+    ai_agents.set_artifact_callback(on_artifact)
+    
+    result = await ai_agents.generate_site_maps("Test project", count=1, project_id="p1")
+    
+    assert len(result[0]["pages"]) == 2
+    ai_agents.anthropic_provider.complete.assert_not_called()
+    partial = [p for p in published if not p[2]]
+    assert partial and partial[0][3] == {"pages": [{"name": "Home", "path": "/"}]}
+    assert published[-1] == ("site_maps", 0, True, result[0])
+    # A stream ended early on a complete artifact is still cacheable
+    assert ai_agents.cache.get_stats()["memory_entries"] == 1
+
+@pytest.mark.asyncio
+async def test_truncated_sitemap_salvages_complete_pages(ai_agents):
+    """Test a cut-off sitemap keeps its finished pages instead of the fallback"""
+    text = '{"pages": [{"name": "Home", "path": "/"}, {"name": "Shop", "path": "/shop"}, {"name": "Cart", "pa'
+    ai_agents.anthropic_provider.complete.return_value = make_completion(text, stop_reason="max_tokens")
+    
+    result = await ai_agents.generate_site_maps("Test project", count=1)
+    
+    assert [page["name"] for page in result[0]["pages"]] == ["Home", "Shop"]
+
+def test_parse_json_response_recovers_from_prose(ai_agents):
+    """Test JSON surrounded by explanation is still parsed"""
+    result = ai_agents._parse_json_response('Sure! Here it is:\n{"pages": [{"name": "Home", "path": "/"}]}\nLet me know.')
+    assert result == {"pages": [{"name": "Home", "path": "/"}]}
+
+@pytest.mark.asyncio
+async def test_generate_selected_indices_only(ai_agents):
+    """Test regenerating one option calls the model once and publishes it at its own index"""
+    ai_agents.anthropic_provider.complete.return_value = make_completion('flowchart TD\nAPI --> Cache')
+    published = []
+    async def on_artifact(project_id, artifact, index, content, complete):
+        published.append((artifact, index, complete))
+    ai_agents.set_artifact_callback(on_artifact)
+    ai_agents.streaming = False
+    
+    result = await ai_agents.generate_backend_diagrams("Test project", count=3, project_id="p1", indices=[1])
+    
+    assert result == ['flowchart TD\n    classDef blackBox fill:#000,stroke:#fff,stroke-width:2px,color:#fff\n'
+                      '    API:::blackBox\n    Cache:::blackBox\n    API --> Cache']
+    assert ai_agents.anthropic_provider.complete.call_count == 1
+    prompt = ai_agents.anthropic_provider.complete.call_args[0][0]
+    assert "Agent 2" in prompt and "database schema" in prompt
+    assert published == [("backend_diagrams", 1, True)]
+
+@pytest.mark.asyncio
+async def test_site_map_candidates_run_concurrently(ai_agents):
+    """Test sitemap candidates are generated in parallel rather than one after another"""
+    in_flight = 0
+    max_in_flight = 0
+    
+    async def slow_complete(*args, **kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return make_completion('{"pages": [{"name": "Home", "path": "/"}]}')
+    
+    ai_agents.anthropic_provider.complete.side_effect = slow_complete
+    result = await ai_agents.generate_site_maps("Test project", count=3)
+    
+    assert len(result) == 3
+    assert max_in_flight == 3
+
+@pytest.mark.asyncio
+async def test_rank_candidates_uses_one_critic_call(ai_agents):
+    """Test all candidates are rated together and ratings map back to their artifacts"""
+    async def candidate(value, delay):
+        await asyncio.sleep(delay)
+        return value
+    
+    ai_agents.rate_artifacts = AsyncMock(return_value=[
+        {"index": 0, "overall_score": 6}, {"index": 1, "overall_score": 9}, {"index": 7, "overall_score": 10}
+    ])
+    artifacts, ratings = await ai_agents.rank_candidates(
+        [candidate("a", 0.02), candidate("b", 0.01)], "diagrams", "Test project"
+    )
+    
+    assert artifacts == ["a", "b"]
+    ai_agents.rate_artifacts.assert_awaited_once()
+    # The out-of-range rating is dropped
+    assert [(r["index"], r["overall_score"]) for r in ratings] == [(0, 6), (1, 9)]
+
+@pytest.mark.asyncio
+async def test_rank_candidates_early_exit_cancels_slow_candidates(ai_agents):
+    """Test a good enough early candidate stops the wait for slower ones"""
+    cancelled = []
+    
+    async def candidate(value, delay):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(value)
+            raise
+        return value
+    
+    ai_agents.rate_artifacts = AsyncMock(return_value=[{"index": 0, "overall_score": 9}])
+    artifacts, ratings = await asyncio.wait_for(ai_agents.rank_candidates(
+        [candidate("slow", 5), candidate("fast", 0.01), candidate("slower", 5)], "diagrams", "Test project",
+        early_exit_score=8, quorum=1
+    ), 1)
+    
+    assert artifacts == ["fast"]
+    assert ratings == [{"index": 0, "overall_score": 9}]
+    assert sorted(cancelled) == ["slow", "slower"]
+    
+    # Below the threshold every candidate is awaited and the rest rated in a second call
+    ai_agents.rate_artifacts = AsyncMock(side_effect=[[{"index": 0, "overall_score": 5}], [{"index": 0, "overall_score": 7}]])
+    artifacts, ratings = await ai_agents.rank_candidates(
+        [candidate("a", 0.03), candidate("b", 0.01)], "diagrams", "Test project", early_exit_score=8, quorum=1
+    )
+    assert artifacts == ["a", "b"]
+    assert [(r["index"], r["overall_score"]) for r in ratings] == [(0, 7), (1, 5)]
+
+@pytest.mark.asyncio
+async def test_token_usage_recorded_per_call(ai_agents):
+    """Test reported token counts reach the usage recorder, with estimates when none are reported"""
+    calls = []
+    ai_agents.set_usage_recorder(lambda project_id, task, completion: calls.append(
+        (project_id, task, completion.input_tokens, completion.output_tokens, completion.stop_reason)
+    ))
+    reported = make_completion('flowchart TD\nA --> B')
+    reported.input_tokens, reported.output_tokens = 120, 15
+    ai_agents.anthropic_provider.complete.return_value = reported
+    
+    await ai_agents.generate_backend_diagrams("Test project", project_id="p1")
+    ai_agents.anthropic_provider.complete.return_value = make_completion("x" * 40)
+    await ai_agents._generate_with_model("y" * 400, "p1", task="rating", use_cache=False)
+    await ai_agents.generate_backend_diagrams("Test project", project_id="p1")
+    
+    assert calls[0] == ("p1", "backend", 120, 15, "end_turn")
+    assert calls[1] == ("p1", "rating", 101, 11, "end_turn")
+    assert calls[2][1] == "backend" and calls[2][4] == "cached"
+
+@pytest.mark.asyncio
+async def test_invalid_sitemap_is_repaired_from_its_errors(ai_agents):
+    """Test a sitemap failing the schema is sent back with only its errors, not regenerated"""
+    ai_agents.anthropic_provider.complete.side_effect = [
+        make_completion('{"pages": [{"name": "Home", "path": "/"}, {"name": "Shop"}]}'),
+        make_completion('{"pages": [{"name": "Home", "path": "/"}, {"name": "Shop", "path": "/shop"}]}'),
+    ]
+    
+    result = await ai_agents.generate_site_maps("Test project", count=1)
+    
+    assert [page["path"] for page in result[0]["pages"]] == ["/", "/shop"]
+    assert result[0]["pages"][1]["features"] == []
+    first, repair = [call.args[0] for call in ai_agents.anthropic_provider.complete.call_args_list]
+    assert "pages[1]: path: Field required" in repair
+    assert '{"name": "Shop"}' in repair
+    assert "web architecture specialist" not in repair
+    # Both requests are constrained to the sitemap schema
+    assert all(call.kwargs["schema"]["required"] == ["pages"]
+               for call in ai_agents.anthropic_provider.complete.call_args_list)
+
+@pytest.mark.asyncio
+async def test_unrepairable_sitemap_raises_instead_of_placeholder(ai_agents):
+    """Test a sitemap that never validates fails loudly, and ranking drops it"""
+    ai_agents.anthropic_provider.complete.return_value = make_completion("I cannot produce a sitemap.")
+    
+    with pytest.raises(StructuredOutputError) as error:
+        await ai_agents.generate_site_maps("Test project", count=1)
+    assert error.value.errors == ["the response does not contain a JSON object"]
+    assert ai_agents.anthropic_provider.complete.call_count == 2
+    
+    async def broken():
+        raise StructuredOutputError("bad sitemap", [])
+    
+    async def good():
+        return {"pages": [{"name": "Home", "path": "/"}]}
+    
+    ai_agents.anthropic_provider.complete.return_value = make_completion('[{"index": 0, "overall_score": 7}]')
+    artifacts, ratings = await ai_agents.rank_candidates([broken(), good()], "site maps", "Test project")
+    assert artifacts == [{"pages": [{"name": "Home", "path": "/"}]}]
+    assert ratings == [{"index": 0, "overall_score": 7}]
+    
+    with pytest.raises(StructuredOutputError):
+        await ai_agents.rank_candidates([broken()], "site maps", "Test project")
+
+@pytest.mark.asyncio
+async def test_broken_diagram_is_repaired_from_its_parse_error(ai_agents):
+    """Test a diagram that does not parse is sent back with its error and stored normalized"""
+    ai_agents.anthropic_provider.complete.side_effect = [
+        make_completion('<MERMAID_START>\nflowchart TB\n    API[Gateway --> DB\n<MERMAID_END>'),
+        make_completion('<MERMAID_START>\nflowchart TB\n    API[Gateway] --> DB\n<MERMAID_END>'),
+    ]
+    
+    result = await ai_agents.generate_backend_diagrams("Test project", count=1)
+    
+    assert "API[Gateway]:::blackBox" in result[0] and "API --> DB" in result[0]
+    repair = ai_agents.anthropic_provider.complete.call_args_list[1].args[0]
+    assert "line 2: unclosed shape for node 'API'" in repair
+    assert "backend architecture specialist" not in repair
+    
+    ai_agents.anthropic_provider.complete.side_effect = None
+    ai_agents.anthropic_provider.complete.return_value = make_completion("I cannot draw that.")
+    with pytest.raises(MermaidSyntaxError):
+        await ai_agents.generate_backend_diagrams("Other project", count=1)
+
+@pytest.mark.asyncio
+async def test_invalid_responses_are_not_cached(ai_agents):
+    """Test output failing its schema or the Mermaid parser is neither cached nor replayed"""
+    ai_agents.anthropic_provider.complete.return_value = make_completion("I cannot produce a sitemap.")
+    with pytest.raises(StructuredOutputError):
+        await ai_agents.generate_site_maps("Test project", count=1)
+    ai_agents.anthropic_provider.complete.return_value = make_completion("I cannot draw that.")
+    with pytest.raises(MermaidSyntaxError):
+        await ai_agents.generate_backend_diagrams("Test project", count=1)
+    assert ai_agents.cache.get_stats()["writes"] == 0
+    
+    ai_agents.anthropic_provider.complete.reset_mock()
+    ai_agents.anthropic_provider.complete.return_value = make_completion('{"pages": [{"name": "Home", "path": "/"}]}')
+    result = await ai_agents.generate_site_maps("Test project", count=1)
+    assert result[0]["pages"][0]["path"] == "/"
+    assert ai_agents.anthropic_provider.complete.call_count == 1
+    assert ai_agents.cache.get_stats()["writes"] == 1
+
+@pytest.mark.asyncio
+async def test_invalid_cached_response_is_evicted(ai_agents):
+    """Test an invalid response already in the cache is dropped and requested again"""
+    mock_create = ai_agents.anthropic_provider.complete
+    mock_create.return_value = make_completion('flowchart TD\nAPI --> Database')
+    await ai_agents.generate_backend_diagrams("Cached project")
+    [key] = list(ai_agents.cache._memory)
+    ai_agents.cache.set(key, "flowchart TD\nAPI[Gateway --> Database")
+    
+    result = await ai_agents.generate_backend_diagrams("Cached project")
+    
+    assert "API --> Database" in result[0]
+    assert mock_create.call_count == 2
+    assert ai_agents.cache.get(key) == 'flowchart TD\nAPI --> Database'
+
+@pytest.mark.asyncio
+async def test_provider_latency_excludes_rate_limiter_wait(ai_agents):
+    """Test the latency recorded for a provider starts when the request is sent, not when it queues"""
+    ai_agents.anthropic_provider.complete.return_value = make_completion("answer")
+    limiter = ai_agents.limiters.get(ai_agents.anthropic_provider)
+    call = limiter.call
+    
+    async def queued_call(request, tokens, usage=None):
+        # Waiting for a slot
+        await asyncio.sleep(0.2)
+        return await call(request, tokens, usage)
+    
+    limiter.call = queued_call
+    recorded = []
+    ai_agents.set_latency_recorder(lambda name, seconds: recorded.append((name, seconds)))
+    
+    await ai_agents._generate_with_model("Prompt", use_cache=False)
+    
+    [(name, seconds)] = [item for item in recorded if item[0].startswith("provider:")]
+    assert name == "provider:anthropic"
+    assert seconds < 0.1
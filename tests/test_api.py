@@ -1,21 +1,27 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from unittest.mock import patch, AsyncMock
 import sys
 import os
+import time
+import json
+import asyncio
+import threading
+from datetime import datetime, timedelta
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
 
-from backend.main import app
-from backend.database import get_db
-from backend.models import Base, Project
+from main import app, job_queue, similarity_index, manager, PROJECTS_MAX_PAGE_SIZE, PROJECTS_PAGE_SIZE
+from database import get_db, get_async_db, make_engines
+from models import Base, Project
+from sqlalchemy.ext.asyncio import async_sessionmaker
 
 # Test database setup
 SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///./test_api.db"
-engine = create_engine(SQLALCHEMY_TEST_DATABASE_URL, connect_args={"check_same_thread": False})
+engine, async_engine = make_engines(SQLALCHEMY_TEST_DATABASE_URL)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
 Base.metadata.create_all(bind=engine)
 
@@ -26,7 +32,14 @@ def override_get_db():
     finally:
         db.close()
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
+job_queue.session_factory = TestingSessionLocal
+job_queue.writer.session_factory = TestingSessionLocal
 
 client = TestClient(app)
 
@@ -69,6 +82,51 @@ def test_get_projects_with_data():
     assert data[0]["name"] == "Test Project"
     assert data[0]["description"] == "Test Description"
 
+def test_get_projects_keyset_pagination():
+    """Test paging through projects with a cursor, including timestamp ties"""
+    db = TestingSessionLocal()
+    tied = datetime(2024, 1, 1, 12, 0, 0)
+    for i in range(5):
+        db.add(Project(id=f"p{i}", name=f"Project {i}", description="Paged",
+                       created_at=tied if i < 3 else tied + timedelta(minutes=i)))
+    db.commit()
+    db.close()
+    
+    seen, cursor = [], None
+    for _ in range(5):
+        params = {"limit": 2, "fields": "summary"}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/projects", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert all(set(item) == {"id", "name", "description", "created_at"} for item in page)
+        seen.extend(item["id"] for item in page)
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    
+    # Newest first, ties broken by id, every project exactly once
+    assert seen == ["p4", "p3", "p2", "p1", "p0"]
+
+def test_get_projects_pages_by_default():
+    """Test the list is paged even without a limit, and oversized pages are rejected"""
+    db = TestingSessionLocal()
+    db.add_all([Project(name=f"Project {i}", description="Paged") for i in range(PROJECTS_PAGE_SIZE + 1)])
+    db.commit()
+    db.close()
+    
+    response = client.get("/projects", params={"fields": "summary"})
+    assert response.status_code == 200
+    assert len(response.json()) == PROJECTS_PAGE_SIZE
+    assert response.headers["x-next-cursor"]
+    assert client.get("/projects", params={"limit": PROJECTS_MAX_PAGE_SIZE + 1}).status_code == 422
+
+def test_get_projects_invalid_cursor():
+    """Test a malformed cursor is rejected"""
+    response = client.get("/projects", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
 def test_get_project_by_id():
     """Test getting a specific project"""
     # Add test project
@@ -85,36 +143,122 @@ def test_get_project_by_id():
     assert data["name"] == "Specific Project"
     assert data["id"] == project_id
 
+def test_get_project_include_and_artifact_endpoint():
+    """Test selective artifact loading per project page"""
+    db = TestingSessionLocal()
+    project = Project(
+        name="Artifacts",
+        description="Split storage",
+        site_maps=[{"pages": [{"name": "Home"}]}],
+        mermaid_diagrams=["graph TD\nA-->B"]
+    )
+    db.add(project)
+    db.commit()
+    project_id = project.id
+    db.close()
+    
+    data = client.get(f"/projects/{project_id}", params={"include": "site_maps,ratings"}).json()
+    assert data["site_maps"] == [{"pages": [{"name": "Home"}]}]
+    assert data["ratings"] == {}
+    assert "mermaid_diagrams" not in data and "backend_diagrams" not in data
+    
+    data = client.get(f"/projects/{project_id}", params={"include": ""}).json()
+    assert set(data) == {"id", "name", "description", "created_at"}
+    
+    assert client.get(f"/projects/{project_id}", params={"include": "nope"}).status_code == 400
+    
+    response = client.get(f"/projects/{project_id}/artifacts/mermaid_diagrams")
+    assert response.status_code == 200
+    assert response.json()["content"] == ["graph TD\nA-->B"]
+    assert client.get(f"/projects/{project_id}/artifacts/backend_diagrams").json()["content"] == []
+    assert client.get("/projects/missing/artifacts/site_maps").status_code == 404
+
+def test_project_reads_answer_304_when_unchanged():
+    """Test conditional GETs and response compression for project reads"""
+    db = TestingSessionLocal()
+    project = Project(name="Cached", description="ETag", site_maps=[{"pages": [{"name": f"Page {i}"} for i in range(100)]}])
+    db.add(project)
+    db.commit()
+    project_id = project.id
+    db.close()
+    
+    for url in (f"/projects/{project_id}", f"/projects/{project_id}/artifacts/site_maps", "/projects"):
+        first = client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert first.status_code == 200
+        assert first.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in first.headers["vary"]
+        etag = first.headers["etag"]
+        assert etag.startswith("W/")
+        
+        # The same validator covers the uncompressed representation
+        identity = client.get(url, headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in identity.headers
+        assert identity.headers["etag"] == etag
+        
+        again = client.get(url, headers={"If-None-Match": etag})
+        assert again.status_code == 304
+        assert again.headers["etag"] == etag
+        assert "Accept-Encoding" in again.headers["vary"]
+        assert again.content == b""
+    
+    # Pinning the artifact URL to its checksum makes it cacheable forever
+    checksum = client.get(f"/projects/{project_id}/artifacts/site_maps").headers["x-artifact-checksum"]
+    pinned = client.get(f"/projects/{project_id}/artifacts/site_maps", params={"v": checksum})
+    assert "immutable" in pinned.headers["cache-control"]
+    
+    # Changing an artifact changes the ETag
+    etag = client.get(f"/projects/{project_id}").headers["etag"]
+    db = TestingSessionLocal()
+    db.query(Project).filter_by(id=project_id).one().ratings = {"site_maps": [{"overall_score": 9}]}
+    db.commit()
+    db.close()
+    assert client.get(f"/projects/{project_id}", headers={"If-None-Match": etag}).status_code == 200
+
 def test_get_project_not_found():
     """Test getting non-existent project"""
     response = client.get("/projects/non-existent-id")
     assert response.status_code == 404
     assert response.json()["detail"] == "Project not found"
 
-@patch('backend.ai_agents.AIAgents.generate_site_maps')
-@patch('backend.ai_agents.AIAgents.generate_mermaid_diagrams')
-@patch('backend.ai_agents.AIAgents.generate_backend_diagrams')
-@patch('backend.ai_agents.AIAgents.rate_artifacts')
-def test_create_project(mock_rate, mock_backend, mock_mermaid, mock_site_maps):
+def wait_for_job(test_client, job_id, timeout=10):
+    """Poll the job status endpoint until the job finishes"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = test_client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+@patch('ai_agents.AIAgents.generate_site_maps', new_callable=AsyncMock)
+@patch('ai_agents.AIAgents.generate_mermaid_diagrams', new_callable=AsyncMock)
+@patch('ai_agents.AIAgents.generate_backend_diagrams', new_callable=AsyncMock)
+def test_create_project(mock_backend, mock_mermaid, mock_site_maps):
     """Test creating a new project"""
     # Mock AI responses
     mock_site_maps.return_value = [{"pages": [{"name": "Home", "path": "/"}]}]
     mock_mermaid.return_value = ["graph TD\nA-->B"]
     mock_backend.return_value = ["flowchart TD\nAPI-->DB"]
-    mock_rate.return_value = [{"index": 0, "overall_score": 8.5}]
-    
-    # Convert to async mocks
-    mock_site_maps.return_value = asyncio.coroutine(lambda: mock_site_maps.return_value)()
-    mock_mermaid.return_value = asyncio.coroutine(lambda: mock_mermaid.return_value)()
-    mock_backend.return_value = asyncio.coroutine(lambda: mock_backend.return_value)()
-    mock_rate.return_value = asyncio.coroutine(lambda: mock_rate.return_value)()
     
     project_data = {
         "name": "New Project",
         "description": "New project description"
     }
     
-    response = client.post("/projects", json=project_data)
+    with TestClient(app) as test_client:
+        response = test_client.post("/projects", json=project_data)
+        assert response.status_code == 202
+        accepted = response.json()
+        assert accepted["status"] == "queued"
+        assert response.headers["location"] == f"/jobs/{accepted['job_id']}"
+        
+        job = wait_for_job(test_client, accepted["job_id"])
+        assert job["status"] == "completed"
+        assert job["progress"] == 100
+        assert job["result"]["project_id"] == accepted["project_id"]
+        
+        response = test_client.get(f"/projects/{accepted['project_id']}")
+    
     assert response.status_code == 200
     data = response.json()
     assert data["name"] == "New Project"
@@ -122,6 +266,207 @@ def test_create_project(mock_rate, mock_backend, mock_mermaid, mock_site_maps):
     assert len(data["site_maps"]) > 0
     assert len(data["mermaid_diagrams"]) > 0
     assert len(data["backend_diagrams"]) > 0
+    # Each diagram is stored with its parsed graph
+    assert data["diagram_graphs"]["mermaid_diagrams"][0]["counts"] == {"nodes": 2, "edges": 1}
+    assert data["diagram_graphs"]["backend_diagrams"][0]["edges"] == [["API", "DB", "-->", ""]]
+
+@patch('ai_agents.AIAgents.generate_site_maps', new_callable=AsyncMock)
+def test_create_project_job_failure(mock_site_maps):
+    """Test that pipeline errors are reported on the job"""
+    mock_site_maps.side_effect = RuntimeError("provider down")
+    
+    with TestClient(app) as test_client:
+        response = test_client.post("/projects", json={"name": "Broken", "description": "Fails"})
+        assert response.status_code == 202
+        job = wait_for_job(test_client, response.json()["job_id"])
+    
+    assert job["status"] == "failed"
+    assert job["error"] == "provider down"
+
+@patch('ai_agents.AIAgents.generate_backend_diagrams', new_callable=AsyncMock)
+def test_regenerate_single_artifact(mock_backend):
+    """Test regenerating one backend diagram leaves the other artifacts alone"""
+    mock_backend.return_value = ["flowchart TD\nAPI-->Queue"]
+    db = TestingSessionLocal()
+    project = Project(
+        name="Regen",
+        description="Regenerate me",
+        site_maps=[{"pages": [{"name": "Home", "path": "/"}]}],
+        backend_diagrams=["flowchart TD\nA-->B", "flowchart TD\n    A[Component] --> B[Loading...]"]
+    )
+    db.add(project)
+    db.commit()
+    project_id = project.id
+    db.close()
+    
+    with TestClient(app) as test_client:
+        assert test_client.post(f"/projects/{project_id}/regenerate", json={"stage": "backend", "index": 2}).status_code == 400
+        assert test_client.post(f"/projects/{project_id}/regenerate", json={"stage": "styles"}).status_code == 422
+        assert test_client.post("/projects/missing/regenerate", json={"stage": "backend"}).status_code == 404
+        
+        response = test_client.post(f"/projects/{project_id}/regenerate", json={"stage": "backend", "index": 1})
+        assert response.status_code == 202
+        job = wait_for_job(test_client, response.json()["job_id"])
+        assert job["status"] == "completed"
+        assert job["kind"] == "regenerate_artifact"
+        assert job["result"]["indices"] == [1]
+        
+        data = test_client.get(f"/projects/{project_id}").json()
+    
+    _, kwargs = mock_backend.call_args
+    assert kwargs["indices"] == [1] and kwargs["count"] == 2 and kwargs["use_cache"] is False
+    assert data["backend_diagrams"] == ["flowchart TD\nA-->B", "flowchart TD\nAPI-->Queue"]
+    assert [graph["edges"] for graph in data["diagram_graphs"]["backend_diagrams"]] == [
+        [["A", "B", "-->", ""]], [["API", "Queue", "-->", ""]]
+    ]
+    assert data["site_maps"] == [{"pages": [{"name": "Home", "path": "/"}]}]
+
+@patch('ai_agents.AIAgents.rate_artifacts', new_callable=AsyncMock)
+@patch('ai_agents.AIAgents.generate_site_maps', new_callable=AsyncMock)
+def test_regenerate_rerates_the_artifacts(mock_site_maps, mock_rate):
+    """Test regenerating replaces the stale ratings, and drops them for a lone artifact"""
+    mock_site_maps.return_value = [{"pages": [{"name": "Shop", "path": "/shop"}]}]
+    mock_rate.return_value = [{"index": 0, "overall_score": 4}, {"index": 1, "overall_score": 9}]
+    db = TestingSessionLocal()
+    project = Project(
+        name="Regen",
+        description="Regenerate me",
+        site_maps=[{"pages": [{"name": "Home", "path": "/"}]}, {"pages": [{"name": "Old", "path": "/old"}]}],
+        backend_diagrams=["flowchart TD\nA-->B"],
+        ratings={"site_maps": [{"index": 0, "overall_score": 8}, {"index": 1, "overall_score": 2}],
+                 "backend_diagrams": [{"index": 0, "overall_score": 6}]}
+    )
+    db.add(project)
+    db.commit()
+    project_id = project.id
+    db.close()
+    
+    with TestClient(app) as test_client:
+        response = test_client.post(f"/projects/{project_id}/regenerate", json={"stage": "sitemap", "index": 1})
+        assert wait_for_job(test_client, response.json()["job_id"])["status"] == "completed"
+        with patch('ai_agents.AIAgents.generate_backend_diagrams', new_callable=AsyncMock) as mock_backend:
+            mock_backend.return_value = ["flowchart TD\nAPI-->Queue"]
+            response = test_client.post(f"/projects/{project_id}/regenerate", json={"stage": "backend"})
+            assert wait_for_job(test_client, response.json()["job_id"])["status"] == "completed"
+        data = test_client.get(f"/projects/{project_id}").json()
+    
+    rated = mock_rate.call_args.args[0]
+    assert rated == [{"pages": [{"name": "Home", "path": "/"}]}, {"pages": [{"name": "Shop", "path": "/shop"}]}]
+    assert [rating["overall_score"] for rating in data["ratings"]["site_maps"]] == [4, 9]
+    assert "backend_diagrams" not in data["ratings"]
+    mock_rate.assert_awaited_once()
+
+@patch('ai_agents.AIAgents.generate_backend_diagrams', new_callable=AsyncMock)
+def test_concurrent_regenerations_of_one_project(mock_backend):
+    """Test a second regeneration of a project is refused while the first is in flight"""
+    release = threading.Event()
+    
+    async def slow_backend(*args, **kwargs):
+        await asyncio.to_thread(release.wait, 5)
+        return ["flowchart TD\nAPI-->Queue"]
+    
+    mock_backend.side_effect = slow_backend
+    db = TestingSessionLocal()
+    project = Project(name="Regen", description="Regenerate me",
+                      backend_diagrams=["flowchart TD\nA-->B", "flowchart TD\nC-->D"])
+    db.add(project)
+    db.commit()
+    project_id = project.id
+    db.close()
+    
+    with TestClient(app) as test_client:
+        first = test_client.post(f"/projects/{project_id}/regenerate", json={"stage": "backend", "index": 0})
+        second = test_client.post(f"/projects/{project_id}/regenerate", json={"stage": "backend", "index": 1})
+        release.set()
+        job = wait_for_job(test_client, first.json()["job_id"])
+        third = test_client.post(f"/projects/{project_id}/regenerate", json={"stage": "backend", "index": 1})
+        assert wait_for_job(test_client, third.json()["job_id"])["status"] == "completed"
+        data = test_client.get(f"/projects/{project_id}").json()
+    
+    assert first.status_code == 202
+    assert second.status_code == 409
+    assert job["status"] == "completed"
+    assert data["backend_diagrams"] == ["flowchart TD\nAPI-->Queue", "flowchart TD\nAPI-->Queue"]
+
+@patch('ai_agents.AIAgents.generate_mermaid_diagrams', new_callable=AsyncMock)
+def test_regenerate_frontend_uses_best_rated_sitemap(mock_mermaid):
+    """Test a regenerated frontend diagram is drawn from the best rated sitemap, not the first"""
+    mock_mermaid.return_value = ["flowchart TD\nShop-->Cart"]
+    best = {"pages": [{"name": "Shop", "path": "/shop"}]}
+    db = TestingSessionLocal()
+    project = Project(
+        name="Regen",
+        description="Regenerate me",
+        site_maps=[{"pages": [{"name": "Home", "path": "/"}]}, best],
+        mermaid_diagrams=["flowchart TD\nA-->B"],
+        ratings={"site_maps": [{"index": 0, "overall_score": 5}, {"index": 1, "overall_score": 9}]}
+    )
+    db.add(project)
+    db.commit()
+    project_id = project.id
+    db.close()
+    
+    with TestClient(app) as test_client:
+        response = test_client.post(f"/projects/{project_id}/regenerate", json={"stage": "frontend"})
+        job = wait_for_job(test_client, response.json()["job_id"])
+    
+    assert job["status"] == "completed"
+    assert mock_mermaid.call_args.args[1] == best
+
+@patch('ai_agents.AIAgents.generate_site_maps', new_callable=AsyncMock)
+@patch('ai_agents.AIAgents.generate_mermaid_diagrams', new_callable=AsyncMock)
+@patch('ai_agents.AIAgents.generate_backend_diagrams', new_callable=AsyncMock)
+def test_create_projects_batch(mock_backend, mock_mermaid, mock_site_maps):
+    """Test bulk creation queues valid items, rejects bad ones and honours the concurrency bound"""
+    running = 0
+    peak = 0
+    
+    async def slow_site_maps(description, **kwargs):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        if description == "explode":
+            raise RuntimeError("provider down")
+        return [{"pages": [{"name": "Home", "path": "/"}]}]
+    
+    mock_site_maps.side_effect = slow_site_maps
+    mock_mermaid.return_value = ["graph TD\nA-->B"]
+    mock_backend.return_value = ["flowchart TD\nAPI-->DB"]
+    items = [
+        {"name": "One", "description": "first", "reuse_similar": False},
+        {"name": "Missing description"},
+        {"name": "Two", "description": "explode", "reuse_similar": False},
+        {"name": "Three", "description": "third", "reuse_similar": False},
+    ]
+    
+    with TestClient(app) as test_client:
+        assert test_client.post("/projects/batch", json={"items": []}).status_code == 422
+        response = test_client.post("/projects/batch", json={"items": items, "concurrency": 1})
+        assert response.status_code == 202
+        accepted = response.json()
+        assert response.headers["location"] == f"/batches/{accepted['batch_id']}"
+        assert accepted["accepted"] == 3 and accepted["rejected"] == 1
+        assert [item["status"] for item in accepted["items"]] == ["queued", "rejected", "queued", "queued"]
+        
+        for item in accepted["items"]:
+            if item["job_id"]:
+                wait_for_job(test_client, item["job_id"])
+        batch = test_client.get(f"/batches/{accepted['batch_id']}").json()
+        assert test_client.get("/batches/missing").status_code == 404
+    
+    assert peak == 1
+    assert batch["total"] == 4
+    assert batch["counts"] == {"completed": 2, "rejected": 1, "failed": 1}
+    assert batch["items"][2]["error"] == "provider down"
+    assert batch["items"][3]["result"]["project_id"] == accepted["items"][3]["project_id"]
+
+def test_get_job_not_found():
+    """Test getting non-existent job"""
+    response = client.get("/jobs/non-existent-id")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Job not found"
 
 def test_create_project_validation():
     """Test project creation validation"""
@@ -157,6 +502,115 @@ def test_delete_project_not_found():
     response = client.delete("/projects/non-existent-id")
     assert response.status_code == 404
     assert response.json()["detail"] == "Project not found"
+@patch('main.SITEMAP_REUSE_MODE', "draft")
+@patch('ai_agents.AIAgents.generate_site_maps', new_callable=AsyncMock)
+@patch('ai_agents.AIAgents.generate_mermaid_diagrams', new_callable=AsyncMock)
+@patch('ai_agents.AIAgents.generate_backend_diagrams', new_callable=AsyncMock)
+def test_create_project_reuses_similar_sitemap(mock_backend, mock_mermaid, mock_site_maps):
+    """Test that in draft mode a near-duplicate description reuses the stored sitemap"""
+    mock_mermaid.return_value = ["graph TD\nA-->B"]
+    mock_backend.return_value = ["flowchart TD\nAPI-->DB"]
+    
+    db = TestingSessionLocal()
+    db.add(Project(
+        name="Shoe Store",
+        description="An online store for shoes with cart, checkout and reviews",
+        site_maps=[{"pages": [{"name": "Catalog", "path": "/catalog"}]}]
+    ))
+    db.commit()
+    db.close()
+    
+    with TestClient(app) as test_client:
+        # Loaded at startup, before any job runs
+        assert similarity_index.loaded and len(similarity_index) == 1
+        response = test_client.post("/projects", json={
+            "name": "Shoes Again",
+            "description": "Online store for shoes with a cart, checkout, and customer reviews"
+        })
+        job = wait_for_job(test_client, response.json()["job_id"])
+        project = test_client.get(f"/projects/{job['project_id']}").json()
+    
+    assert job["status"] == "completed"
+    assert job["result"]["sitemap_source"]["mode"] == "reused"
+    assert job["result"]["sitemap_source"]["similarity"] >= 0.7
+    assert project["site_maps"] == [{"pages": [{"name": "Catalog", "path": "/catalog"}]}]
+    mock_site_maps.assert_not_called()
 
-# Fix for async tests
-import asyncio
\ No newline at end of file
+@patch('ai_agents.AIAgents.generate_site_maps', new_callable=AsyncMock)
+@patch('ai_agents.AIAgents.generate_mermaid_diagrams', new_callable=AsyncMock)
+@patch('ai_agents.AIAgents.generate_backend_diagrams', new_callable=AsyncMock)
+def test_create_project_seeds_from_similar_sitemap_by_default(mock_backend, mock_mermaid, mock_site_maps):
+    """Test that by default a near-duplicate's sitemap only seeds a newly generated one"""
+    mock_site_maps.return_value = [{"pages": [{"name": "Shoes", "path": "/shoes"}]}]
+    mock_mermaid.return_value = ["graph TD\nA-->B"]
+    mock_backend.return_value = ["flowchart TD\nAPI-->DB"]
+    
+    db = TestingSessionLocal()
+    db.add(Project(
+        name="Shoe Store",
+        description="An online store for shoes",
+        site_maps=[{"pages": [{"name": "Catalog", "path": "/catalog"}]}]
+    ))
+    db.commit()
+    db.close()
+    
+    with TestClient(app) as test_client:
+        response = test_client.post("/projects", json={
+            "name": "Shoes Again",
+            "description": "E-commerce site selling shoes"
+        })
+        job = wait_for_job(test_client, response.json()["job_id"])
+        project = test_client.get(f"/projects/{job['project_id']}").json()
+    
+    assert job["status"] == "completed"
+    assert job["result"]["sitemap_source"]["mode"] == "seeded"
+    assert project["site_maps"] == [{"pages": [{"name": "Shoes", "path": "/shoes"}]}]
+    assert mock_site_maps.call_args.kwargs["seed_site_map"] == {"pages": [{"name": "Catalog", "path": "/catalog"}]}
+
+@patch('main.CANDIDATE_COUNT', 2)
+@patch('ai_agents.AIAgents.rank_candidates', new_callable=AsyncMock)
+@patch('ai_agents.AIAgents.mermaid_diagram_candidates')
+def test_create_project_ranks_candidates(mock_frontend_candidates, mock_rank):
+    """Test that with several candidates the ratings are stored and the best sitemap feeds the frontend stage"""
+    site_maps = [{"pages": [{"name": "Weak", "path": "/"}]}, {"pages": [{"name": "Strong", "path": "/"}]}]
+    
+    async def rank(candidates, artifact_type, description, **kwargs):
+        for candidate in candidates:
+            if asyncio.iscoroutine(candidate):
+                candidate.close()
+        if artifact_type == "site maps":
+            return site_maps, [{"index": 0, "overall_score": 5}, {"index": 1, "overall_score": 9}]
+        return ["flowchart TD\nA-->B", "flowchart TD\nC-->D"], [{"index": 1, "overall_score": 7}]
+    
+    mock_rank.side_effect = rank
+    mock_frontend_candidates.return_value = []
+    
+    with TestClient(app) as test_client:
+        response = test_client.post("/projects", json={"name": "Ranked", "description": "Rank me", "reuse_similar": False})
+        job = wait_for_job(test_client, response.json()["job_id"])
+        project = test_client.get(f"/projects/{job['project_id']}").json()
+    
+    assert job["status"] == "completed"
+    assert mock_rank.await_count == 3
+    assert mock_frontend_candidates.call_args[0][1] == site_maps[1]
+    assert project["site_maps"] == site_maps
+    assert project["ratings"]["site_maps"][1]["overall_score"] == 9
+    assert project["ratings"]["backend_diagrams"] == [{"index": 1, "overall_score": 7}]
+
+def test_websocket_progress_routed_by_project():
+    """Test that progress only reaches sockets subscribed to that project"""
+    with TestClient(app) as test_client:
+        with test_client.websocket_connect("/ws/project-a") as ws_a, \
+             test_client.websocket_connect("/ws") as ws_any:
+            ws_any.send_text(json.dumps({"action": "subscribe", "project_id": "project-b"}))
+            # Round-trip through the app so the subscription is registered
+            test_client.portal.call(asyncio.sleep, 0.05)
+            
+            test_client.portal.call(manager.send_progress, "project-b", "sitemap", "B progress", 40)
+            test_client.portal.call(manager.send_progress, "project-a", "sitemap", "A progress", 30)
+            
+            assert json.loads(ws_a.receive_text())["message"] == "A progress"
+            assert json.loads(ws_any.receive_text())["message"] == "B progress"
+    
+    assert manager.topics == {}
+    assert manager.subscriptions == {}
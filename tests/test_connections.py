@@ -0,0 +1,146 @@
+import pytest
+import asyncio
+import json
+from unittest.mock import AsyncMock
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.connections import ClientChannel, ConnectionManager
+
+class SlowSocket:
+    """Fake WebSocket whose sends block until released"""
+    def __init__(self):
+        self.sent = []
+        self.release = asyncio.Event()
+        self.closed_with = None
+    
+    async def accept(self):
+        pass
+    
+    async def send_text(self, text):
+        await self.release.wait()
+        self.sent.append(json.loads(text))
+    
+    async def close(self, code=1000):
+        self.closed_with = code
+
+async def settle():
+    await asyncio.sleep(0.02)
+
+@pytest.mark.asyncio
+async def test_send_progress_drops_dead_sockets():
+    """Test that failing sockets are unsubscribed and the payload is shared"""
+    manager = ConnectionManager()
+    healthy, dead = AsyncMock(), AsyncMock()
+    dead.send_text.side_effect = RuntimeError("closed")
+    await manager.connect(healthy, "project-a")
+    await manager.connect(dead, "project-a")
+    
+    await manager.send_progress("project-a", "sitemap", "Working", 10)
+    await manager.send_progress("project-z", "sitemap", "Nobody listening", 10)
+    await settle()
+    
+    assert healthy.send_text.await_count == 1
+    assert healthy.send_text.await_args.args[0] is dead.send_text.await_args.args[0]
+    assert manager.topics == {"project-a": {healthy}}
+    assert dead not in manager.subscriptions
+    assert dead not in manager.channels
+    manager.disconnect(healthy)
+
+@pytest.mark.asyncio
+async def test_slow_consumer_does_not_block_sender():
+    """Test that a hung socket never stalls send_progress"""
+    manager = ConnectionManager()
+    slow = SlowSocket()
+    await manager.connect(slow, "project-a")
+    
+    await asyncio.wait_for(
+        asyncio.gather(*[manager.send_progress("project-a", "sitemap", f"Step {i}", i) for i in range(50)]),
+        timeout=0.5
+    )
+    manager.disconnect(slow)
+
+@pytest.mark.asyncio
+async def test_intermediate_progress_coalesced_terminal_kept():
+    """Test that superseded progress is dropped while terminal events survive"""
+    manager = ConnectionManager()
+    slow = SlowSocket()
+    await manager.connect(slow, "project-a")
+    
+    await manager.send_progress("project-a", "sitemap", "First", 10)
+    await settle()  # writer picks up "First" and blocks on the socket
+    for i in range(2, 10):
+        await manager.send_progress("project-a", "sitemap", f"Step {i}", i * 10)
+    await manager.send_progress("project-a", "finalize", "Done", 100)
+    
+    slow.release.set()
+    await settle()
+    
+    messages = [m["message"] for m in slow.sent]
+    assert messages == ["First", "Step 9", "Done"]
+    manager.disconnect(slow)
+
+@pytest.mark.asyncio
+async def test_full_queue_makes_room_for_terminal_and_evicts_stalled():
+    """Test bounded queue behaviour for terminal events and stalled consumers"""
+    socket = SlowSocket()
+    channel = ClientChannel(socket, max_pending=2, stall_seconds=0)
+    
+    assert channel.offer(("progress", "a"), "a1", terminal=False)
+    assert channel.offer(("progress", "b"), "b1", terminal=False)
+    # Terminal event displaces an intermediate one
+    assert channel.offer(("progress", "c"), "done", terminal=True)
+    assert list(channel.pending.values()) == ["b1", "done"]
+    # Queue full of work and no patience left: consumer reported as stalled
+    assert not channel.offer(("progress", "d"), "d1", terminal=False)
+    assert channel.dropped == 2
+
+@pytest.mark.asyncio
+async def test_stalled_consumer_is_evicted():
+    """Test that send_progress evicts a consumer whose queue stays full"""
+    manager = ConnectionManager()
+    slow = SlowSocket()
+    await manager.connect(slow, "project-a")
+    channel = manager.channels[slow]
+    channel.max_pending = 1
+    channel.stall_seconds = 0
+    
+    await manager.send_progress("project-a", "sitemap", "First", 10)
+    await settle()
+    await manager.send_progress("project-b", "sitemap", "Other", 10)
+    manager.subscribe(slow, "project-b")
+    await manager.send_progress("project-b", "sitemap", "Queued", 10)
+    await manager.send_progress("project-a", "sitemap", "Overflow", 20)
+    await settle()
+    
+    assert slow not in manager.channels
+    assert manager.topics == {}
+    assert slow.closed_with == 1013
+
+@pytest.mark.asyncio
+async def test_partial_artifacts_coalesced_per_artifact():
+    """Test partial artifacts supersede each other while final ones are kept"""
+    manager = ConnectionManager()
+    slow = SlowSocket()
+    await manager.connect(slow, "project-a")
+    
+    await manager.send_progress("project-a", "sitemap", "First", 10)
+    await settle()
+    for size in range(1, 4):
+        await manager.send_artifact("project-a", "site_maps", 0, {"pages": [{}] * size}, complete=False)
+    await manager.send_artifact("project-a", "mermaid_diagrams", 0, "flowchart TB", complete=False)
+    await manager.send_artifact("project-a", "site_maps", 0, {"pages": [{}] * 4}, complete=True)
+    
+    slow.release.set()
+    await settle()
+    
+    artifacts = [(m["artifact"], m["complete"], m["content"]) for m in slow.sent if m["type"] == "artifact"]
+    assert artifacts == [
+        ("site_maps", False, {"pages": [{}] * 3}),
+        ("mermaid_diagrams", False, "flowchart TB"),
+        ("site_maps", True, {"pages": [{}] * 4}),
+    ]
+    assert slow.sent[0]["type"] == "progress"
+    manager.disconnect(slow)
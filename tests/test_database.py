@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import inspect, text
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.database import async_url, init_db, make_engines
+
+def test_async_url():
+    """Test sync SQLite URLs map onto the aiosqlite driver"""
+    assert async_url("sqlite:///./site_planner.db") == "sqlite+aiosqlite:///./site_planner.db"
+    assert async_url("postgresql+asyncpg://db/app") == "postgresql+asyncpg://db/app"
+
+def test_sqlite_pragmas_applied(tmp_path):
+    """Test every connection runs in WAL mode with relaxed fsync"""
+    engine, async_engine = make_engines(f"sqlite:///{tmp_path / 'pragmas.db'}")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA foreign_keys")).scalar() == 1
+    engine.dispose()
+
+@pytest.mark.asyncio
+async def test_async_engine_reads_alongside_sync_writes(tmp_path):
+    """Test the aiosqlite engine sees rows committed through the sync engine"""
+    engine, async_engine = make_engines(f"sqlite:///{tmp_path / 'async.db'}")
+    init_db(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO projects (id, name, description) VALUES ('p1', 'One', 'First')"))
+    
+    async with async_engine.connect() as conn:
+        assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+        assert (await conn.execute(text("SELECT name FROM projects"))).scalar() == "One"
+    await async_engine.dispose()
+    engine.dispose()
+
+def test_init_db_adds_missing_indexes(tmp_path):
+    """Test init_db upgrades a projects table created before the pagination index"""
+    engine, _ = make_engines(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE projects (id VARCHAR PRIMARY KEY, name VARCHAR NOT NULL, description TEXT NOT NULL, "
+                          "created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME)"))
+    
+    init_db(engine)
+    
+    inspector = inspect(engine)
+    assert "ix_projects_created_at_id" in {index["name"] for index in inspector.get_indexes("projects")}
+    assert "token_usage" in {column["name"] for column in inspector.get_columns("projects")}
+    assert "project_artifacts" in inspector.get_table_names()
+    engine.dispose()
@@ -0,0 +1,23 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.http_cache import etag_matches, make_etag
+
+def test_make_etag_is_stable_quoted_and_weak():
+    """Test the same validators always produce the same weak ETag"""
+    etag = make_etag("p1", ["site_maps"], [("site_maps", "abc")])
+    assert etag == make_etag("p1", ["site_maps"], [("site_maps", "abc")])
+    assert etag != make_etag("p1", ["site_maps"], [("site_maps", "abd")])
+    assert etag.startswith('W/"') and etag.endswith('"')
+
+def test_etag_matches_header_forms():
+    """Test If-None-Match lists, weak validators and the wildcard"""
+    etag = make_etag("p1")
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches(etag.removeprefix("W/"), etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
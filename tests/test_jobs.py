@@ -0,0 +1,263 @@
+import pytest
+import asyncio
+import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from models import Base, GenerationJob
+from jobs import JobQueue
+
+# Test database setup
+SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///./test_jobs.db"
+engine = create_engine(SQLALCHEMY_TEST_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture(autouse=True)
+def setup_and_teardown():
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+async def wait_until_done(queue, job_id, timeout=5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        job = await queue.get(job_id)
+        if job.status in ("completed", "failed"):
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+@pytest.mark.asyncio
+async def test_enqueue_and_complete():
+    """Test that a queued job runs and stores its result"""
+    queue = JobQueue(TestingSessionLocal, concurrency=2)
+    
+    async def handler(job_id, project_id, payload, db):
+        queue.record_progress(project_id, "sitemap", "Working...", 40)
+        return {"project_id": project_id, "name": payload["name"]}
+    
+    queue.register("create_project", handler)
+    await queue.start()
+    try:
+        job = await queue.enqueue("create_project", "project-1", {"name": "Demo"})
+        done = await wait_until_done(queue, job.id)
+    finally:
+        await queue.stop()
+    
+    assert done.status == "completed"
+    assert done.progress == 100
+    assert done.result == {"project_id": "project-1", "name": "Demo"}
+    assert done.attempts == 1
+
+@pytest.mark.asyncio
+async def test_worker_pool_is_bounded():
+    """Test that no more than `concurrency` jobs run at once"""
+    queue = JobQueue(TestingSessionLocal, concurrency=2)
+    in_flight = 0
+    max_in_flight = 0
+    
+    async def handler(job_id, project_id, payload, db):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return {}
+    
+    queue.register("create_project", handler)
+    await queue.start()
+    try:
+        jobs = [await queue.enqueue("create_project", f"project-{i}", {}) for i in range(5)]
+        for job in jobs:
+            await wait_until_done(queue, job.id)
+    finally:
+        await queue.stop()
+    
+    assert max_in_flight == 2
+
+@pytest.mark.asyncio
+async def test_unfinished_jobs_recovered_on_start():
+    """Test that queued and interrupted jobs are picked up after a restart"""
+    db = TestingSessionLocal()
+    queued = GenerationJob(kind="create_project", project_id="p-queued", status="queued", payload={})
+    interrupted = GenerationJob(kind="create_project", project_id="p-running", status="running", attempts=1, payload={})
+    db.add_all([queued, interrupted])
+    db.commit()
+    queued_id, interrupted_id = queued.id, interrupted.id
+    db.close()
+    
+    seen = []
+    
+    async def handler(job_id, project_id, payload, db):
+        seen.append(project_id)
+        return {}
+    
+    queue = JobQueue(TestingSessionLocal, concurrency=1)
+    queue.register("create_project", handler)
+    await queue.start()
+    try:
+        first = await wait_until_done(queue, queued_id)
+        second = await wait_until_done(queue, interrupted_id)
+    finally:
+        await queue.stop()
+    
+    assert first.status == "completed"
+    assert second.status == "completed"
+    assert second.attempts == 2
+    assert sorted(seen) == ["p-queued", "p-running"]
+
+@pytest.mark.asyncio
+async def test_jobs_of_one_project_run_one_at_a_time():
+    """Test a project's second job waits for its first, while other projects' jobs still run"""
+    queue = JobQueue(TestingSessionLocal, concurrency=3)
+    running = {}
+    overlapped = []
+    
+    async def handler(job_id, project_id, payload, db):
+        if running.get(project_id):
+            overlapped.append(project_id)
+        running[project_id] = job_id
+        queue.record_progress(project_id, "backend", "Working...", 50)
+        await asyncio.sleep(0.05)
+        running[project_id] = None
+        return {"job_id": job_id}
+    
+    queue.register("regenerate_artifact", handler)
+    await queue.start()
+    try:
+        jobs = [await queue.enqueue("regenerate_artifact", project_id, {}) for project_id in ("p1", "p1", "p2")]
+        done = [await wait_until_done(queue, job.id) for job in jobs]
+    finally:
+        await queue.stop()
+    
+    assert overlapped == []
+    assert all(job.status == "completed" and job.result == {"job_id": job.id} for job in done)
+    assert queue.running_by_project == {} and queue.waiting_by_project == {}
+    # The other project did not wait behind p1
+    assert done[2].finished_at < done[1].finished_at
+
+@pytest.mark.asyncio
+async def test_handler_error_marks_job_failed():
+    """Test that handler exceptions fail the job with the error message"""
+    queue = JobQueue(TestingSessionLocal, concurrency=1)
+    
+    async def handler(job_id, project_id, payload, db):
+        raise ValueError("bad input")
+    
+    queue.register("create_project", handler)
+    await queue.start()
+    try:
+        job = await queue.enqueue("create_project", "project-x", {})
+        done = await wait_until_done(queue, job.id)
+    finally:
+        await queue.stop()
+    
+    assert done.status == "failed"
+    assert done.error == "bad input"
+
+@pytest.mark.asyncio
+async def test_job_claimed_by_one_worker_only():
+    """Test two queues sharing the database never run the same job twice"""
+    db = TestingSessionLocal()
+    job = GenerationJob(kind="create_project", project_id="p-shared", status="queued", payload={})
+    db.add(job)
+    db.commit()
+    job_id = job.id
+    db.close()
+    
+    runs = []
+    
+    async def handler(job_id, project_id, payload, db):
+        runs.append(project_id)
+        await asyncio.sleep(0.05)
+        return {}
+    
+    queues = [JobQueue(TestingSessionLocal, concurrency=1) for _ in range(2)]
+    for queue in queues:
+        queue.register("create_project", handler)
+    # Both workers recover the same queued row on startup
+    await asyncio.gather(*[queue.start() for queue in queues])
+    try:
+        done = await wait_until_done(queues[0], job_id)
+        await asyncio.sleep(0.05)
+    finally:
+        await asyncio.gather(*[queue.stop() for queue in queues])
+    
+    assert done.status == "completed"
+    assert done.attempts == 1
+    assert runs == ["p-shared"]
+
+@pytest.mark.asyncio
+async def test_live_lease_is_not_taken_over():
+    """Test a starting worker leaves another worker's leased job alone until the lease expires"""
+    db = TestingSessionLocal()
+    lease = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=0.3)
+    job = GenerationJob(kind="create_project", project_id="p-leased", status="running", attempts=1, payload={},
+                        owner="other-worker", lease_expires_at=lease)
+    db.add(job)
+    db.commit()
+    job_id = job.id
+    db.close()
+    
+    runs = []
+    
+    async def handler(job_id, project_id, payload, db):
+        runs.append(project_id)
+        return {}
+    
+    queue = JobQueue(TestingSessionLocal, concurrency=1, heartbeat_seconds=0.05)
+    queue.register("create_project", handler)
+    await queue.start()
+    try:
+        await asyncio.sleep(0.15)
+        assert runs == []
+        assert (await queue.get(job_id)).owner == "other-worker"
+        # The other worker stopped renewing; the next heartbeat after expiry requeues it
+        done = await wait_until_done(queue, job_id)
+    finally:
+        await queue.stop()
+    
+    assert done.status == "completed"
+    assert done.attempts == 2
+    assert done.owner == queue.worker_id
+    assert runs == ["p-leased"]
+
+@pytest.mark.asyncio
+async def test_running_job_lease_is_renewed_and_released_on_stop():
+    """Test a worker keeps renewing its job's lease, and stopping ends the lease for the next worker"""
+    started = asyncio.Event()
+    
+    async def blocked(job_id, project_id, payload, db):
+        started.set()
+        await asyncio.sleep(10)
+    
+    first = JobQueue(TestingSessionLocal, concurrency=1, lease_seconds=0.2, heartbeat_seconds=0.05)
+    first.register("create_project", blocked)
+    await first.start()
+    job = await first.enqueue("create_project", "p-renewed", {})
+    await started.wait()
+    # Well past the initial lease, but the heartbeat keeps it alive
+    await asyncio.sleep(0.4)
+    running = await first.get(job.id)
+    assert running.status == "running"
+    assert running.owner == first.worker_id
+    await first.stop()
+    
+    async def handler(job_id, project_id, payload, db):
+        return {}
+    
+    second = JobQueue(TestingSessionLocal, concurrency=1)
+    second.register("create_project", handler)
+    await second.start()
+    try:
+        done = await wait_until_done(second, job.id)
+    finally:
+        await second.stop()
+    
+    assert done.status == "completed"
+    assert done.attempts == 2
@@ -0,0 +1,77 @@
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.json_stream import IncrementalJSONParser, parse_json_document, validate_sitemap_page
+
+SITEMAP = {
+    "pages": [
+        {"name": "Home", "path": "/", "features": ["Hero {banner}", "Quote \"here\""], "children": []},
+        {"name": "About", "path": "/about", "features": [], "children": [{"name": "Team"}]},
+    ],
+    "notes": "[not an item]"
+}
+
+def test_items_complete_as_they_stream():
+    """Test each page is returned as soon as its closing brace arrives"""
+    text = "```json\n" + json.dumps(SITEMAP) + "\n```"
+    parser = IncrementalJSONParser("pages")
+    seen = []
+    for char in text:
+        seen.extend(parser.feed(char))
+        if len(seen) == 1:
+            # The second page has not streamed in yet
+            assert not parser.complete
+    
+    assert seen == SITEMAP["pages"]
+    assert parser.complete
+    assert json.loads(parser.document()) == SITEMAP
+
+def test_incomplete_document():
+    """Test a truncated response yields finished items but no document"""
+    text = json.dumps(SITEMAP)
+    parser = IncrementalJSONParser("pages")
+    parser.feed(text[:text.index('"About"')])
+    
+    assert parser.items == [SITEMAP["pages"][0]]
+    assert not parser.complete
+    assert parser.document() is None
+
+def test_other_keys_are_ignored():
+    """Test arrays under other keys are not reported as items"""
+    parser = IncrementalJSONParser("pages")
+    assert parser.feed('{"meta": [{"a": 1}], "pages": [{"b": 2}]}') == [{"b": 2}]
+
+def test_parse_document_wrapped_in_prose():
+    """Test the object is found after prose containing non-JSON braces"""
+    text = "Here is the {requested} sitemap:\n```json\n" + json.dumps(SITEMAP) + "\n```\nEnjoy!"
+    result = parse_json_document(text, "pages", validate_sitemap_page)
+    
+    assert result.complete
+    assert result.data == SITEMAP
+    assert result.rejected == []
+
+def test_parse_document_salvages_truncated_pages():
+    """Test complete pages are recovered from a response cut off mid-page"""
+    text = json.dumps(SITEMAP)
+    result = parse_json_document(text[:text.index('"Team"')], "pages", validate_sitemap_page)
+    
+    assert not result.complete
+    assert result.data == {"pages": [SITEMAP["pages"][0]]}
+    assert [page["name"] for page in result.salvaged] == ["Home"]
+
+def test_parse_document_drops_invalid_pages():
+    """Test pages that do not match the sitemap schema are rejected with a reason"""
+    text = json.dumps({"pages": [{"name": "Home", "path": "/"}, {"name": "No path"}, {"path": "/x", "name": "X", "features": "oops"}]})
+    result = parse_json_document(text, "pages", validate_sitemap_page)
+    
+    assert result.complete
+    assert result.data["pages"] == [{"name": "Home", "path": "/"}]
+    assert [index for index, _ in result.rejected] == [1, 2]
+    assert "path" in result.rejected[0][1]
+
+def test_parse_document_without_json():
+    """Test plain prose yields an empty result"""
+    assert parse_json_document("I could not do that.").data is None
@@ -0,0 +1,78 @@
+import pytest
+import time
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.llm_cache import LLMCache
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "llm_cache.db")
+
+def test_key_depends_on_every_parameter():
+    """Test that the cache key changes with each request parameter"""
+    base = LLMCache.make_key("openai", "gpt-4.1", "sys", "prompt", 100)
+    assert base == LLMCache.make_key("openai", "gpt-4.1", "sys", "prompt", 100)
+    assert base != LLMCache.make_key("anthropic", "gpt-4.1", "sys", "prompt", 100)
+    assert base != LLMCache.make_key("openai", "gpt-4o", "sys", "prompt", 100)
+    assert base != LLMCache.make_key("openai", "gpt-4.1", "other", "prompt", 100)
+    assert base != LLMCache.make_key("openai", "gpt-4.1", "sys", "prompt!", 100)
+    assert base != LLMCache.make_key("openai", "gpt-4.1", "sys", "prompt", 200)
+    assert base != LLMCache.make_key("openai", "gpt-4.1", "sys", "prompt", 100, variant=1)
+
+def test_memory_and_disk_tiers(cache_path):
+    """Test that entries survive a restart through the disk tier"""
+    cache = LLMCache(path=cache_path)
+    cache.set("k", "value")
+    assert cache.get("k") == "value"
+    assert cache.get("missing") is None
+    stats = cache.get_stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+    cache.close()
+    
+    reopened = LLMCache(path=cache_path)
+    assert reopened.get("k") == "value"
+    assert reopened.get_stats()["disk_hits"] == 1
+    # Promoted into memory on the first disk hit
+    assert reopened.get("k") == "value"
+    assert reopened.get_stats()["memory_hits"] == 1
+    reopened.close()
+
+def test_ttl_expiry(cache_path):
+    """Test that expired entries are treated as misses"""
+    cache = LLMCache(path=cache_path, ttl=0.05)
+    cache.set("k", "value")
+    time.sleep(0.1)
+    assert cache.get("k") is None
+    assert cache.get_stats()["disk_entries"] == 0
+    cache.close()
+
+def test_lru_and_size_eviction(cache_path):
+    """Test LRU eviction in memory and byte-budget eviction on disk"""
+    cache = LLMCache(path=cache_path, max_memory_entries=2, max_disk_bytes=25)
+    cache.set("a", "x" * 10)
+    cache.set("b", "y" * 10)
+    cache.get("a")  # a is now most recently used
+    cache.set("c", "z" * 10)
+    
+    stats = cache.get_stats()
+    assert stats["memory_entries"] == 2
+    assert stats["disk_bytes"] <= 25
+    assert "b" not in cache._memory
+    assert cache.get("a") == "x" * 10
+    assert cache.get("c") == "z" * 10
+    cache.close()
+
+def test_delete(cache_path):
+    """Test that deleting an entry removes it from both tiers"""
+    cache = LLMCache(path=cache_path)
+    cache.set("k", "value")
+    cache.delete("k")
+    cache.delete("missing")
+    assert cache.get("k") is None
+    stats = cache.get_stats()
+    assert stats["memory_entries"] == 0
+    assert stats["disk_entries"] == 0
+    cache.close()
@@ -0,0 +1,127 @@
+import pytest
+import asyncio
+from unittest.mock import Mock, AsyncMock
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.llm_providers import AnthropicProvider, Completion
+
+def anthropic_message(text, stop_reason="end_turn"):
+    message = Mock()
+    message.content = [Mock(text=text)]
+    message.stop_reason = stop_reason
+    return message
+
+@pytest.mark.asyncio
+async def test_anthropic_provider_complete():
+    """Test Anthropic provider awaits the async SDK client"""
+    provider = AnthropicProvider(api_key="test-key", model="claude-test")
+    provider.client.messages.create = AsyncMock(return_value=anthropic_message("graph TD\nA-->B", "max_tokens"))
+    
+    completion = await provider.complete("Draw a diagram", instructions="Be brief", max_tokens=50, timeout=5)
+    
+    assert isinstance(completion, Completion)
+    assert completion.text == "graph TD\nA-->B"
+    assert completion.provider == "anthropic"
+    assert completion.truncated
+    kwargs = provider.client.messages.create.call_args.kwargs
+    assert kwargs["max_tokens"] == 50
+    assert kwargs["system"] == "Be brief"
+    assert kwargs["timeout"] == 5
+    await provider.aclose()
+
+@pytest.mark.asyncio
+async def test_provider_calls_do_not_block_event_loop():
+    """Test that concurrent provider calls overlap instead of serializing"""
+    async def slow_create(**kwargs):
+        await asyncio.sleep(0.1)
+        return anthropic_message("ok")
+    
+    provider = AnthropicProvider(api_key="test-key")
+    provider.client.messages.create = AsyncMock(side_effect=slow_create)
+    
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    results = await asyncio.gather(*[provider.complete("hi") for _ in range(5)])
+    elapsed = loop.time() - start
+    
+    assert [r.text for r in results] == ["ok"] * 5
+    assert elapsed < 0.4
+    await provider.aclose()
+
+class FakeMessageStream:
+    """Stand-in for the SDK's message stream context manager"""
+    def __init__(self, deltas, stop_reason="end_turn"):
+        self.deltas = deltas
+        self.final = anthropic_message("".join(deltas), stop_reason)
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc):
+        return False
+    
+    @property
+    async def text_stream(self):
+        for delta in self.deltas:
+            yield delta
+    
+    async def get_final_message(self):
+        return self.final
+
+@pytest.mark.asyncio
+async def test_anthropic_provider_stream_stops_when_artifact_complete():
+    """Test streamed deltas reach the handler and a True return ends the stream"""
+    provider = AnthropicProvider(api_key="test-key", model="claude-test")
+    provider.client.messages.stream = Mock(return_value=FakeMessageStream(["<MERMAID_START>", "A-->B", "<MERMAID_END>", "extra"]))
+    seen = []
+    
+    async def on_delta(delta):
+        seen.append(delta)
+        return delta == "<MERMAID_END>"
+    
+    completion = await provider.stream("Draw a diagram", on_delta)
+    
+    assert seen == ["<MERMAID_START>", "A-->B", "<MERMAID_END>"]
+    assert completion.text == "<MERMAID_START>A-->B<MERMAID_END>"
+    assert completion.stop_reason == "artifact_complete"
+    assert not completion.truncated
+    await provider.aclose()
+
+@pytest.mark.asyncio
+async def test_anthropic_structured_output_uses_forced_tool():
+    """Test a schema is sent as a forced tool call and its input comes back as JSON text"""
+    schema = {"type": "object", "properties": {"pages": {"type": "array"}}, "required": ["pages"], "additionalProperties": False}
+    message = Mock()
+    message.content = [Mock(type="tool_use", input={"pages": [{"name": "Home"}]})]
+    message.stop_reason = "tool_use"
+    provider = AnthropicProvider(api_key="test-key", model="claude-test")
+    provider.client.messages.create = AsyncMock(return_value=message)
+    
+    completion = await provider.complete("Plan a site", schema=schema)
+    
+    assert completion.text == '{"pages": [{"name": "Home"}]}'
+    kwargs = provider.client.messages.create.call_args.kwargs
+    assert kwargs["tools"][0]["input_schema"] == schema
+    assert kwargs["tool_choice"] == {"type": "tool", "name": kwargs["tools"][0]["name"]}
+    
+    class ToolStream(FakeMessageStream):
+        def __aiter__(self):
+            return self.events()
+        
+        async def events(self):
+            yield Mock(type="text", text="ignored")
+            for delta in self.deltas:
+                yield Mock(type="input_json", partial_json=delta)
+    
+    provider.client.messages.stream = Mock(return_value=ToolStream(['{"pages": ', '[]}']))
+    seen = []
+    async def on_delta(delta):
+        seen.append(delta)
+    
+    completion = await provider.stream("Plan a site", on_delta, schema=schema)
+    assert seen == ['{"pages": ', '[]}']
+    assert completion.text == '{"pages": []}'
+    await provider.aclose()
@@ -0,0 +1,84 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.mermaid_parser import MermaidSyntaxError, flowchart_graph, normalize_flowchart, parse_flowchart
+
+DIAGRAM = """flowchart LR
+    %% Generated layout
+    subgraph api [API Layer]
+        direction TB
+        GW{{Gateway}}:::blackBox -->|routes| DB[("Users (primary)")]:::blackBox
+    end
+    C((Client)) -- HTTPS --> GW & Q[/Queue/]
+    Q -.-> W>Worker] ==> api; W --- C
+    classDef blackBox fill:#000,stroke:#fff,stroke-width:2px,color:#fff
+    classDef pink fill:#f9f
+    style C fill:#f00"""
+
+def test_parse_flowchart_builds_ast():
+    """Test nodes, shapes, subgraphs and every link form end up in the AST"""
+    chart = parse_flowchart(DIAGRAM)
+    graph = chart.to_dict()
+    
+    assert graph["direction"] == "LR"
+    assert graph["nodes"] == [
+        ["GW", "Gateway", "hexagon", "api"],
+        ["DB", "Users (primary)", "cylinder", "api"],
+        ["C", "Client", "circle", None],
+        ["Q", "Queue", "parallelogram", None],
+        ["W", "Worker", "asymmetric", None],
+    ]
+    assert graph["edges"] == [
+        ["GW", "DB", "-->", "routes"],
+        ["C", "GW", "-->", "HTTPS"],
+        ["C", "Q", "-->", "HTTPS"],
+        ["Q", "W", "-.->", ""],
+        ["W", "api", "==>", ""],
+        ["W", "C", "---", ""],
+    ]
+    assert graph["subgraphs"] == [["api", "API Layer", None, "TB"]]
+    assert graph["counts"] == {"nodes": 5, "edges": 6}
+
+def test_normalize_applies_house_style_and_round_trips():
+    """Test normalized text drops other styling, styles every node as a black box and parses to the same AST"""
+    normalized, chart = normalize_flowchart(DIAGRAM)
+    
+    assert normalized == """flowchart LR
+    classDef blackBox fill:#000,stroke:#fff,stroke-width:2px,color:#fff
+    subgraph api [API Layer]
+        direction TB
+        GW{{Gateway}}:::blackBox
+        DB[("Users (primary)")]:::blackBox
+    end
+    C((Client)):::blackBox
+    Q[/Queue/]:::blackBox
+    W>Worker]:::blackBox
+    GW -->|routes| DB
+    C -->|HTTPS| GW
+    C -->|HTTPS| Q
+    Q -.-> W
+    W ==> api
+    W --- C"""
+    assert normalize_flowchart(normalized) == (normalized, chart)
+    assert parse_flowchart(normalized) is chart
+
+@pytest.mark.parametrize("diagram, message", [
+    ("", "empty diagram"),
+    ("sequenceDiagram\nA->>B: hi", "expected 'flowchart' or 'graph'"),
+    ("flowchart XY\nA-->B", "invalid flowchart direction"),
+    ("flowchart TB\nA[Label --> B", "line 2: unclosed shape for node 'A'"),
+    ("flowchart TB\nA -->", "link without a target node"),
+    ("flowchart TB\nA B", "expected a link"),
+    ("flowchart TB\nsubgraph S\nA-->B", "subgraph 'S' is never closed"),
+    ("flowchart TB\nend", "'end' without an open subgraph"),
+    ("flowchart TB", "diagram has no nodes"),
+])
+def test_invalid_diagrams_are_rejected(diagram, message):
+    """Test syntax Mermaid would reject fails here with the line it is on"""
+    with pytest.raises(MermaidSyntaxError) as error:
+        parse_flowchart(diagram)
+    assert message in str(error.value)
+    assert flowchart_graph(diagram) is None
@@ -1,12 +1,12 @@
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from backend.models import Base, Project
-from backend.database import get_db
+from backend.models import Base, Project, ProjectArtifact, migrate_legacy_artifacts
+from backend.database import init_db
 
 # Test database setup
 SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///./test.db"
@@ -91,4 +91,38 @@ def test_delete_project(db):
     
     # Verify deletion
     deleted = db.query(Project).filter_by(id=project_id).first()
-    assert deleted is None
\ No newline at end of file
+    assert deleted is None
+
+def test_artifacts_stored_in_own_table(db):
+    """Test artifacts are separate rows and are removed with their project"""
+    project = Project(name="Split", description="Artifacts table", site_maps=[{"pages": []}], ratings={"a": 1})
+    db.add(project)
+    db.commit()
+    
+    kinds = {a.kind for a in db.query(ProjectArtifact).filter_by(project_id=project.id)}
+    assert kinds == {"site_maps", "ratings"}
+    
+    db.delete(project)
+    db.commit()
+    assert db.query(ProjectArtifact).count() == 0
+
+def test_migrate_legacy_artifacts():
+    """Test artifacts in the old JSON columns are copied into project_artifacts"""
+    legacy_engine = create_engine("sqlite://")
+    with legacy_engine.begin() as conn:
+        conn.execute(text("CREATE TABLE projects (id VARCHAR PRIMARY KEY, name VARCHAR NOT NULL, description TEXT NOT NULL, "
+                          "site_maps JSON, mermaid_diagrams JSON, backend_diagrams JSON, ratings JSON, "
+                          "created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME)"))
+        conn.execute(text("INSERT INTO projects (id, name, description, site_maps, mermaid_diagrams) "
+                          "VALUES ('old', 'Old', 'Legacy', '[{\"pages\": []}]', '[\"graph TD\"]')"))
+    # The upgrade path: new tables and columns, then the artifact copy
+    init_db(legacy_engine)
+    migrate_legacy_artifacts(legacy_engine)  # Safe to rerun
+    
+    session = sessionmaker(bind=legacy_engine)()
+    project = session.query(Project).filter_by(id="old").one()
+    assert project.site_maps == [{"pages": []}]
+    assert project.mermaid_diagrams == ["graph TD"]
+    assert project.backend_diagrams == []
+    assert session.query(ProjectArtifact).count() == 2
+    session.close()
@@ -0,0 +1,74 @@
+import pytest
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.pipeline import Pipeline, PipelineError, Stage
+
+def sleeper(value, delay, log=None, name=None):
+    async def run(deps):
+        if log is not None:
+            log.append(("start", name))
+        await asyncio.sleep(delay)
+        if log is not None:
+            log.append(("end", name))
+        return value(deps) if callable(value) else value
+    return run
+
+@pytest.mark.asyncio
+async def test_independent_stages_run_in_parallel():
+    """Test that a stage without dependencies starts alongside the root"""
+    log = []
+    pipeline = Pipeline([
+        Stage("sitemap", sleeper(["map"], 0.1, log, "sitemap")),
+        Stage("frontend", sleeper(lambda deps: deps["sitemap"] + ["diagram"], 0.05, log, "frontend"), depends_on=["sitemap"]),
+        Stage("backend", sleeper(["backend"], 0.1, log, "backend")),
+    ])
+    
+    outcome = await pipeline.run()
+    
+    assert outcome.results == {"sitemap": ["map"], "frontend": ["map", "diagram"], "backend": ["backend"]}
+    # backend starts before sitemap finishes; frontend waits for sitemap
+    assert log.index(("start", "backend")) < log.index(("end", "sitemap"))
+    assert log.index(("end", "sitemap")) < log.index(("start", "frontend"))
+    # Critical path is sitemap -> frontend, not the sum of all stages
+    assert outcome.total < 0.22
+    assert set(outcome.timings) == {"sitemap", "frontend", "backend"}
+    assert outcome.timings["frontend"].started >= outcome.timings["sitemap"].duration
+
+@pytest.mark.asyncio
+async def test_stage_failure_cancels_remaining_stages():
+    """Test that a failing stage aborts the pipeline"""
+    cancelled = asyncio.Event()
+    
+    async def slow(deps):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+    
+    async def broken(deps):
+        raise RuntimeError("boom")
+    
+    pipeline = Pipeline([Stage("slow", slow), Stage("broken", broken)])
+    
+    with pytest.raises(PipelineError) as exc_info:
+        await pipeline.run()
+    
+    assert exc_info.value.stage == "broken"
+    assert str(exc_info.value) == "boom"
+    assert cancelled.is_set()
+
+def test_invalid_graphs_rejected():
+    """Test validation of unknown dependencies and cycles"""
+    async def noop(deps):
+        return None
+    
+    with pytest.raises(ValueError):
+        Pipeline([Stage("a", noop, depends_on=["missing"])])
+    
+    with pytest.raises(ValueError):
+        Pipeline([Stage("a", noop, depends_on=["b"]), Stage("b", noop, depends_on=["a"])])
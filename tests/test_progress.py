@@ -0,0 +1,56 @@
+import pytest
+import time
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.progress import ProgressEstimator, ProgressTracker, RollingStats
+
+def test_rolling_percentiles():
+    """Test interpolated percentiles over a bounded window"""
+    stats = RollingStats(window=5)
+    assert stats.percentile(50) is None
+    for value in [100, 1, 2, 3, 4, 5]:
+        stats.add(value)
+    # The oldest sample (100) fell out of the window
+    assert len(stats) == 5
+    assert stats.percentile(50) == 3
+    assert stats.percentile(0) == 1
+    assert stats.percentile(100) == 5
+    assert stats.percentile(95) == pytest.approx(4.8)
+
+def test_expected_uses_defaults_until_enough_samples():
+    """Test fallback to prior durations for unmeasured stages"""
+    estimator = ProgressEstimator(defaults={"stage:sitemap": 30.0})
+    assert estimator.expected("stage:sitemap") == 30.0
+    for seconds in [2.0, 4.0, 6.0]:
+        estimator.record("stage:sitemap", seconds)
+    assert estimator.expected("stage:sitemap") == 4.0
+    assert estimator.snapshot()["stage:sitemap"]["samples"] == 3
+
+def test_tracker_progress_and_eta_follow_the_dag():
+    """Test that progress is time-weighted and ETA follows the critical path"""
+    estimator = ProgressEstimator(defaults={"stage:a": 10.0, "stage:b": 10.0, "stage:c": 20.0})
+    tracker = ProgressTracker(estimator, {"a": [], "b": ["a"], "c": []})
+    
+    assert tracker.progress() == 0
+    # a -> b (20s) runs alongside c (20s)
+    assert tracker.eta() == 20.0
+    
+    tracker.start("a")
+    tracker.start("c")
+    tracker.finish("a")
+    tracker.finish("c", record=False)
+    assert tracker.progress() == 75
+    assert tracker.eta() == 10.0
+    assert "stage:a" in estimator.stats
+    assert "stage:c" not in estimator.stats
+
+def test_tracker_never_reports_complete_while_running():
+    """Test that overrunning stages stay below 100 percent"""
+    estimator = ProgressEstimator(defaults={"stage:a": 0.01})
+    tracker = ProgressTracker(estimator, {"a": []})
+    tracker.start("a")
+    time.sleep(0.03)
+    assert tracker.progress() == 95
+    assert 0 <= tracker.eta() <= 0.1
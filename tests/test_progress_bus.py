@@ -0,0 +1,61 @@
+import pytest
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.connections import progress_event
+from backend.progress_bus import InProcessBus, SQLiteBus, create_progress_bus
+
+class Inbox:
+    def __init__(self):
+        self.events = []
+    
+    async def deliver(self, event):
+        self.events.append(event)
+
+@pytest.mark.asyncio
+async def test_in_process_bus_delivers_immediately():
+    """Test the default bus hands events straight to the local manager"""
+    inbox = Inbox()
+    bus = create_progress_bus(inbox.deliver, "memory")
+    assert isinstance(bus, InProcessBus)
+    
+    await bus.publish(progress_event("p1", "sitemap", "Working", 10))
+    assert [e["message"] for e in inbox.events] == ["Working"]
+
+@pytest.mark.asyncio
+async def test_sqlite_bus_reaches_other_workers(tmp_path):
+    """Test events published by one worker are delivered by the others, once each"""
+    path = str(tmp_path / "bus.db")
+    inboxes = [Inbox(), Inbox()]
+    buses = [SQLiteBus(inbox.deliver, path=path, poll_interval=0.01) for inbox in inboxes]
+    for bus in buses:
+        await bus.start()
+    try:
+        await buses[0].publish(progress_event("p1", "sitemap", "From worker A", 10))
+        await buses[1].publish(progress_event("p1", "backend", "From worker B", 20))
+        await asyncio.sleep(0.1)
+    finally:
+        for bus in buses:
+            await bus.stop()
+    
+    for inbox in inboxes:
+        assert sorted(e["message"] for e in inbox.events) == ["From worker A", "From worker B"]
+
+@pytest.mark.asyncio
+async def test_sqlite_bus_skips_history(tmp_path):
+    """Test a worker starting later does not replay old events"""
+    path = str(tmp_path / "bus.db")
+    early = SQLiteBus(Inbox().deliver, path=path, poll_interval=0.01)
+    await early.start()
+    await early.publish(progress_event("p1", "sitemap", "Old news", 10))
+    await early.stop()
+    
+    inbox = Inbox()
+    late = SQLiteBus(inbox.deliver, path=path, poll_interval=0.01)
+    await late.start()
+    await asyncio.sleep(0.05)
+    await late.stop()
+    assert inbox.events == []
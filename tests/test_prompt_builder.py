@@ -0,0 +1,58 @@
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.prompt_builder import compact_json, count_tokens, fit_sitemap, sitemap_outline
+
+def make_site_map(pages=6, children=4, grandchildren=3):
+    return {"pages": [
+        {
+            "name": f"Page {p}",
+            "path": f"/p{p}",
+            "description": "A page with a reasonably long description of what it is for.",
+            "features": ["Search", "Filters", "Pagination"],
+            "children": [
+                {
+                    "name": f"Child {p}.{c}",
+                    "path": f"/p{p}/c{c}",
+                    "children": [{"name": f"Leaf {p}.{c}.{g}", "path": f"/p{p}/c{c}/g{g}"} for g in range(grandchildren)]
+                }
+                for c in range(children)
+            ]
+        }
+        for p in range(pages)
+    ]}
+
+def test_outline_is_much_smaller_than_indented_json():
+    """Test the outline keeps every page while dropping JSON syntax"""
+    site_map = make_site_map()
+    outline = sitemap_outline(site_map)
+    
+    assert outline.splitlines()[0] == ("- Page 0 (/p0): A page with a reasonably long description of what it is for. "
+                                       "[Search; Filters; Pagination]")
+    assert "    - Leaf 0.0.0 (/p0/c0/g0)" in outline.splitlines()
+    assert len(outline.splitlines()) == 6 * (1 + 4 * (1 + 3))
+    assert count_tokens(outline) < count_tokens(json.dumps(site_map, indent=2)) / 2
+    assert compact_json({"a": [1, 2]}) == '{"a":[1,2]}'
+
+def test_outline_summarizes_deep_children():
+    """Test levels below max_depth collapse into a page count"""
+    outline = sitemap_outline(make_site_map(pages=1), max_depth=0, details=False, features=False)
+    assert outline.splitlines() == ["- Page 0 (/p0)", "  - (+16 more pages)"]
+
+def test_fit_sitemap_respects_budget():
+    """Test detail is dropped step by step until the outline fits"""
+    site_map = make_site_map()
+    assert fit_sitemap(site_map, budget=10000) == sitemap_outline(site_map)
+    
+    medium = fit_sitemap(site_map, budget=400)
+    assert count_tokens(medium) <= 400
+    assert "Search" not in medium and "Page 5" in medium
+    
+    tiny = fit_sitemap(site_map, budget=20)
+    assert tiny.startswith("- Page 0 (/p0)")
+    assert tiny.splitlines()[-1].endswith("more top-level pages)")
+    
+    assert fit_sitemap({}, budget=10) == ""
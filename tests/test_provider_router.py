@@ -0,0 +1,171 @@
+import pytest
+import asyncio
+from unittest.mock import Mock
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.llm_providers import Completion
+from backend.provider_router import CircuitBreaker, NoProviderAvailable, ProviderRouter, request_queued, request_sent
+from backend.rate_limiter import ProviderLimiter
+
+def make_provider(name):
+    provider = Mock()
+    provider.name = name
+    provider.model = f"{name}-test"
+    return provider
+
+def make_completion(provider, text="answer", stop_reason="end_turn"):
+    return Completion(text=text, provider=provider.name, model=provider.model, stop_reason=stop_reason)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_breaker_opens_on_error_rate_and_probes():
+    """Test the breaker trips on failures, then admits one half-open probe"""
+    clock = FakeClock()
+    breaker = CircuitBreaker("openai", window=4, min_calls=4, failure_rate=0.5, open_seconds=10, clock=clock)
+    breaker.record_success(1.0)
+    breaker.record_failure()
+    breaker.record_success(1.0)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now = 11
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one probe at a time
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 22
+    assert breaker.allow()
+    breaker.record_success(1.0)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+def test_breaker_counts_slow_calls():
+    """Test calls slower than the threshold count against the provider"""
+    breaker = CircuitBreaker("openai", window=3, min_calls=3, failure_rate=1.0, slow_call_seconds=5)
+    for _ in range(3):
+        breaker.record_success(6.0)
+    assert breaker.state == CircuitBreaker.OPEN
+
+@pytest.mark.asyncio
+async def test_falls_back_and_skips_open_circuit():
+    """Test a failing primary falls back, and is skipped once its circuit opens"""
+    primary, secondary = make_provider("openai"), make_provider("anthropic")
+    router = ProviderRouter(hedging=False,
+                            breaker_factory=lambda name: CircuitBreaker(name, min_calls=2, failure_rate=1.0))
+    calls = []
+
+    async def attempt(provider, hedged):
+        calls.append(provider.name)
+        if provider is primary:
+            raise RuntimeError("503")
+        return make_completion(provider)
+
+    for _ in range(3):
+        completion = await router.call([primary, secondary], attempt)
+        assert completion.provider == "anthropic"
+
+    assert calls == ["openai", "anthropic", "openai", "anthropic", "anthropic"]
+    assert router.breaker("openai").state == CircuitBreaker.OPEN
+    assert router.stats["short_circuited"] == 1
+
+@pytest.mark.asyncio
+async def test_empty_response_falls_back():
+    """Test an empty answer is treated as a failure"""
+    primary, secondary = make_provider("openai"), make_provider("anthropic")
+    router = ProviderRouter(hedging=False)
+
+    async def attempt(provider, hedged):
+        return make_completion(provider, text="" if provider is primary else "answer")
+
+    completion = await router.call([primary, secondary], attempt)
+    assert completion.text == "answer"
+
+    async def always_empty(provider, hedged):
+        return make_completion(provider, text="")
+
+    with pytest.raises(NoProviderAvailable):
+        await router.call([primary, secondary], always_empty)
+
+@pytest.mark.asyncio
+async def test_hedges_past_p95_and_cancels_loser():
+    """Test a slow primary is raced against the secondary and cancelled when it loses"""
+    primary, secondary = make_provider("openai"), make_provider("anthropic")
+    router = ProviderRouter(hedging=True, hedge_percentile=95, hedge_min_samples=3)
+
+    async def fast(provider, hedged):
+        return make_completion(provider)
+
+    # No hedging until the primary has a latency history for the task
+    for _ in range(3):
+        await router.call([primary, secondary], fast, task="sitemap")
+    assert router.hedge_delay("openai", "sitemap") is not None
+    assert router.hedge_delay("openai", "frontend") is None
+
+    cancelled = asyncio.Event()
+    seen = []
+
+    async def slow_primary(provider, hedged):
+        seen.append((provider.name, hedged))
+        if provider is primary:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        return make_completion(provider)
+
+    completion = await asyncio.wait_for(router.call([primary, secondary], slow_primary, task="sitemap"), 1)
+
+    assert completion.provider == "anthropic"
+    assert seen == [("openai", False), ("anthropic", True)]
+    assert cancelled.is_set()
+    assert router.stats["hedged"] == 1
+    assert router.stats["hedge_wins"] == 1
+    # The cancelled loser is neither a success nor a failure
+    assert list(router.breaker("openai").outcomes) == [False, False, False]
+
+@pytest.mark.asyncio
+async def test_time_queued_in_our_limiter_is_not_provider_latency():
+    """Test waiting for our own rate limiter neither trips the breaker nor triggers a hedge"""
+    primary, secondary = make_provider("openai"), make_provider("anthropic")
+    router = ProviderRouter(hedging=True, hedge_min_samples=1,
+                            breaker_factory=lambda name: CircuitBreaker(name, min_calls=2, slow_call_seconds=0.5))
+    limiter = ProviderLimiter("openai:test", max_in_flight=1)
+    seen = []
+    duration = 0.3
+
+    async def attempt(provider, hedged):
+        seen.append((provider.name, hedged))
+
+        async def request():
+            request_sent()
+            await asyncio.sleep(duration)
+            return make_completion(provider)
+
+        request_queued()
+        return await limiter.call(request, tokens=1)
+
+    # Seeds a 0.3s latency history, so later calls would hedge after ~0.3s
+    await router.call([primary, secondary], attempt, task="sitemap")
+    # The last of four 0.2s requests queues 0.6s behind the others; only its own 0.2s counts
+    duration = 0.2
+    await asyncio.gather(*(router.call([primary, secondary], attempt, task="sitemap") for _ in range(4)))
+
+    assert router.breaker("openai").state == CircuitBreaker.CLOSED
+    assert not any(bad for bad in router.breaker("openai").outcomes)
+    assert router.stats["hedged"] == 0
+    assert seen == [("openai", False)] * 5
+    assert max(router.latencies[("openai", "sitemap")].samples) < 0.45
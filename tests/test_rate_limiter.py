@@ -0,0 +1,164 @@
+import pytest
+import asyncio
+import time
+from types import SimpleNamespace
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.rate_limiter import ProviderLimiter, estimate_tokens, retry_after, transient_delay
+
+class RateLimitError(Exception):
+    def __init__(self, headers):
+        super().__init__("429 Too Many Requests")
+        self.status_code = 429
+        self.response = SimpleNamespace(headers=headers)
+
+def test_estimate_tokens_counts_prompt_and_output():
+    """Test the estimate covers the prompt and the reserved output"""
+    assert estimate_tokens("x" * 400, 1000) == 1101
+    assert estimate_tokens("", 0) == 1
+
+def test_retry_after_parsing():
+    """Test Retry-After headers are read in seconds, milliseconds or as a date"""
+    assert retry_after(RateLimitError({"retry-after": "3"})) == 3.0
+    assert retry_after(RateLimitError({"retry-after-ms": "250", "retry-after": "1"})) == 0.25
+    assert retry_after(RateLimitError({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert retry_after(RateLimitError({})) > 0
+    assert retry_after(RuntimeError("boom")) is None
+
+@pytest.mark.asyncio
+async def test_max_in_flight_queues_in_order():
+    """Test concurrency is capped and queued callers run in arrival order"""
+    limiter = ProviderLimiter("openai:test", max_in_flight=2)
+    in_flight = 0
+    peak = 0
+    order = []
+
+    async def request(i):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        order.append(i)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        return i
+
+    results = await asyncio.gather(*(limiter.call(lambda i=i: request(i), tokens=1) for i in range(6)))
+
+    assert results == list(range(6))
+    assert peak == 2
+    assert order == list(range(6))
+    assert limiter.in_flight == 0
+    assert limiter.stats["queued"] == 4
+
+@pytest.mark.asyncio
+async def test_token_budget_spreads_requests():
+    """Test the tokens-per-period budget delays requests that would exceed it"""
+    limiter = ProviderLimiter("anthropic:test", max_in_flight=0, tpm=100, period=0.2)
+
+    async def request():
+        return time.monotonic()
+
+    started = time.monotonic()
+    stamps = [await limiter.call(request, tokens=60) for _ in range(3)]
+
+    # 100 tokens refill over 0.2s: the 2nd request waits for 20 tokens, the 3rd for 60 more
+    assert stamps[0] - started < 0.02
+    assert stamps[1] - started >= 0.03
+    assert stamps[2] - started >= 0.15
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_and_retries():
+    """Test a 429 pauses the queue for Retry-After, then retries the request"""
+    limiter = ProviderLimiter("openai:test", retries=1)
+    calls = []
+
+    async def request():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise RateLimitError({"retry-after-ms": "50"})
+        return "ok"
+
+    assert await limiter.call(request, tokens=1) == "ok"
+    assert calls[1] - calls[0] >= 0.045
+    assert limiter.stats["rate_limited"] == 1
+
+    async def always_limited():
+        raise RateLimitError({"retry-after-ms": "1"})
+
+    with pytest.raises(RateLimitError):
+        await limiter.call(always_limited, tokens=1)
+    assert limiter.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_unused_reservation_is_returned():
+    """Test the token budget is reconciled with what a request actually used"""
+    limiter = ProviderLimiter("openai:test", max_in_flight=0, tpm=1000, period=60)
+
+    async def request():
+        return 150
+
+    # Reserves prompt plus max output, but only 150 tokens were used
+    assert await limiter.call(request, tokens=900, usage=lambda used: used) == 150
+    assert limiter.tokens.level == pytest.approx(850, abs=1)
+    # Without usage the reservation counts in full
+    await limiter.call(request, tokens=100)
+    assert limiter.tokens.level == pytest.approx(750, abs=1)
+
+def test_transient_failures_back_off():
+    """Test timeouts and server errors are retried with a growing backoff, other errors are not"""
+    class ServerError(Exception):
+        status_code = 503
+
+    class BadRequest(Exception):
+        status_code = 400
+
+    assert transient_delay(ServerError(), 1) == 2 * transient_delay(ServerError(), 0)
+    assert transient_delay(BadRequest(), 0) is None
+    assert transient_delay(RateLimitError({}), 0) is None
+
+@pytest.mark.asyncio
+async def test_transient_failure_is_retried_without_pausing_the_queue(monkeypatch):
+    """Test a 5xx is retried once by the limiter and a 429 returns its tokens"""
+    monkeypatch.setattr("backend.rate_limiter.LLM_RETRY_BACKOFF_SECONDS", 0.01)
+    limiter = ProviderLimiter("openai:test", retries=1, tpm=1000, period=60)
+    calls = []
+
+    class ServerError(Exception):
+        status_code = 503
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ServerError()
+        return "ok"
+
+    assert await limiter.call(flaky, tokens=10) == "ok"
+    assert len(calls) == 2
+    assert limiter.stats["retried"] == 1
+    assert limiter.paused_until == 0.0
+
+    async def limited():
+        raise RateLimitError({"retry-after-ms": "1"})
+
+    level = limiter.tokens.level
+    with pytest.raises(RateLimitError):
+        await limiter.call(limited, tokens=100)
+    # Rejected attempts give their reservation back
+    assert limiter.tokens.level == pytest.approx(level, abs=1)
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_frees_its_slot():
+    """Test a caller cancelled while waiting or running never leaks a slot"""
+    limiter = ProviderLimiter("openai:test", max_in_flight=1)
+    running = asyncio.create_task(limiter.call(lambda: asyncio.sleep(1), tokens=1))
+    waiting = asyncio.create_task(limiter.call(lambda: asyncio.sleep(0), tokens=1))
+    await asyncio.sleep(0.01)
+    running.cancel()
+    waiting.cancel()
+    await asyncio.gather(running, waiting, return_exceptions=True)
+
+    assert limiter.in_flight == 0
+    assert await limiter.call(lambda: asyncio.sleep(0, result="free"), tokens=1) == "free"
@@ -0,0 +1,42 @@
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.schemas import Sitemap, page_errors, response_schema, validate_sitemap
+
+def test_validate_sitemap_fills_defaults():
+    """Test a valid sitemap is normalized to every documented field"""
+    parsed, errors = validate_sitemap({"pages": [{"name": "Home", "path": "/", "children": [{"name": "Team"}]}]})
+    
+    assert errors == []
+    assert parsed == {"pages": [{
+        "name": "Home", "path": "/", "description": "", "features": [],
+        "children": [{"name": "Team", "path": "", "description": "", "features": [], "children": []}],
+    }]}
+
+def test_validate_sitemap_reports_locations():
+    """Test each error names where in the document it is"""
+    parsed, errors = validate_sitemap({"pages": [{"name": "Home", "path": " "}, {"name": "Shop", "features": "cart"}]})
+    
+    assert parsed is None
+    assert errors == [
+        "pages.0.path: Value error, must not be blank",
+        "pages.1.path: Field required",
+        "pages.1.features: Input should be a valid list",
+    ]
+    assert validate_sitemap({"pages": []})[1][0].startswith("pages: List should have at least 1 item")
+    assert page_errors({"name": "Home", "path": "/"}) is None
+
+def test_response_schema_is_strict_and_bounded():
+    """Test the provider schema has no references, requires every field and stops at max_depth"""
+    schema = response_schema(Sitemap, max_depth=2)
+    
+    assert "$ref" not in json.dumps(schema) and "$defs" not in schema
+    page = schema["properties"]["pages"]["items"]
+    assert page["required"] == ["name", "path", "description", "features", "children"]
+    assert page["additionalProperties"] is False
+    child = page["properties"]["children"]["items"]
+    assert "children" not in child["properties"]
+    assert child["required"] == ["name", "path", "description", "features"]
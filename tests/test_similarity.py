@@ -0,0 +1,79 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.similarity import MinHash, SimilarityIndex, SIMILARITY_THRESHOLD, features
+
+# Descriptions of the same kind of project, worded differently
+SIMILAR = [
+    ("An online store for shoes", "E-commerce site selling shoes"),
+    ("An online store for shoes with cart, checkout and reviews",
+     "Online store for shoes with a cart, checkout, and customer reviews"),
+]
+# Projects sharing generic features or phrasing but not their subject
+UNRELATED = [
+    ("Online store for selling handmade jewelry with user accounts, wishlists and reviews",
+     "Online store for selling handmade furniture with user accounts, wishlists and reviews"),
+    ("A blog for developers with tutorials, code snippets and comments",
+     "A blog for chefs with recipes, cooking tips and comments"),
+    ("An online store for shoes with cart, checkout and reviews", "Fleet telemetry dashboard for delivery trucks"),
+]
+
+def test_features_ignore_case_punctuation_filler_and_inflection():
+    """Test that normalization removes noise and folds synonyms before hashing"""
+    assert features("An Online STORE, for shoes!") == features("shop shoe")
+    assert features("e-commerce site selling shoes") == features("shoe store")
+    assert features("") == set()
+
+def test_topic_words_outweigh_generic_features():
+    """Test that words naming the subject count for more than common site features"""
+    assert len(features("jewelry")) > len(features("reviews"))
+
+def test_signature_similarity_tracks_jaccard():
+    """Test that identical texts match fully and unrelated texts barely match"""
+    minhash = MinHash(num_perm=128)
+    a = minhash.signature(features("An online store for shoes with cart and checkout"))
+    b = minhash.signature(features("An online store for shoes with cart and checkout"))
+    c = minhash.signature(features("Internal dashboard for hospital staff scheduling"))
+    assert MinHash.similarity(a, b) == 1.0
+    assert MinHash.similarity(a, c) < 0.2
+
+def test_default_threshold_separates_paraphrases_from_unrelated_projects():
+    """Test the default threshold against pinned pairs that must and must not match"""
+    for stored, new in SIMILAR:
+        index = SimilarityIndex()
+        index.add("stored", stored)
+        match = index.best_match(new)
+        assert match is not None, (stored, new)
+        assert match[1] >= SIMILARITY_THRESHOLD + 0.1
+    for stored, new in UNRELATED:
+        index = SimilarityIndex()
+        index.add("stored", stored)
+        assert index.best_match(new) is None, (stored, new)
+        assert not index.query(new, threshold=SIMILARITY_THRESHOLD - 0.1)
+
+def test_index_finds_near_duplicates():
+    """Test that reworded descriptions are ranked against the other stored projects"""
+    index = SimilarityIndex()
+    index.add("shoes", "An online store for shoes with cart, checkout and reviews")
+    index.add("blog", "A blog platform for travel writers with comments")
+    
+    match = index.best_match("Online store for shoes with a cart, checkout, and customer reviews")
+    assert match is not None
+    assert match[0] == "shoes"
+    
+    assert index.best_match("Fleet telemetry dashboard for delivery trucks") is None
+
+def test_index_remove_and_load():
+    """Test removing entries and rebuilding from rows"""
+    index = SimilarityIndex()
+    index.add("shoes", "An online store for shoes")
+    index.remove("shoes")
+    assert len(index) == 0
+    assert index.best_match("An online store for shoes", threshold=0.5) is None
+    assert all(not bucket for bucket in index.buckets)
+    
+    index.load([("a", "Recipe sharing community"), ("b", "Recipe sharing community for bakers")])
+    assert index.loaded
+    assert len(index) == 2
+    assert index.best_match("Recipe sharing community", threshold=0.9)[0] == "a"
@@ -0,0 +1,53 @@
+import pytest
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.streaming import MermaidStream, SitemapStream
+
+def chunks(text, size=7):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+@pytest.mark.asyncio
+async def test_sitemap_stream_emits_growing_page_lists():
+    """Test partial sitemaps are emitted per page and completion stops the stream"""
+    emitted = []
+    async def emit(content):
+        emitted.append(content)
+    stream = SitemapStream(emit)
+    text = json.dumps({"pages": [{"name": "Home", "path": "/"}, {"name": "About", "path": "/about"}, {"name": "Shop", "path": "/shop"}]}) + " trailing prose"
+    
+    done_at = None
+    for i, chunk in enumerate(chunks(text)):
+        if await stream.feed(chunk):
+            done_at = i
+            break
+    
+    assert done_at is not None
+    assert [len(e["pages"]) for e in emitted] == [1, 2, 3]
+    assert emitted[-1]["pages"][1] == {"name": "About", "path": "/about"}
+    
+    stream.reset()
+    assert stream.parser.items == []
+
+@pytest.mark.asyncio
+async def test_mermaid_stream_emits_whole_lines():
+    """Test diagram snapshots only contain finished lines and stop at the end marker"""
+    emitted = []
+    async def emit(content):
+        emitted.append(content)
+    stream = MermaidStream(emit, min_interval=0)
+    text = "<MERMAID_START>\nflowchart TB\n    A[Home] --> B[About]\n    B --> C[Contact]\n<MERMAID_END>"
+    
+    finished = False
+    for chunk in chunks(text, 5):
+        finished = await stream.feed(chunk)
+        if finished:
+            break
+    
+    assert finished
+    assert emitted
+    assert emitted[-1] == "flowchart TB\n    A[Home] --> B[About]\n    B --> C[Contact]"
+    assert all(not line.endswith("[") for e in emitted for line in e.split("\n"))
@@ -0,0 +1,107 @@
+import gzip
+import json
+import logging
+import queue
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from backend.structured_log import (DroppingQueueHandler, LogWriter, SamplingFilter, get_logger, record_raw_response,
+                                    rotating_handler)
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def start_writer(tmp_path):
+    writer = LogWriter(log_dir=str(tmp_path), level="DEBUG", console=False)
+    writer.start()
+    return writer
+
+
+def test_records_are_written_as_json_lines(tmp_path):
+    writer = start_writer(tmp_path)
+    log = get_logger("test")
+    log.info("Sitemap parsed", project_id="p1", pages=5)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        log.exception("Job failed", job_id="j1")
+    writer.stop()
+
+    first, second = read_lines(tmp_path / "app.jsonl")
+    assert first["msg"] == "Sitemap parsed"
+    assert first["level"] == "INFO"
+    assert first["logger"] == "architect.test"
+    assert first["project_id"] == "p1" and first["pages"] == 5
+    assert second["job_id"] == "j1"
+    assert "ValueError: boom" in second["exc"]
+
+
+def test_raw_responses_go_to_their_own_file(tmp_path):
+    writer = start_writer(tmp_path)
+    record_raw_response('{"pages": []}', project_id="p1", task="sitemap", provider="openai")
+    get_logger("test").info("Response received")
+    writer.stop()
+
+    [raw] = read_lines(tmp_path / "raw_responses.jsonl")
+    assert raw["msg"] == '{"pages": []}'
+    assert raw["task"] == "sitemap"
+    assert [line["msg"] for line in read_lines(tmp_path / "app.jsonl")] == ["Response received"]
+
+
+def test_sampling_keeps_warnings():
+    sampler = SamplingFilter(0.0)
+    info = logging.LogRecord("architect.test", logging.INFO, __file__, 1, "info", None, None)
+    warning = logging.LogRecord("architect.test", logging.WARNING, __file__, 1, "warning", None, None)
+    assert not sampler.filter(info)
+    assert sampler.filter(warning)
+    assert SamplingFilter(1.0).filter(info)
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    record = logging.LogRecord("architect.test", logging.INFO, __file__, 1, "message", None, None)
+    handler.handle(record)
+    handler.handle(record)
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 1
+
+
+def test_rotated_segments_are_compressed(tmp_path):
+    path = tmp_path / "raw_responses.jsonl"
+    handler = rotating_handler(str(path), max_bytes=200, backup_count=2)
+    logger = logging.getLogger("architect_test_rotation")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for i in range(10):
+            logger.warning("x" * 100, extra={"fields": {"i": i}})
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["raw_responses.jsonl", "raw_responses.jsonl.1.gz",
+                                                         "raw_responses.jsonl.2.gz"]
+    with gzip.open(tmp_path / "raw_responses.jsonl.1.gz", "rt") as f:
+        assert json.loads(f.readline())["i"] == 8
+    assert read_lines(path)[-1]["i"] == 9
+
+
+def test_writer_reports_dropped_records(tmp_path):
+    writer = start_writer(tmp_path)
+    writer.handler.dropped = 2
+    assert writer.stats() == {"queued": 0, "dropped": 2}
+    writer.stop()
+
+def test_writer_defaults_to_the_configured_log_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr("backend.structured_log.LOG_DIR", str(tmp_path / "configured"))
+    writer = LogWriter(console=False)
+    writer.start()
+    get_logger("test").info("Configured")
+    writer.stop()
+
+    assert [line["msg"] for line in read_lines(tmp_path / "configured" / "app.jsonl")] == ["Configured"]
@@ -0,0 +1,102 @@
+import pytest
+import asyncio
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from models import Base, GenerationJob
+from write_batcher import WriteBatcher
+
+# Test database setup
+SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///./test_write_batcher.db"
+engine = create_engine(SQLALCHEMY_TEST_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture(autouse=True)
+def setup_and_teardown():
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+def add_job(job_id):
+    return lambda db: db.add(GenerationJob(id=job_id, kind="create_project", project_id=job_id, payload={}))
+
+def count_jobs():
+    db = TestingSessionLocal()
+    try:
+        return db.query(GenerationJob).count()
+    finally:
+        db.close()
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_share_commits():
+    """Test writes arriving together are committed in a few grouped transactions"""
+    writer = WriteBatcher(TestingSessionLocal, max_batch=16, interval=0.05)
+    await writer.start()
+    try:
+        await asyncio.gather(*[writer.write(add_job(f"job-{i}")) for i in range(40)])
+        # Acknowledged writes are already durable
+        assert count_jobs() == 40
+    finally:
+        await writer.stop()
+    
+    assert writer.stats["writes"] == 40
+    assert writer.stats["batches"] == 3
+
+@pytest.mark.asyncio
+async def test_keyed_writes_coalesce():
+    """Test a queued write is replaced by a newer one with the same key"""
+    writer = WriteBatcher(TestingSessionLocal, interval=0.05)
+    await writer.write(add_job("job-1"))  # Not started yet: written straight through
+    await writer.start()
+    
+    def set_message(message):
+        def update(db):
+            db.query(GenerationJob).filter_by(id="job-1").one().message = message
+        return update
+    
+    try:
+        futures = [writer.submit(set_message(f"Step {i}"), key=("progress", "job-1")) for i in range(5)]
+        await asyncio.gather(*futures)
+    finally:
+        await writer.stop()
+    
+    assert writer.stats["coalesced"] == 4
+    assert writer.stats["writes"] == 1
+    db = TestingSessionLocal()
+    assert db.query(GenerationJob).filter_by(id="job-1").one().message == "Step 4"
+    db.close()
+
+@pytest.mark.asyncio
+async def test_failing_write_does_not_fail_batch():
+    """Test one bad write is isolated from the rest of its batch"""
+    writer = WriteBatcher(TestingSessionLocal, interval=0.05)
+    await writer.start()
+    
+    def broken(db):
+        raise ValueError("bad write")
+    
+    try:
+        results = await asyncio.gather(
+            writer.write(add_job("job-a")), writer.write(broken), writer.write(add_job("job-b")),
+            return_exceptions=True
+        )
+    finally:
+        await writer.stop()
+    
+    assert isinstance(results[1], ValueError)
+    assert count_jobs() == 2
+
+@pytest.mark.asyncio
+async def test_stop_flushes_queued_writes():
+    """Test writes queued at shutdown are still committed"""
+    writer = WriteBatcher(TestingSessionLocal, interval=10)
+    await writer.start()
+    future = writer.submit(add_job("job-late"))
+    await writer.stop()
+    
+    assert future.done() and future.exception() is None
+    assert count_jobs() == 1